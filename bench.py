@@ -0,0 +1,352 @@
+"""
+Бенчмарк конвейера конвертации.
+
+Генерирует синтетические исходники (ffmpeg testsrc + sine), прогоняет их через
+convert_file и ConverterService с разными профилями и числом потоков и пишет
+результаты в JSON, чтобы сравнивать версии между собой:
+
+    python bench.py --quick -o bench_new.json
+    python bench.py --compare bench_old.json bench_new.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional
+
+import psutil
+
+from videoconverter.converter import ConversionOptions, convert_file
+from videoconverter.models import FormatProfile, Job, JobState, Settings
+from videoconverter.probe import ProbeCache
+from videoconverter.service import ConverterService
+from videoconverter.settings_store import SettingsStore
+
+# Профили кодирования: разрешение и FPS не заданы — сохраняются как у исходника
+PROFILES: Dict[str, FormatProfile] = {
+    "h264-veryfast": FormatProfile(video_codec="h264", preset="veryfast", resolution="", fps=0, bitrate="2M"),
+    "h264-medium": FormatProfile(video_codec="h264", preset="medium", resolution="", fps=0, bitrate="2M"),
+    "hevc-fast": FormatProfile(video_codec="hevc", preset="fast", resolution="", fps=0, bitrate="2M"),
+    "remux": FormatProfile(format="mkv", video_codec="copy", audio_codec="copy", resolution="", fps=0, bitrate=""),
+}
+DEFAULT_RESOLUTIONS = ["640x360", "1280x720", "1920x1080"]
+DEFAULT_DURATIONS = [5.0, 20.0]
+DEFAULT_WORKERS = [1, 2, 4]
+SAMPLE_INTERVAL = 0.05  # как часто замеряем память процессов ffmpeg
+
+
+@dataclass
+class BenchResult:
+    scenario: str  # convert_file / service / dispatch
+    profile: str
+    resolution: str
+    duration: float  # секунды исходного видео в одном файле
+    files: int
+    workers: int
+    wall_time: float
+    realtime_factor: float  # во сколько раз быстрее реального времени (по всем файлам)
+    cpu_percent: float  # загрузка всей машины процессами ffmpeg
+    peak_rss_mb: float  # пик суммарной памяти процессов ffmpeg
+    queue_overhead_ms: Optional[float] = None  # накладные расходы сервиса на одну задачу
+
+    @property
+    def key(self) -> str:
+        return f"{self.scenario}/{self.profile}/{self.resolution}/{self.duration:g}s/x{self.files}/w{self.workers}"
+
+
+class ChildSampler:
+    """Замер CPU и пиковой памяти дочерних процессов (ffmpeg) за время работы блока with."""
+
+    def __init__(self):
+        self._me = psutil.Process()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self.peak_rss = 0
+        self.cpu_seconds = 0.0
+
+    def _children_cpu(self) -> float:
+        times = self._me.cpu_times()
+        return times.children_user + times.children_system
+
+    def _sample(self) -> None:
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            rss = 0
+            for child in self._me.children(recursive=True):
+                try:
+                    rss += child.memory_info().rss
+                except psutil.Error:
+                    pass  # процесс успел завершиться
+            self.peak_rss = max(self.peak_rss, rss)
+
+    def __enter__(self) -> "ChildSampler":
+        self._cpu_start = self._children_cpu()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        # Время CPU засчитывается процессу-родителю только после wait(), поэтому считаем по завершении
+        self.cpu_seconds = self._children_cpu() - self._cpu_start
+
+
+def generate_source(work_dir: Path, resolution: str, duration: float) -> Path:
+    """Синтетический исходник: тестовая таблица + синус. Уже созданные файлы переиспользуются."""
+    path = work_dir / f"src_{resolution}_{duration:g}s.mp4"
+    if path.exists():
+        return path
+    cmd = [
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"testsrc=size={resolution}:rate=30:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={duration}",
+        "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p",
+        "-c:a", "aac", "-shortest", str(path),
+    ]
+    subprocess.run(cmd, check=True)
+    return path
+
+
+def _options(profile: FormatProfile, output_dir: Path) -> ConversionOptions:
+    return ConversionOptions(
+        target_format=profile.format, output_dir=output_dir, video_bitrate=profile.bitrate or None,
+        resolution=profile.resolution or None, fps=profile.fps or None, video_codec=profile.video_codec,
+        audio_codec=profile.audio_codec, preset=profile.preset or None, crf=profile.crf,
+        copy_video=profile.video_codec == "copy", copy_audio=profile.audio_codec == "copy",
+    )
+
+
+def _result(scenario: str, profile: str, resolution: str, duration: float, files: int, workers: int,
+            wall: float, sampler: ChildSampler, **extra) -> BenchResult:
+    cpus = os.cpu_count() or 1
+    return BenchResult(
+        scenario=scenario, profile=profile, resolution=resolution, duration=duration, files=files,
+        workers=workers, wall_time=round(wall, 3),
+        realtime_factor=round(duration * files / wall, 2) if wall > 0 else 0.0,
+        cpu_percent=round(sampler.cpu_seconds / (wall * cpus) * 100, 1) if wall > 0 else 0.0,
+        peak_rss_mb=round(sampler.peak_rss / 1024 / 1024, 1), **extra,
+    )
+
+
+def bench_convert_file(source: Path, profile_name: str, resolution: str, duration: float,
+                       output_dir: Path) -> BenchResult:
+    """Одно кодирование напрямую через convert_file — базовая линия без сервиса."""
+    options = _options(PROFILES[profile_name], output_dir)
+    with ChildSampler() as sampler:
+        start = time.perf_counter()
+        convert_file(source, options, duration=duration)
+        wall = time.perf_counter() - start
+    return _result("convert_file", profile_name, resolution, duration, 1, 1, wall, sampler)
+
+
+def _run_service(service: ConverterService, jobs: List[Job], timeout: float) -> float:
+    for job in jobs:
+        service.add_job(job)
+    start = time.perf_counter()
+    service.start_processing()
+    deadline = time.monotonic() + timeout
+    while any(job.state in (JobState.QUEUED, JobState.RUNNING) for job in jobs):
+        if time.monotonic() > deadline:
+            service.stop_processing()
+            raise RuntimeError(f"Сервис не обработал {len(jobs)} задач за {timeout:.0f} с")
+        time.sleep(0.01)
+    wall = time.perf_counter() - start
+    failed = [job for job in jobs if job.state != JobState.DONE]
+    if failed:
+        raise RuntimeError(f"Ошибка кодирования {failed[0].source_path.name}: {failed[0].error_message}")
+    return wall
+
+
+def bench_service(source: Path, profile_name: str, resolution: str, duration: float, files: int,
+                  workers: int, output_dir: Path, engine: str = "threads") -> BenchResult:
+    """Пакет одинаковых файлов через ConverterService: масштабирование по числу потоков."""
+    # Копии под разными именами, чтобы у каждой задачи был свой выходной файл
+    sources = [_link_copy(source, f"{source.stem}_copy{i}") for i in range(files)]
+
+    jobs = [Job(source_path=s, output_dir=output_dir, profile=PROFILES[profile_name]) for s in sources]
+    with _isolated_service(source.parent, max_workers=workers, engine=engine) as service, ChildSampler() as sampler:
+        wall = _run_service(service, jobs, timeout=max(600.0, duration * files * 10))
+    return _result(f"service-{engine}", profile_name, resolution, duration, files, workers, wall, sampler)
+
+
+@contextmanager
+def _isolated_service(work_dir: Path, encoder: Optional[Callable[..., None]] = None,
+                      **settings) -> Iterator[ConverterService]:
+    """
+    Сервис со своими настройками без горячей папки и журнала (если не задан journal_path):
+    settings.json пользователя и probe_cache.json в текущем каталоге не влияют на замер.
+    Собирается так же, как в daemon и GUI. После сценария сервис завершается полностью.
+    """
+    settings_path = work_dir / "bench_settings.json"
+    values = dict(output_path=str(work_dir), hot_folder_enabled=False, journal_path="")
+    values.update(settings)
+    if not Settings(**values).save(settings_path):
+        raise RuntimeError(f"Не удалось записать {settings_path}")
+    probe_cache = ProbeCache(work_dir / "bench_probe_cache.json")
+    service = ConverterService.from_settings(SettingsStore(settings_path), encoder=encoder, probe_cache=probe_cache)
+    try:
+        yield service
+    finally:
+        service.shutdown(timeout=60)
+        if service.journal:
+            service.journal.close()
+
+
+def _link_copy(source: Path, stem: str) -> Path:
+    copy = source.with_name(stem + source.suffix)
+    if not copy.exists():
+        try:
+            os.link(source, copy)
+        except OSError:
+            shutil.copy2(source, copy)
+    return copy
+
+
+def _noop_encoder(input_file, options, progress_callback=None, **kwargs) -> None:
+    """Кодирование-пустышка: остаются только накладные расходы очереди и сервиса."""
+    if progress_callback:
+        progress_callback(100)
+
+
+def bench_dispatch(source: Path, jobs_count: int, workers: int, work_dir: Path, journal: bool) -> BenchResult:
+    """Сколько стоит сама очередь: выдача задачи, смена состояний, журнал и ffprobe для выбора копирования."""
+    db = work_dir / "bench_jobs.db"
+    for suffix in ("", "-wal", "-shm"):
+        Path(str(db) + suffix).unlink(missing_ok=True)
+    profile = PROFILES["h264-veryfast"]
+    jobs = [Job(source_path=_link_copy(source, f"dispatch_{i}"), output_dir=work_dir / "out", profile=profile)
+            for i in range(jobs_count)]
+    with _isolated_service(work_dir, encoder=_noop_encoder, max_workers=workers,
+                           journal_path=str(db) if journal else "") as service, ChildSampler() as sampler:
+        wall = _run_service(service, jobs, timeout=600.0)
+    name = "dispatch-journal" if journal else "dispatch"
+    return _result(name, "noop", "-", 0.0, jobs_count, workers, wall, sampler,
+                   queue_overhead_ms=round(wall / jobs_count * workers * 1000, 3))
+
+
+def _version() -> str:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent).stdout.strip() or "unknown"
+    except OSError:
+        return "unknown"
+
+
+def _ffmpeg_version() -> str:
+    try:
+        output = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True).stdout
+        return output.splitlines()[0] if output else "unknown"
+    except OSError:
+        return "unknown"
+
+
+def run_suite(args: argparse.Namespace) -> dict:
+    work_dir = Path(args.work_dir) if args.work_dir else Path(tempfile.mkdtemp(prefix="vc-bench-"))
+    work_dir.mkdir(parents=True, exist_ok=True)
+    output_dir = work_dir / "out"
+    results: List[BenchResult] = []
+
+    def record(result: BenchResult) -> None:
+        results.append(result)
+        print(f"[BENCH] {result.key}: {result.wall_time:.2f} с, x{result.realtime_factor} "
+              f"CPU {result.cpu_percent}% RSS {result.peak_rss_mb} МБ")
+
+    try:
+        for resolution in args.resolutions:
+            for duration in args.durations:
+                source = generate_source(work_dir, resolution, duration)
+                for profile_name in args.profiles:
+                    for _ in range(args.repeat):
+                        record(bench_convert_file(source, profile_name, resolution, duration, output_dir))
+                    for workers in args.workers:
+                        for _ in range(args.repeat):
+                            record(bench_service(source, profile_name, resolution, duration, args.files,
+                                                 workers, output_dir, args.engine))
+        dispatch_source = generate_source(work_dir, args.resolutions[0], args.durations[0])
+        for journal in (False, True):
+            record(bench_dispatch(dispatch_source, args.dispatch_jobs, max(args.workers), work_dir, journal))
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        "version": _version(),
+        "timestamp": time.time(),
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "memory_mb": psutil.virtual_memory().total // 1024 // 1024,
+            "ffmpeg": _ffmpeg_version(),
+        },
+        "results": [{**asdict(r), "key": r.key} for r in results],
+    }
+
+
+def compare_results(old: dict, new: dict, threshold: float = 5.0) -> List[str]:
+    """
+    Сравнивает два прогона по совпадающим сценариям (медиана по повторам).
+    Возвращает строки отчета; изменения меньше threshold процентов помечаются как шум.
+    """
+    def medians(data: dict) -> Dict[str, float]:
+        grouped: Dict[str, List[float]] = {}
+        for row in data["results"]:
+            grouped.setdefault(row["key"], []).append(row["wall_time"])
+        return {key: sorted(values)[len(values) // 2] for key, values in grouped.items()}
+
+    before, after = medians(old), medians(new)
+    lines = []
+    for key in sorted(before.keys() & after.keys()):
+        change = (after[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+        verdict = "~" if abs(change) < threshold else ("медленнее" if change > 0 else "быстрее")
+        lines.append(f"{key}: {before[key]:.3f} -> {after[key]:.3f} с ({change:+.1f}%) {verdict}")
+    return lines
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Бенчмарк конвейера конвертации VideoConverter")
+    parser.add_argument("-o", "--output", default="bench_results.json", help="Куда записать результаты (JSON)")
+    parser.add_argument("--resolutions", nargs="+", default=DEFAULT_RESOLUTIONS)
+    parser.add_argument("--durations", nargs="+", type=float, default=DEFAULT_DURATIONS,
+                        help="Длительность синтетических исходников, секунды")
+    parser.add_argument("--profiles", nargs="+", default=list(PROFILES), choices=list(PROFILES))
+    parser.add_argument("--workers", nargs="+", type=int, default=DEFAULT_WORKERS,
+                        help="Варианты числа параллельных задач сервиса")
+    parser.add_argument("--files", type=int, default=4, help="Сколько файлов в пакете для сервиса")
+    parser.add_argument("--engine", choices=("threads", "asyncio"), default="threads")
+    parser.add_argument("--dispatch-jobs", type=int, default=500,
+                        help="Число пустых задач для замера накладных расходов очереди")
+    parser.add_argument("--repeat", type=int, default=1, help="Повторы каждого замера")
+    parser.add_argument("--work-dir", help="Папка для исходников (по умолчанию временная, удаляется)")
+    parser.add_argument("--quick", action="store_true", help="Короткий прогон: 360p, 5 с, один профиль")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Сравнить два файла результатов")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = _build_parser().parse_args(argv)
+    if args.compare:
+        old, new = (json.loads(Path(p).read_text(encoding="utf-8")) for p in args.compare)
+        for line in compare_results(old, new):
+            print(line)
+        return
+    if shutil.which("ffmpeg") is None:
+        raise SystemExit("[ERROR] Утилита 'ffmpeg' не найдена в системе.")
+    if args.quick:
+        args.resolutions, args.durations, args.profiles = ["640x360"], [5.0], ["h264-veryfast"]
+        args.workers, args.files, args.dispatch_jobs = [1, 2], 2, 100
+
+    report = run_suite(args)
+    Path(args.output).write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"[OK] Результаты записаны в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,7 @@
 import sys
 import shutil
 from videoconverter.cli import main as cli_main
-# Импортируем функцию запуска GUI (мы её добавим сейчас в __init__ или вызовем напрямую)
-from videoconverter.gui import run_gui
+from videoconverter.daemon import main as daemon_main
 
 
 def ensure_ffmpeg_installed() -> None:
@@ -14,9 +13,14 @@ def ensure_ffmpeg_installed() -> None:
 if __name__ == "__main__":
     ensure_ffmpeg_installed()
 
+    # Фоновый режим без GUI: main.py daemon [--host ...] [--port ...]
+    if len(sys.argv) > 1 and sys.argv[1] == "daemon":
+        daemon_main(sys.argv[2:])
     # Если переданы аргументы (например: main.py video.mp4 -f mkv), запускаем CLI
-    if len(sys.argv) > 1:
-        cli_main()
+    elif len(sys.argv) > 1:
+        sys.exit(cli_main())
     else:
-        # Иначе запускаем графический интерфейс
+        # Иначе запускаем графический интерфейс. Импорт здесь: на серверах без ttkbootstrap
+        # должны работать daemon и CLI
+        from videoconverter.gui import run_gui
         run_gui()
\ No newline at end of file
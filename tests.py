@@ -4,6 +4,29 @@ from videoconverter.converter import build_ffmpeg_command, ConversionOptions, Co
 from videoconverter.cli import _validate_bitrate, _build_parser
 
 
+@pytest.fixture
+def make_service(tmp_path):
+    """
+    Фабрика ConverterService с настройками во временной папке (без горячей папки и журнала):
+    settings.json репозитория не читается. После теста каждый сервис завершается через shutdown().
+    """
+    from videoconverter.models import Settings
+    from videoconverter.service import ConverterService
+    from videoconverter.settings_store import SettingsStore
+    path = tmp_path / "service_settings.json"
+    Settings(output_path=str(tmp_path), hot_folder_enabled=False, journal_path="").save(path)
+    services = []
+
+    def make(**kwargs):
+        kwargs.setdefault("settings_store", SettingsStore(path))
+        services.append(ConverterService(**kwargs))
+        return services[-1]
+
+    yield make
+    for service in services:
+        service.shutdown(timeout=10)
+
+
 # --- ТЕСТ 1: Проверка логики (Unit-тест) ---
 def test_build_ffmpeg_command():
     """Проверяет, что команда для FFmpeg собирается правильно."""
@@ -67,4 +90,1348 @@ def test_cli_parser_defaults():
     assert args.format == "mkv"
     # Проверяем, что входной файл попал в список
     assert args.inputs == ["my_video.avi"]
-    assert args.output_dir == "output"
\ No newline at end of file
+    assert args.output_dir == "output"
+
+# --- ТЕСТ 5: Размер пула рабочих потоков ---
+def test_resolve_worker_count(monkeypatch):
+    from videoconverter.service import resolve_worker_count
+    monkeypatch.setattr("os.cpu_count", lambda: 32)
+    assert resolve_worker_count(3, 8) == 3  # явное значение важнее
+    assert resolve_worker_count(None, 4) == 8  # 32 ядра / 4 потока
+    assert resolve_worker_count(None, None) == 1  # ffmpeg сам займет все ядра
+
+
+# --- ТЕСТ 6: Пул не выдает одну задачу двум потокам ---
+def test_worker_pool_claims_each_job_once(monkeypatch, tmp_path, make_service):
+    import threading
+    import time
+    from videoconverter.models import Job, FormatProfile, JobState
+
+    seen = []
+    seen_lock = threading.Lock()
+
+    def fake_convert(input_file, options, progress_callback=None, **kwargs):
+        time.sleep(0.01)
+        with seen_lock:
+            seen.append(input_file)
+
+    service = make_service(max_workers=4, encoder=fake_convert)
+    jobs = [Job(source_path=tmp_path / f"{i}.avi", output_dir=tmp_path / "out", profile=FormatProfile())
+            for i in range(20)]
+    for job in jobs:
+        service.add_job(job)
+
+    service.start_processing()
+    deadline = time.time() + 5
+    while service._running and time.time() < deadline:
+        time.sleep(0.01)
+
+    assert sorted(seen) == sorted(j.source_path for j in jobs)
+    assert all(j.state == JobState.DONE for j in jobs)
+
+
+# --- ТЕСТ 7: Сегментное кодирование ---
+def test_segment_commands(tmp_path):
+    from videoconverter.segments import build_split_command, build_concat_command, write_concat_list
+    split = build_split_command(Path("long.mov"), tmp_path, 120)
+    assert split[split.index("-f") + 1] == "segment"
+    assert split[split.index("-segment_time") + 1] == "120"
+    assert "copy" in split  # нарезка без перекодирования
+
+    parts = [tmp_path / "seg_00000.mp4", tmp_path / "it's.mp4"]
+    list_file = tmp_path / "list.txt"
+    write_concat_list(parts, list_file)
+    assert "'\\''" in list_file.read_text(encoding="utf-8")  # кавычка экранирована
+    concat = build_concat_command(list_file, tmp_path / "out.mp4")
+    assert concat[concat.index("-f") + 1] == "concat"
+
+
+def test_segmented_short_file_falls_back(monkeypatch, tmp_path):
+    from videoconverter import segments
+    source = tmp_path / "clip.mp4"
+    source.write_bytes(b"x")
+    calls = []
+    monkeypatch.setattr(segments.converter, "get_video_duration", lambda p: 30.0)
+    monkeypatch.setattr(segments.converter, "convert_file", lambda *a, **kw: calls.append(a[0]))
+    segments.convert_file_segmented(source, ConversionOptions(target_format="mp4", output_dir=tmp_path))
+    assert calls == [source]
+
+
+def test_segments_encode_with_known_duration(monkeypatch, tmp_path):
+    from videoconverter import segments
+    from videoconverter.probe import MediaInfo
+    source = tmp_path / "long.mp4"
+    source.write_bytes(b"x")
+    probed, durations = [], []
+
+    def fake_ffmpeg(cmd, *args, **kwargs):
+        if "segment" in cmd:
+            for i in range(3):
+                (Path(cmd[-1]).parent / f"seg_{i:05d}.mkv").write_bytes(b"s")
+
+    def fake_probe(path, use_cache=True):
+        probed.append(use_cache)
+        return MediaInfo(duration=60.0)
+
+    monkeypatch.setattr(segments.converter, "get_video_duration", lambda p: 600.0)
+    monkeypatch.setattr(segments.converter, "run_ffmpeg", fake_ffmpeg)
+    monkeypatch.setattr(segments, "probe_media", fake_probe)
+    monkeypatch.setattr(segments.converter, "convert_file",
+                        lambda *a, duration=None, **kw: durations.append(duration))
+    segments.convert_file_segmented(source, ConversionOptions(target_format="mp4", output_dir=tmp_path),
+                                    segment_seconds=60)
+    # Сегменты не попадают в кэш ffprobe: длительность известна с нарезки
+    assert probed == [False] * 3
+    assert durations == [60.0] * 3
+
+
+@pytest.mark.skipif(__import__("sys").platform == "win32", reason="скрипт-заглушка ffmpeg только для POSIX")
+def test_segmented_forwards_process_and_metrics(monkeypatch, tmp_path):
+    import threading
+    from videoconverter import segments
+    from videoconverter.probe import MediaInfo
+    monkeypatch.setenv("PATH", _fake_ffmpeg(tmp_path, (
+        "out = sys.argv[-1]\n"
+        "if 'segment' in sys.argv:\n"
+        "    for i in range(3):\n"
+        "        open(out % i, 'wb').write(b's')\n"
+        "else:\n"
+        "    open(out, 'wb').write(b'o')\n"
+        "print('out_time_us=1000000\\nprogress=end', flush=True)"
+    )))
+    monkeypatch.setattr(segments.converter, "get_video_duration", lambda p: 900.0)
+    monkeypatch.setattr(segments, "probe_media", lambda p, use_cache=True: MediaInfo(duration=300.0))
+    source = tmp_path / "long.avi"
+    source.write_bytes(b"x")
+    processes, infos = [], []
+
+    segments.convert_file_segmented(source, ConversionOptions(target_format="mp4", output_dir=tmp_path / "out"),
+                                    pause_event=threading.Event(), max_parallel=2, segment_seconds=300,
+                                    metrics_callback=infos.append, process_callback=processes.append)
+    assert (tmp_path / "out" / "long.mp4").exists()
+    # Нарезка, три сегмента и склейка — все процессы видны управлению задачей
+    assert len(processes) == 5
+    assert len(infos) == 3
+
+
+# --- ТЕСТ 8: Разбор ответа ffprobe ---
+def test_parse_ffprobe_output():
+    from videoconverter.probe import parse_ffprobe_output
+    info = parse_ffprobe_output({
+        "format": {"duration": "125.50", "format_name": "matroska,webm", "bit_rate": "4000000"},
+        "streams": [
+            {"index": 0, "codec_type": "video", "codec_name": "h264", "width": 1920, "height": 1080,
+             "avg_frame_rate": "30000/1001"},
+            {"index": 1, "codec_type": "audio", "codec_name": "aac", "channels": 2, "sample_rate": "48000"},
+        ],
+    })
+    assert info.duration == 125.5
+    assert info.video_codec == "h264"
+    assert info.audio_codec == "aac"
+    assert info.resolution == "1920x1080"
+    assert info.fps == 29.97
+    assert info.bit_rate == 4000000
+
+
+# --- ТЕСТ 9: Кэш метаданных (повторный probe не запускается, LRU-вытеснение) ---
+def test_probe_cache_reuses_and_evicts(monkeypatch, tmp_path):
+    from videoconverter import probe
+    calls = []
+
+    def fake_ffprobe(path):
+        calls.append(path)
+        return probe.MediaInfo(duration=10.0)
+
+    monkeypatch.setattr(probe, "run_ffprobe", fake_ffprobe)
+    files = []
+    for name in ("a.mp4", "b.mp4", "c.mp4"):
+        f = tmp_path / name
+        f.write_bytes(b"data")
+        files.append(f)
+
+    cache_file = tmp_path / "cache.json"
+    cache = probe.ProbeCache(cache_file=cache_file, max_entries=2)
+    assert cache.get(files[0]).duration == 10.0
+    cache.get(files[0])
+    assert len(calls) == 1  # второй раз — из кэша
+
+    cache.get(files[1])
+    cache.get(files[2])
+    assert len(cache) == 2  # самая старая запись вытеснена
+    cache.save()
+
+    reloaded = probe.ProbeCache(cache_file=cache_file, max_entries=2)
+    reloaded.get(files[2])
+    assert len(calls) == 3  # после перезапуска кэш читается с диска
+
+
+# --- ТЕСТ 10: Копирование потоков, если исходник уже подходит под профиль ---
+def test_plan_stream_copy():
+    from videoconverter.converter import plan_stream_copy
+    from videoconverter.models import FormatProfile
+    from videoconverter.probe import MediaInfo, StreamInfo
+
+    info = MediaInfo(duration=60.0, streams=[
+        StreamInfo(index=0, codec_type="video", codec_name="h264", width=1920, height=1080, fps=30.0,
+                   bit_rate=3_000_000),
+        StreamInfo(index=1, codec_type="audio", codec_name="aac"),
+    ])
+    profile = FormatProfile(format="mp4", video_codec="h264", audio_codec="aac",
+                            resolution="1920x1080", bitrate="4M", fps=30)
+    assert plan_stream_copy(info, profile) == (True, True)
+
+    # Другое разрешение — видео перекодируем, аудио по-прежнему копируем
+    profile.resolution = "1280x720"
+    assert plan_stream_copy(info, profile) == (False, True)
+
+
+def test_build_command_with_stream_copy():
+    options = ConversionOptions(target_format="mp4", output_dir=Path("out"), video_bitrate="2M",
+                                resolution="1280x720", copy_video=True, copy_audio=True)
+    cmd = build_ffmpeg_command(Path("in.mkv"), Path("out/in.mp4"), options)
+    assert cmd[cmd.index("-c:v") + 1] == "copy"
+    assert cmd[cmd.index("-c:a") + 1] == "copy"
+    assert "-b:v" not in cmd and "-s" not in cmd  # параметры кодирования не нужны
+
+
+# --- ТЕСТ 11: Кодеки, пресет и CRF из профиля попадают в команду ---
+def test_build_command_codecs_preset_crf():
+    options = ConversionOptions(target_format="mkv", output_dir=Path("out"), video_bitrate="20M",
+                                video_codec="hevc", audio_codec="aac", preset="veryfast", crf=23, threads=4)
+    cmd = build_ffmpeg_command(Path("in.avi"), Path("out/in.mkv"), options)
+    assert cmd[cmd.index("-c:v") + 1] == "libx265"
+    assert cmd[cmd.index("-c:a") + 1] == "aac"
+    assert cmd[cmd.index("-preset") + 1] == "veryfast"
+    assert cmd[cmd.index("-crf") + 1] == "23"
+    assert cmd[cmd.index("-maxrate") + 1] == "20M"  # битрейт стал потолком
+    assert "-b:v" not in cmd
+    assert cmd[cmd.index("-x265-params") + 1] == "pools=4"
+
+
+def test_cli_parser_codec_options():
+    args = _build_parser().parse_args(["a.avi", "-f", "mp4", "--video-codec", "h264", "--preset", "veryfast",
+                                       "--crf", "20"])
+    assert args.video_codec == "h264"
+    assert args.preset == "veryfast"
+    assert args.crf == 20
+
+
+# --- ТЕСТ 12: Наблюдатели горячей папки ---
+def test_polling_watcher_reports_new_and_changed(tmp_path):
+    from videoconverter.watcher import PollingWatcher
+    (tmp_path / "old.mp4").write_bytes(b"1")
+    watcher = PollingWatcher(tmp_path, interval=0)
+    assert [e.path.name for e in watcher.poll(0)] == ["old.mp4"]  # начальное сканирование
+    assert watcher.poll(0) == []
+
+    (tmp_path / "new.mkv").write_bytes(b"22")
+    events = watcher.poll(0)
+    assert [e.path.name for e in events] == ["new.mkv"]
+    assert not events[0].confirmed  # опрос не знает, закончена ли запись
+
+
+@pytest.mark.skipif(not __import__("sys").platform.startswith("linux"), reason="inotify есть только в Linux")
+def test_inotify_watcher_close_write(tmp_path):
+    from videoconverter.watcher import InotifyWatcher
+    watcher = InotifyWatcher(tmp_path)
+    try:
+        assert watcher.poll(0) == []
+        (tmp_path / "clip.mp4").write_bytes(b"data")
+        events = watcher.poll(1.0)
+        assert [(e.path.name, e.confirmed) for e in events] == [("clip.mp4", True)]
+    finally:
+        watcher.close()
+
+
+# --- ТЕСТ 13: Индексированная очередь задач ---
+def test_job_queue_indexes_and_priority(tmp_path):
+    from videoconverter.job_queue import JobQueue
+    from videoconverter.models import Job, FormatProfile, JobState
+
+    queue = JobQueue()
+    jobs = [Job(source_path=tmp_path / f"{i}.mp4", output_dir=tmp_path, profile=FormatProfile()) for i in range(3)]
+    jobs[2].priority = 5
+    for job in jobs:
+        queue.add(job)
+
+    assert len(queue) == 3
+    assert [j.id for j in queue] == [j.id for j in jobs]  # порядок добавления сохраняется
+    assert queue.get(jobs[1].id) is jobs[1]
+    assert queue.has_source(tmp_path / "0.mp4")
+    assert queue.count(JobState.QUEUED) == 3
+
+    # Сначала выдается задача с большим приоритетом, затем по порядку добавления
+    assert queue.claim_next() is jobs[2]
+    assert jobs[2].state == JobState.RUNNING
+    queue.remove(jobs[0].id)
+    assert not queue.has_source(tmp_path / "0.mp4")
+    assert queue.claim_next() is jobs[1]
+    assert queue.claim_next() is None
+
+    queue.set_state(jobs[1], JobState.DONE)
+    assert queue.count(JobState.DONE) == 1
+    assert queue.remove_states(JobState.DONE) == [jobs[1]]
+    assert len(queue) == 1
+
+
+def test_job_queue_policies_and_wait_stats(tmp_path):
+    import time
+    from videoconverter.job_queue import JobQueue, get_policy
+    from videoconverter.models import Job, FormatProfile, JobPriority
+
+    def make(name, **kwargs):
+        return Job(source_path=tmp_path / name, output_dir=tmp_path, profile=FormatProfile(), **kwargs)
+
+    long_job = make("long.mp4", duration=3600.0)
+    short_job = make("short.mp4", duration=60.0)
+    unknown = make("unknown.mp4")
+    urgent = make("urgent.mp4", duration=7200.0, priority=JobPriority.URGENT)
+    queue = JobQueue(get_policy("sjf"))
+    for job in (long_job, unknown, short_job, urgent):
+        queue.add(job)
+
+    # Приоритет важнее длительности, неизвестная длительность — в конец
+    assert [job.id for job in queue.pending()] == [j.id for j in (urgent, short_job, long_job, unknown)]
+
+    # Смена политики перестраивает порядок уже стоящих задач
+    long_job.deadline = time.time() + 60
+    queue.set_policy(get_policy("edf"))
+    assert queue.claim_next() is long_job
+    queue.set_policy(get_policy("fifo"))
+    assert queue.claim_next() is unknown
+
+    report = queue.wait_report()
+    assert report["edf"]["count"] == 1 and report["fifo"]["count"] == 1
+    assert long_job.started_at is not None
+    with pytest.raises(ValueError):
+        get_policy("random")
+
+
+# --- ТЕСТ 14: Журнал задач и восстановление после сбоя ---
+def test_journal_recovers_interrupted_jobs(tmp_path):
+    from videoconverter.journal import JobJournal, recover_jobs
+    from videoconverter.models import Job, FormatProfile, JobState
+
+    journal = JobJournal(tmp_path / "jobs.db")
+    done = Job(source_path=tmp_path / "a.avi", output_dir=tmp_path / "out", profile=FormatProfile(format="mkv"))
+    running = Job(source_path=tmp_path / "b.avi", output_dir=tmp_path / "out", profile=FormatProfile())
+    for job in (done, running):
+        journal.record_created(job)
+    done.state = JobState.DONE
+    journal.record_state(done)
+    running.priority = 5
+    journal.record_priority(running)
+    running.state = JobState.RUNNING
+    journal.record_state(running)
+
+    # "Процесс упал" посреди кодирования: выходной файл записан наполовину
+    running.output_filename.parent.mkdir()
+    running.output_filename.write_bytes(b"half")
+    journal.close()
+
+    reopened = JobJournal(tmp_path / "jobs.db")
+    restored = {job.id: job for job in recover_jobs(reopened)}
+    assert restored[done.id].state == JobState.DONE  # завершенное не переделываем
+    assert restored[done.id].profile.format == "mkv"
+    assert restored[running.id].state == JobState.QUEUED
+    assert not running.output_filename.exists()
+    assert restored[running.id].priority == 5
+    assert reopened.history(running.id) == ["CREATED", "PRIORITY", "RUNNING", "QUEUED"]
+
+
+# --- ТЕСТ 15: HTTP API фонового режима ---
+def test_daemon_api_submit_and_list(monkeypatch, tmp_path, make_service):
+    import json
+    import threading
+    import urllib.error
+    import urllib.request
+    from videoconverter.daemon import DaemonServer
+
+    service = make_service()
+    server = DaemonServer(("127.0.0.1", 0), service, autostart=False)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    def call(method, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(base + path, data=data, method=method,
+                                         headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+
+    try:
+        created = call("POST", "/jobs", {"jobs": [
+            {"source_path": str(tmp_path / "a.avi"), "output_dir": str(tmp_path), "profile": {"format": "mkv"}},
+            {"source_path": str(tmp_path / "b.avi"), "output_dir": str(tmp_path), "priority": 3},
+        ]})["created"]
+        assert len(created) == 2
+
+        listing = call("GET", "/jobs?state=queued")
+        assert listing["total"] == 2
+        assert listing["jobs"][0]["profile"]["format"] == "mkv"
+
+        with pytest.raises(urllib.error.HTTPError) as error:
+            call("POST", f"/jobs/{created[1]}/priority", [5])
+        assert error.value.code == 400
+
+        cancelled = call("POST", f"/jobs/{created[0]}/cancel")
+        assert cancelled["state"] == "CANCELLED"
+        assert call("GET", "/status")["jobs"]["QUEUED"] == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+# --- ТЕСТ 16: Разбор вывода ffmpeg -progress ---
+def test_progress_parser():
+    from videoconverter.progress import ProgressParser
+    parser = ProgressParser()
+    block = ["frame=120", "fps=59.94", "bitrate=1500.2kbits/s", "total_size=1048576",
+             "out_time_us=4000000", "speed=2.5x"]
+    assert all(parser.feed(line) is None for line in block)
+    info = parser.feed("progress=continue")
+    assert info.frame == 120
+    assert info.fps == 59.94
+    assert info.bitrate_kbps == 1500.2
+    assert info.out_time == 4.0
+    assert info.speed == 2.5
+    assert not info.finished
+    assert parser.feed("progress=end").finished
+
+
+def _fake_ffmpeg(tmp_path, body):
+    """Подкладывает в PATH скрипт ffmpeg, имитирующий вывод -progress."""
+    import os
+    import stat
+    import sys
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    script = bin_dir / "ffmpeg"
+    script.write_text(f"#!{sys.executable}\nimport sys, time\n{body}\n", encoding="utf-8")
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    return str(bin_dir) + os.pathsep + os.environ.get("PATH", "")
+
+
+@pytest.mark.skipif(__import__("sys").platform == "win32", reason="скрипт-заглушка ffmpeg только для POSIX")
+def test_convert_file_reports_metrics(monkeypatch, tmp_path):
+    from videoconverter import converter
+    monkeypatch.setenv("PATH", _fake_ffmpeg(tmp_path, (
+        "for us in (2500000, 5000000):\n"
+        "    print(f'frame=10\\nfps=25\\nout_time_us={us}\\nspeed=1.0x\\nprogress=continue', flush=True)\n"
+        "print('progress=end', flush=True)"
+    )))
+    monkeypatch.setattr(converter, "get_video_duration", lambda p: 10.0)
+    source = tmp_path / "in.avi"
+    source.write_bytes(b"x")
+    percents, metrics = [], []
+    converter.convert_file(source, ConversionOptions(target_format="mp4", output_dir=tmp_path),
+                           progress_callback=percents.append, metrics_callback=metrics.append)
+    assert percents == [25, 50, 100]
+    assert metrics[-1].finished
+
+
+@pytest.mark.skipif(__import__("sys").platform == "win32", reason="скрипт-заглушка ffmpeg только для POSIX")
+def test_convert_file_stops_while_ffmpeg_is_silent(monkeypatch, tmp_path):
+    import threading
+    import time
+    from videoconverter import converter
+    monkeypatch.setenv("PATH", _fake_ffmpeg(tmp_path, "time.sleep(30)"))
+    monkeypatch.setattr(converter, "get_video_duration", lambda p: 10.0)
+    source = tmp_path / "in.avi"
+    source.write_bytes(b"x")
+    stop = threading.Event()
+    threading.Timer(0.3, stop.set).start()
+    started = time.monotonic()
+    with pytest.raises(ConversionError, match="STOPPED"):
+        converter.convert_file(source, ConversionOptions(target_format="mp4", output_dir=tmp_path), stop_event=stop)
+    assert time.monotonic() - started < 5
+
+
+# --- ТЕСТ 17: Движок asyncio ---
+@pytest.mark.skipif(__import__("sys").platform == "win32", reason="скрипт-заглушка ffmpeg только для POSIX")
+def test_async_conversion_iterates_progress(monkeypatch, tmp_path):
+    import asyncio
+    from videoconverter import aio
+    monkeypatch.setenv("PATH", _fake_ffmpeg(tmp_path, (
+        "print('out_time_us=3000000\\nprogress=continue\\nout_time_us=6000000\\nprogress=end', flush=True)"
+    )))
+    monkeypatch.setattr(aio, "get_video_duration", lambda p: 6.0)
+    source = tmp_path / "in.avi"
+    source.write_bytes(b"x")
+
+    async def collect():
+        conversion = aio.AsyncConversion(source, ConversionOptions(target_format="mp4", output_dir=tmp_path))
+        return [(conversion.percent(info), info.finished) async for info in conversion]
+
+    assert asyncio.run(collect()) == [(50, False), (100, True)]
+
+
+def test_ffmpeg_run_shared_core():
+    from videoconverter.converter import FfmpegRun, ConversionError
+    percents, infos = [], []
+    run = FfmpegRun(10.0, percents.append, infos.append)
+    for line in ("out_time_us=5000000", "progress=continue", "out_time_us=12000000", "progress=end"):
+        run.feed(line)
+    assert percents == [50, 99] and len(infos) == 2 and run.last_info.finished
+    run.feed_stderr("  \n")
+    run.feed_stderr("Invalid data found\n")
+    with pytest.raises(ConversionError, match="код 1.*\n.*Invalid data found"):
+        run.finish(1)
+    run.finish(0)
+    assert percents[-1] == 100
+
+    # Отмена до запуска процесса: итог — STOPPED независимо от кода возврата
+    cancelled = FfmpegRun()
+    cancelled.cancel()
+    with pytest.raises(ConversionError, match="STOPPED"):
+        cancelled.finish(0)
+
+
+@pytest.mark.skipif(__import__("sys").platform == "win32", reason="скрипт-заглушка ffmpeg только для POSIX")
+def test_async_conversion_timeout_and_cancel(monkeypatch, tmp_path):
+    import asyncio
+    from videoconverter import aio
+    monkeypatch.setenv("PATH", _fake_ffmpeg(tmp_path, "time.sleep(30)"))
+    monkeypatch.setattr(aio, "get_video_duration", lambda p: 6.0)
+    source = tmp_path / "in.avi"
+    source.write_bytes(b"x")
+    options = ConversionOptions(target_format="mp4", output_dir=tmp_path)
+
+    with pytest.raises(ConversionError, match="Превышено время"):
+        asyncio.run(aio.convert_file_async(source, options, timeout=0.3))
+
+    async def cancel_soon():
+        conversion = aio.AsyncConversion(source, options)
+        asyncio.get_running_loop().call_later(0.3, conversion.cancel)
+        await conversion.run()
+
+    with pytest.raises(ConversionError, match="STOPPED"):
+        asyncio.run(cancel_soon())
+
+
+@pytest.mark.skipif(__import__("sys").platform == "win32", reason="скрипт-заглушка ffmpeg только для POSIX")
+def test_service_asyncio_engine_runs_jobs(monkeypatch, tmp_path, make_service):
+    import time
+    from videoconverter import aio
+    from videoconverter.models import Job, FormatProfile, JobState
+    monkeypatch.setenv("PATH", _fake_ffmpeg(tmp_path, "print('out_time_us=1000000\\nprogress=end', flush=True)"))
+    monkeypatch.setattr(aio, "get_video_duration", lambda p: 1.0)
+
+    service = make_service(max_workers=3, engine="asyncio")
+    jobs = []
+    for i in range(5):
+        source = tmp_path / f"{i}.avi"
+        source.write_bytes(b"x")
+        jobs.append(Job(source_path=source, output_dir=tmp_path / "out", profile=FormatProfile()))
+        service.add_job(jobs[-1])
+
+    service.start_processing()
+    deadline = time.time() + 10
+    while service._running and time.time() < deadline:
+        time.sleep(0.05)
+    assert [j.state for j in jobs] == [JobState.DONE] * 5
+
+
+@pytest.mark.skipif(__import__("sys").platform == "win32", reason="скрипт-заглушка ffmpeg только для POSIX")
+def test_sync_wrappers_honour_timeout(monkeypatch, tmp_path):
+    import time
+    from videoconverter import converter, ladder
+    monkeypatch.setenv("PATH", _fake_ffmpeg(tmp_path, "time.sleep(30)"))
+    monkeypatch.setattr(converter, "get_video_duration", lambda p: 6.0)
+    monkeypatch.setattr(ladder, "get_video_duration", lambda p: 6.0)
+    source = tmp_path / "in.avi"
+    source.write_bytes(b"x")
+    options = ConversionOptions(target_format="mp4", output_dir=tmp_path)
+
+    started = time.monotonic()
+    with pytest.raises(ConversionError, match="Превышено время"):
+        converter.convert_file(source, options, timeout=0.3)
+    with pytest.raises(ConversionError, match="Превышено время"):
+        ladder.convert_ladder(source, [(tmp_path / "a.mp4", options)], timeout=0.3)
+    assert time.monotonic() - started < 5
+
+
+# --- ТЕСТ 18: Планировщик по ресурсам ---
+class _FakeMonitor:
+    def __init__(self, cpu=10.0, iowait=0.0, memory_mb=8000, disk_mb=100000):
+        from videoconverter.scheduler import ResourceSnapshot
+        self.snap = ResourceSnapshot(cpu_percent=cpu, iowait_percent=iowait, available_memory=memory_mb * 1024 * 1024)
+        self.disk = disk_mb * 1024 * 1024
+
+    def snapshot(self):
+        return self.snap
+
+    def disk_free(self, path):
+        return self.disk
+
+
+def test_resource_scheduler_admission(monkeypatch, tmp_path):
+    from videoconverter import scheduler as sched
+    from videoconverter.models import Job, FormatProfile
+    from videoconverter.probe import MediaInfo
+
+    monkeypatch.setattr(sched, "probe_media", lambda path: MediaInfo(duration=3600.0, size=10 ** 9))
+    monkeypatch.setattr("os.cpu_count", lambda: 32)
+    job = Job(source_path=tmp_path / "a.mkv", output_dir=tmp_path,
+              profile=FormatProfile(video_codec="h264", bitrate="4M"))
+
+    busy = sched.ResourceScheduler(sched.ResourceBudget(max_cpu_percent=80), _FakeMonitor(cpu=95.0))
+    assert busy.admit(job, running=1)[0] == sched.Admission.WAIT
+    assert busy.admit(job, running=0)[0] == sched.Admission.START  # одна задача выполняется всегда
+
+    # Час видео в 4 Мбит/с — около 1.8 ГБ, а на диске свободно 1 ГБ
+    full_disk = sched.ResourceScheduler(monitor=_FakeMonitor(disk_mb=1000))
+    decision, reason = full_disk.admit(job, running=0)
+    assert decision == sched.Admission.REJECT
+    assert "диске" in reason
+
+    idle = sched.ResourceScheduler(monitor=_FakeMonitor(cpu=5.0))
+    assert idle.admit(job, running=2)[0] == sched.Admission.START
+
+    # Резерв места считается по диску, а не по строке папки: соседняя папка того же диска его видит
+    (tmp_path / "other").mkdir()
+    neighbour = Job(source_path=tmp_path / "b.mkv", output_dir=tmp_path / "other" / "new",
+                    profile=FormatProfile(video_codec="h264", bitrate="4M"))
+    shared = sched.ResourceScheduler(monitor=_FakeMonitor(cpu=5.0, disk_mb=4000))
+    assert shared.admit(job, running=0)[0] == sched.Admission.START
+    assert shared.admit(neighbour, running=1)[0] == sched.Admission.WAIT
+
+
+def test_scheduler_counts_paused_jobs_as_active(monkeypatch, tmp_path, make_service):
+    from videoconverter import scheduler as sched
+    from videoconverter.models import Job, FormatProfile, JobState
+    from videoconverter.probe import MediaInfo
+
+    monkeypatch.setattr(sched, "probe_media", lambda path: MediaInfo(duration=60.0))
+    service = make_service(scheduler=sched.ResourceScheduler(monitor=_FakeMonitor(cpu=95.0)))
+    paused, waiting = (Job(source_path=tmp_path / name, output_dir=tmp_path, profile=FormatProfile())
+                       for name in ("a.mkv", "b.mkv"))
+    service.add_job(paused)
+    service.queue.set_state(paused, JobState.PAUSED)
+    service.add_job(waiting)
+    # Приостановленная задача держит свой ffmpeg: при занятом процессоре новая ждет, а не стартует «первой»
+    assert service._claim_next_job() is None
+    assert waiting.state == JobState.QUEUED
+
+
+def test_estimate_job_cost_scales_with_codec_and_resolution(tmp_path):
+    from videoconverter.scheduler import estimate_job_cost
+    from videoconverter.models import Job, FormatProfile
+    from videoconverter.probe import MediaInfo
+
+    info = MediaInfo(duration=60.0)
+    small = estimate_job_cost(Job(tmp_path / "a", tmp_path, FormatProfile(video_codec="h264", resolution="1280x720")),
+                              info, cpu_count=32)
+    big = estimate_job_cost(Job(tmp_path / "a", tmp_path, FormatProfile(video_codec="hevc", resolution="3840x2160")),
+                            info, cpu_count=32)
+    assert big.cpu_percent > small.cpu_percent
+    assert big.memory_bytes > small.memory_bytes
+    assert small.output_bytes > 0
+
+
+# --- ТЕСТ 19: Кэш результатов по содержимому ---
+def test_output_cache_dedup_and_eviction(tmp_path):
+    from videoconverter.models import FormatProfile
+    from videoconverter.output_cache import OutputCache, fast_hash
+
+    first = tmp_path / "first.avi"
+    first.write_bytes(b"a" * 100_000 + b"b" * 100_000)
+    renamed = tmp_path / "renamed.avi"
+    renamed.write_bytes(first.read_bytes())
+    other = tmp_path / "other.avi"
+    other.write_bytes(b"a" * 100_000 + b"c" * 100_000)
+    # Большой файл читается выборочно, но изменение внутри выборки меняет хэш
+    assert fast_hash(first, sample_size=1000, samples=4) == fast_hash(renamed, sample_size=1000, samples=4)
+    assert fast_hash(first, sample_size=1000, samples=4) != fast_hash(other, sample_size=1000, samples=4)
+
+    cache = OutputCache(tmp_path / "cache", max_bytes=250)
+    key = cache.key_for(first, FormatProfile(format="MP4", bitrate="2M"))
+    assert key == cache.key_for(renamed, FormatProfile(format="mp4", bitrate="2000k", threads=4))
+    assert key == cache.key_for(renamed, FormatProfile(format="mp4", bitrate="2M", poster=True, preview_interval=10))
+    assert key != cache.key_for(renamed, FormatProfile(format="mkv"))
+
+    output = tmp_path / "out" / "first.mp4"
+    output.parent.mkdir()
+    output.write_bytes(b"x" * 100)
+    cache.store(key, output)
+    assert cache.fetch(key, tmp_path / "out" / "renamed.mp4")
+    assert (tmp_path / "out" / "renamed.mp4").read_bytes() == b"x" * 100
+    # Перезапись выхода на месте (как ffmpeg -y) не должна портить закэшированный результат
+    with open(output, "r+b") as f:
+        f.truncate(0)
+        f.write(b"z" * 50)
+    assert cache.fetch(key, tmp_path / "out" / "again.mp4")
+    assert (tmp_path / "out" / "again.mp4").read_bytes() == b"x" * 100
+
+    # Индекс переживает перезапуск, а при превышении лимита вытесняется давно не использованное
+    cache = OutputCache(tmp_path / "cache", max_bytes=250)
+    for i in range(2):
+        extra = tmp_path / "out" / f"extra{i}.mp4"
+        extra.write_bytes(b"y" * 100)
+        cache.store(f"extra{i}", extra)
+    assert len(cache) == 2 and cache.total_bytes == 200
+    assert not cache.fetch(key, tmp_path / "out" / "again.mp4")
+
+
+@pytest.mark.skipif(__import__("sys").platform == "win32", reason="скрипт-заглушка ffmpeg только для POSIX")
+def test_service_reuses_cached_output(monkeypatch, tmp_path, make_service):
+    from videoconverter.models import Job, FormatProfile, JobState, ConversionPath
+    from videoconverter.output_cache import OutputCache
+    calls = tmp_path / "calls.txt"
+    monkeypatch.setenv("PATH", _fake_ffmpeg(tmp_path, (
+        f"open({str(calls)!r}, 'a').write('run\\n')\n"
+        "open(sys.argv[-1], 'wb').write(b'encoded')\n"
+        "print('progress=end', flush=True)"
+    )))
+
+    service = make_service(output_cache=OutputCache(tmp_path / "cache"))
+    jobs = []
+    for name in ("clip.avi", "clip copy.avi"):
+        source = tmp_path / name
+        source.write_bytes(b"same footage")
+        jobs.append(Job(source_path=source, output_dir=tmp_path / "out", profile=FormatProfile()))
+        service.add_job(jobs[-1])
+        service._run_job(jobs[-1])
+
+    assert [j.state for j in jobs] == [JobState.DONE] * 2
+    assert calls.read_text().count("run") == 1
+    assert jobs[1].conversion_path == ConversionPath.CACHED
+    assert jobs[1].output_filename.read_bytes() == b"encoded"
+
+    # Ошибка плана превью при попадании в кэш завершает задачу, а не рабочий поток
+    broken = Job(source_path=tmp_path / "clip.avi", output_dir=tmp_path / "out2",
+                 profile=FormatProfile(poster=True, preview_tile="bad"))
+    service.add_job(broken)
+    service.output_cache.store(service._cache_key(broken), jobs[0].output_filename)
+    service._run_job(broken)
+    assert broken.conversion_path == ConversionPath.CACHED
+    assert broken.state == JobState.FAILED and "сетка" in broken.error_message
+
+
+# --- ТЕСТ 20: Несколько выходов за один проход (ABR-лесенка) ---
+def test_ladder_command_splits_once(tmp_path):
+    from videoconverter.ladder import build_ladder_command, build_renditions
+    from videoconverter.models import FormatProfile
+
+    base = FormatProfile(resolution="1920x1080", bitrate="4000k")
+    renditions = build_renditions(base, ["1920x1080", "1280x720", "854x480"])
+    assert [r.label for r in renditions] == ["1080p", "720p", "480p"]
+    assert renditions[0].profile.bitrate == "4000k"
+    assert 2000 < int(renditions[1].profile.bitrate[:-1]) < 2500  # битрейт растет медленнее площади
+
+    outputs = []
+    for i, r in enumerate(renditions):
+        options = ConversionOptions(target_format="mp4", output_dir=tmp_path, resolution=r.profile.resolution,
+                                    fps=30, video_codec="h264", video_bitrate=r.profile.bitrate)
+        options.copy_video = i == 0  # первый выход уже подходит — видео копируется без декодирования
+        outputs.append((tmp_path / f"in_{r.label}.mp4", options))
+    cmd = build_ladder_command(Path("in.mkv"), outputs)
+
+    assert cmd.count("-i") == 1
+    graph = cmd[cmd.index("-filter_complex") + 1]
+    assert graph == "[0:v:0]split=2[s1][s2];[s1]scale=1280:720,fps=30[v1];[s2]scale=854:480,fps=30[v2]"
+    assert cmd[cmd.index(str(tmp_path / "in_1080p.mp4")) - 1] == "copy"
+    assert "-s" not in cmd and "[v2]" in cmd
+    assert cmd[-1] == str(tmp_path / "in_480p.mp4")
+
+
+@pytest.mark.skipif(__import__("sys").platform == "win32", reason="скрипт-заглушка ffmpeg только для POSIX")
+def test_service_runs_ladder_job(monkeypatch, tmp_path, make_service):
+    from videoconverter.ladder import build_renditions
+    from videoconverter.models import Job, FormatProfile, JobState
+    calls = tmp_path / "calls.txt"
+    # Заглушка записывает все выходы, кроме 480p
+    monkeypatch.setenv("PATH", _fake_ffmpeg(tmp_path, (
+        f"open({str(calls)!r}, 'a').write('run\\n')\n"
+        "for arg in sys.argv[1:]:\n"
+        "    if arg.endswith('.mp4') and '480p' not in arg:\n"
+        "        open(arg, 'wb').write(b'encoded')\n"
+        "print('progress=end', flush=True)"
+    )))
+
+    source = tmp_path / "clip.avi"
+    source.write_bytes(b"x")
+    service = make_service()
+    job = Job(source_path=source, output_dir=tmp_path / "out", profile=FormatProfile(),
+              renditions=build_renditions(FormatProfile(), ["1920x1080", "1280x720", "854x480"]))
+    service.add_job(job)
+    service._run_job(job)
+
+    assert calls.read_text().count("run") == 1  # все выходы одним процессом
+    assert [r.state for r in job.renditions] == [JobState.DONE, JobState.DONE, JobState.FAILED]
+    assert job.renditions[0].size == len(b"encoded")
+    assert job.state == JobState.FAILED and "480p" in job.error_message
+
+
+# --- ТЕСТ 21: Сравнение прогонов бенчмарка ---
+def test_bench_compare_results():
+    import bench
+
+    def run(*walls):
+        return {"results": [{"key": "service/h264/720p", "wall_time": w} for w in walls]
+                + [{"key": "convert_file/h264/720p", "wall_time": 10.0}]}
+
+    lines = bench.compare_results(run(10.0, 12.0, 11.0), run(8.0, 8.5, 30.0))
+    assert lines == [
+        "convert_file/h264/720p: 10.000 -> 10.000 с (+0.0%) ~",
+        "service/h264/720p: 11.000 -> 8.500 с (-22.7%) быстрее",  # медиана гасит выброс 30 с
+    ]
+
+
+# --- ТЕСТ 22: Метрики задач и экспорт в Prometheus ---
+@pytest.mark.skipif(__import__("sys").platform == "win32", reason="скрипт-заглушка ffmpeg только для POSIX")
+def test_service_collects_job_metrics(monkeypatch, tmp_path, make_service):
+    from videoconverter.metrics import Histogram
+    from videoconverter.models import Job, FormatProfile, JobState
+    monkeypatch.setenv("PATH", _fake_ffmpeg(tmp_path, (
+        "open(sys.argv[-1], 'wb').write(b'o' * 250)\n"
+        "print('frame=100\\nfps=50\\nout_time_us=2000000\\nspeed=2.5x\\nprogress=continue', flush=True)\n"
+        "time.sleep(0.2)\n"
+        "print('progress=end', flush=True)"
+    )))
+
+    source = tmp_path / "clip.avi"
+    source.write_bytes(b"s" * 1000)
+    service = make_service()
+    job = Job(source_path=source, output_dir=tmp_path / "out", profile=FormatProfile(preset="fast"))
+    service.add_job(job)
+    assert service.queue.claim_next() is job
+    service._run_job(job)
+
+    m = job.metrics
+    assert job.state == JobState.DONE
+    assert (m.speed, m.fps) == (2.5, 50.0)
+    assert m.input_bytes == 1000 and m.output_bytes == 250 and m.compression_ratio == 4.0
+    assert m.encode_time >= 0.2 and m.queue_wait is not None
+    assert m.peak_rss > 0
+
+    text = service.metrics_text()
+    profile = 'profile="mp4:h264:1920x1080:fast:4M"'
+    assert f'videoconverter_jobs_total{{path="transcode",{profile},state="done"}} 1' in text
+    assert f'videoconverter_job_compression_ratio_bucket{{{profile},le="4"}} 1' in text
+    assert f'videoconverter_job_input_bytes_total{{{profile}}} 1000' in text
+    assert 'videoconverter_queue_jobs{state="done"} 1' in text
+    assert service.metrics_snapshot()["counters"]["jobs_total"][0]["value"] == 1
+
+    hist = Histogram((1, 5))
+    for value in (0.5, 3, 3, 100):
+        hist.observe(value)
+    assert hist.cumulative() == [(1, 1), (5, 3), (float("inf"), 4)]
+
+
+# --- ТЕСТ 23: Пакетный CLI ---
+def test_cli_iter_inputs(tmp_path):
+    import io
+    from videoconverter.cli import iter_inputs
+    (tmp_path / "a.avi").write_bytes(b"x")
+    (tmp_path / "b.mkv").write_bytes(b"x")
+    (tmp_path / "notes.txt").write_text("x")
+    (tmp_path / "sub" / "deep").mkdir(parents=True)
+    (tmp_path / "sub" / "deep" / "c.mov").write_bytes(b"x")
+    out = tmp_path / "out"
+
+    def names(*inputs, **kwargs):
+        return [(i.source.name, i.output_dir.relative_to(out).as_posix())
+                for i in iter_inputs(inputs, out, **kwargs)]
+
+    assert names(str(tmp_path / "*.avi")) == [("a.avi", ".")]
+    assert names(str(tmp_path)) == [("a.avi", "."), ("b.mkv", ".")]
+    assert names(str(tmp_path), recursive=True) == [("a.avi", "."), ("b.mkv", "."), ("c.mov", "sub/deep")]
+    assert names(str(tmp_path / "**" / "*.mov")) == [("c.mov", ".")]
+    assert names("-", stdin=io.StringIO(f"{tmp_path / 'a.avi'}\n\n{tmp_path / 'b.mkv'}\n")) == [
+        ("a.avi", "."), ("b.mkv", ".")]
+    assert names("-", stdin=io.StringIO(f"{tmp_path / 'a.avi'}\0{tmp_path / 'b.mkv'}\0"),
+                 null_separated=True) == [("a.avi", "."), ("b.mkv", ".")]
+    assert names(str(tmp_path / "missing*.avi")) == [("missing*.avi", ".")]
+
+
+@pytest.mark.skipif(__import__("sys").platform == "win32", reason="скрипт-заглушка ffmpeg только для POSIX")
+def test_cli_batch_run(monkeypatch, tmp_path, capsys):
+    from videoconverter import cli, converter
+    monkeypatch.setenv("PATH", _fake_ffmpeg(tmp_path, (
+        "if 'bad' in sys.argv[sys.argv.index('-i') + 1]:\n"
+        "    sys.exit(1)\n"
+        "open(sys.argv[-1], 'wb').write(b'o')\n"
+        "print('progress=end', flush=True)"
+    )))
+    monkeypatch.setattr(converter, "get_video_duration", lambda p: 1.0)
+    src = tmp_path / "src"
+    src.mkdir()
+    for name in ("one.avi", "two.avi", "three.avi"):
+        (src / name).write_bytes(b"x")
+    out = tmp_path / "out"
+
+    assert cli.main([str(src), "-f", "mp4", "-o", str(out), "-j", "2"]) == cli.EXIT_OK
+    assert sorted(p.name for p in out.iterdir()) == ["one.mp4", "three.mp4", "two.mp4"]
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 3 and all(line.startswith("OK\t") for line in lines)
+
+    (src / "bad.avi").write_bytes(b"x")
+    code = cli.main([str(src / "*.avi"), str(src / "one.avi"), str(tmp_path / "nope.avi"),
+                     "-f", "mp4", "-o", str(out), "-j", "3"])
+    assert code == cli.EXIT_FAILED
+    failed = sorted(Path(line.split("\t")[1]).name for line in capsys.readouterr().out.splitlines()
+                    if line.startswith("FAIL"))
+    # bad.avi упал в ffmpeg, повтор one.avi занял бы тот же выход, nope.avi не существует
+    assert failed == ["bad.avi", "nope.avi", "one.avi"]
+
+    assert cli.main([str(src), "-f", "mkv2"]) == cli.EXIT_USAGE
+    captured = capsys.readouterr()
+    assert "mkv2" in captured.err and not captured.out  # ошибки использования — в stderr, stdout только для путей
+
+
+@pytest.mark.skipif(__import__("sys").platform == "win32", reason="скрипт-заглушка ffmpeg только для POSIX")
+def test_cli_batch_interrupt(monkeypatch, tmp_path):
+    import io
+    import threading
+    import time
+    from videoconverter import cli, converter
+    monkeypatch.setenv("PATH", _fake_ffmpeg(tmp_path, "import time\ntime.sleep(30)"))
+    monkeypatch.setattr(converter, "get_video_duration", lambda p: 1.0)
+    (tmp_path / "one.avi").write_bytes(b"x")
+    stop_event = threading.Event()
+
+    def items():
+        yield cli.BatchItem(tmp_path / "one.avi", tmp_path / "out")
+        time.sleep(0.5)  # ffmpeg успевает запуститься
+        raise KeyboardInterrupt
+
+    start = time.monotonic()
+    with pytest.raises(KeyboardInterrupt):
+        cli.run_batch(items(), converter.ConversionOptions("mp4", tmp_path / "out"), 2,
+                      cli.BatchProgress(io.StringIO(), enabled=False), io.StringIO(), stop_event)
+    # Пул не ждал 30 секунд ffmpeg: прерывание остановило его
+    assert stop_event.is_set() and time.monotonic() - start < 10
+
+
+# --- ТЕСТ 24: Кэш настроек с оповещением об изменениях ---
+def test_settings_store_caches_and_notifies(tmp_path, monkeypatch):
+    import os
+    from videoconverter.models import Settings
+    from videoconverter.settings_store import SettingsStore
+    path = tmp_path / "settings.json"
+    Settings(output_path="a").save(path)
+
+    loads = []
+    original_load = Settings.load.__func__
+    monkeypatch.setattr(Settings, "load", classmethod(lambda cls, p=None: loads.append(p) or original_load(cls, p)))
+    store = SettingsStore(path)
+    seen = []
+    unsubscribe = store.subscribe(seen.append)
+
+    assert store.get().output_path == "a"
+    store.get().default_profile.format = "avi"  # копия: кэш не портится
+    assert store.get().default_profile.format == "mp4"
+    assert len(loads) == 1 and seen == []
+
+    store.update(lambda s: setattr(s, "output_path", "b"))
+    assert [s.output_path for s in seen] == ["b"]
+    assert Settings.load(path).output_path == "b" and not (tmp_path / "settings.json.tmp").exists()
+
+    # Правка файла извне: замечаем по mtime и оповещаем подписчиков
+    Settings(output_path="c").save(path)
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert store.get().output_path == "c"
+    assert [s.output_path for s in seen] == ["b", "c"]
+
+    unsubscribe()
+    store.save(Settings(output_path="d"))
+    assert len(seen) == 2 and store.get().output_path == "d"
+
+    # update оповещает уже без блокировки: обработчик может читать store из другого потока
+    import threading
+    readers = []
+
+    def read_elsewhere(settings):
+        reader = threading.Thread(target=store.get)
+        reader.start()
+        reader.join(5)
+        readers.append(reader)
+
+    store.subscribe(read_elsewhere)
+    assert store.update(lambda s: setattr(s, "output_path", "e")).output_path == "e"
+    assert readers and not readers[0].is_alive()
+
+
+# --- ТЕСТ 25: Превью в том же проходе ffmpeg ---
+def test_preview_plan_and_vtt(tmp_path):
+    from videoconverter.ladder import build_ladder_command
+    from videoconverter.models import FormatProfile
+    from videoconverter.previews import preview_plan, preview_branches, build_preview_command, write_sprite_vtt
+    from videoconverter.probe import MediaInfo, StreamInfo
+    assert preview_plan(FormatProfile(), tmp_path, "clip") is None
+
+    info = MediaInfo(duration=250.0, streams=[StreamInfo(index=0, codec_type="video", codec_name="h264",
+                                                         width=1280, height=720)])
+    profile = FormatProfile(poster=True, preview_interval=10, preview_width=160, preview_tile="5x4")
+    plan = preview_plan(profile, tmp_path, "clip", info)
+    assert (plan.width, plan.height, plan.cue_count, plan.poster_time) == (160, 90, 25, 25.0)
+    assert [p.name for p in plan.files] == ["clip_poster.jpg", "clip_sprite_001.jpg", "clip_sprite_002.jpg",
+                                            "clip_sprite.vtt"]
+
+    options = ConversionOptions(target_format="mp4", output_dir=tmp_path, resolution="1920x1080")
+    cmd = build_ladder_command(tmp_path / "in.avi", [(tmp_path / "clip.mp4", options)], preview_branches(plan))
+    graph = cmd[cmd.index("-filter_complex") + 1]
+    # Один декодер на все: основной выход и обе ветки превью растут из одного split
+    assert cmd.count("-i") == 1
+    assert graph.startswith("[0:v:0]split=3[s0][x0][x1];[s0]scale=1920:1080[v0];[x0]trim=start=25.0,")
+    assert "[x1]fps=1/10,scale=160:90,tile=5x4[xv1]" in graph
+    assert cmd[-1].endswith("clip_sprite_%03d.jpg") and "-frames:v" in cmd
+
+    keyframes = build_preview_command(tmp_path / "in.avi", plan)
+    assert keyframes[2:4] == ["-skip_frame", "nokey"]
+
+    vtt = write_sprite_vtt(plan).read_text(encoding="utf-8").splitlines()
+    assert vtt[:4] == ["WEBVTT", "", "00:00:00.000 --> 00:00:10.000", "clip_sprite_001.jpg#xywh=0,0,160,90"]
+    assert "clip_sprite_001.jpg#xywh=640,270,160,90" in vtt  # 20-я миниатюра — последняя на первом листе
+    assert vtt[-2:] == ["00:04:00.000 --> 00:04:10.000", "clip_sprite_002.jpg#xywh=640,0,160,90"]
+
+
+@pytest.mark.skipif(__import__("sys").platform == "win32", reason="скрипт-заглушка ffmpeg только для POSIX")
+def test_service_previews_single_pass(monkeypatch, tmp_path, make_service):
+    from videoconverter import ladder, service as service_module
+    from videoconverter.models import FormatProfile, Job, JobState
+    from videoconverter.probe import MediaInfo, StreamInfo
+    calls = tmp_path / "calls.txt"
+    monkeypatch.setenv("PATH", _fake_ffmpeg(tmp_path, (
+        f"open({str(calls)!r}, 'a').write(' '.join(sys.argv) + '\\n')\n"
+        "for arg in sys.argv:\n"
+        "    if arg.endswith(('.mp4', '.jpg')) and 'in.avi' not in arg:\n"
+        "        open(arg.replace('%03d', '001'), 'wb').write(b'o')\n"
+        "print('progress=end', flush=True)"
+    )))
+    info = MediaInfo(duration=20.0, streams=[StreamInfo(index=0, codec_type="video", codec_name="mpeg4",
+                                                        width=640, height=360)])
+    monkeypatch.setattr(service_module, "probe_media", lambda path, cache=None: info)
+    monkeypatch.setattr(ladder, "get_video_duration", lambda path: 20.0)
+
+    source = tmp_path / "in.avi"
+    source.write_bytes(b"s")
+    service = make_service()
+    job = Job(source_path=source, output_dir=tmp_path / "out",
+              profile=FormatProfile(poster=True, preview_interval=5, preview_tile="2x2"))
+    service.add_job(job)
+    assert service.queue.claim_next() is job
+    service._run_job(job)
+
+    assert job.state == JobState.DONE
+    assert len(calls.read_text().splitlines()) == 1  # превью не потребовали второго запуска ffmpeg
+    assert [p.name for p in job.previews] == ["in_poster.jpg", "in_sprite_001.jpg", "in_sprite.vtt"]
+
+
+# --- ТЕСТ 26: Шина событий сервиса ---
+def test_event_bus_coalesces_throttles_and_drops(tmp_path, make_service):
+    from uuid import uuid4
+    from videoconverter.events import (EventBus, JobAdded, JobPriorityChanged, JobProgress, JobRemoved,
+                                       JobStateChanged, ServiceStateChanged)
+    from videoconverter.models import Job, JobState, FormatProfile
+    bus = EventBus(progress_interval=0)
+    sub = bus.subscribe(maxsize=3)
+    a, b = uuid4(), uuid4()
+    for p in range(100):
+        bus.publish(JobProgress(a, p))  # непрочитанный прогресс сливается в одно событие
+    bus.publish(JobStateChanged(b, JobState.RUNNING, 0, 0))
+    assert [(type(e), getattr(e, "progress", None)) for e in sub.drain()] == [
+        (JobProgress, 99), (JobStateChanged, 0)]
+    for state in (JobState.RUNNING, JobState.DONE, JobState.FAILED, JobState.CANCELLED):
+        bus.publish(JobStateChanged(a, state, 0, 0))
+    assert sub.dropped == 1  # самое старое событие вытеснено
+    assert [e.state for e in sub.drain()] == [JobState.DONE, JobState.FAILED, JobState.CANCELLED]
+    assert sub.get(timeout=0.01) is None
+
+    # Частый прогресс придерживается и уходит перед сменой состояния
+    bus = EventBus(progress_interval=60)
+    sub = bus.subscribe(types=(JobProgress, JobStateChanged))
+    bus.publish(JobProgress(a, 10))
+    bus.publish(JobProgress(a, 50))
+    assert [e.progress for e in sub.drain()] == [10]
+    bus.publish(ServiceStateChanged(running=True, paused=False))  # не нужен подписчику, но выпускает придержанное
+    bus.publish(JobStateChanged(a, JobState.DONE, 100, 0))
+    assert [type(e) for e in sub.drain()] == [JobProgress, JobStateChanged]
+    sub.close()
+    bus.publish(JobProgress(b, 1))
+    assert len(sub) == 0
+
+    # Без следующих событий задачи придержанный прогресс уходит по таймеру; итог задачи чистит отметки
+    bus = EventBus(progress_interval=0.05)
+    sub = bus.subscribe()
+    bus.publish(JobProgress(a, 10))
+    bus.publish(JobProgress(a, 40))
+    assert sub.get(timeout=1).progress == 10
+    assert sub.get(timeout=1).progress == 40
+    bus.publish(JobStateChanged(a, JobState.FAILED, 40, 0))
+    assert sub.get(timeout=1).state == JobState.FAILED and not bus._last_sent
+
+    service = make_service(progress_interval=0)
+    seen = []
+    remove = service.events.add_listener(seen.append)
+    job = Job(source_path=tmp_path / "a.avi", output_dir=tmp_path, profile=FormatProfile())
+    service.add_job(job)
+    service.set_job_priority(job.id, 10)
+    service.pause_processing()
+    service.remove_job(job.id)
+    remove()
+    service.resume_processing()
+    assert [type(e) for e in seen] == [JobAdded, JobPriorityChanged, ServiceStateChanged, JobRemoved]
+    assert seen[1].priority == 10 and seen[2].paused
+
+
+# --- ТЕСТ 27: Пауза и отмена отдельной задачи ---
+@pytest.mark.skipif(__import__("sys").platform == "win32", reason="скрипт-заглушка ffmpeg только для POSIX")
+def test_pause_and_cancel_single_job(monkeypatch, tmp_path, make_service):
+    import time
+    import psutil
+    from videoconverter.models import Job, FormatProfile, JobState
+    monkeypatch.setenv("PATH", _fake_ffmpeg(tmp_path, (
+        "for i in range(30):\n"
+        "    print(f'out_time_us={i * 100000}\\nprogress=continue', flush=True)\n"
+        "    time.sleep(0.05)\n"
+        "open(sys.argv[-1], 'wb').write(b'o')\n"
+        "print('progress=end', flush=True)"
+    )))
+    service = make_service(max_workers=2)
+    jobs = []
+    for name in ("a.avi", "b.avi"):
+        (tmp_path / name).write_bytes(b"s")
+        jobs.append(Job(source_path=tmp_path / name, output_dir=tmp_path / "out", profile=FormatProfile()))
+        service.add_job(jobs[-1])
+    a, b = jobs
+
+    def wait_for(condition, timeout=10.0):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.02)
+        return condition()
+
+    service.start_processing()
+    assert wait_for(lambda: all(c._processes for c in list(service._controls.values())) and len(service._controls) == 2)
+    started_at = a.started_at
+    waits = service.queue.wait_stats["priority"].count
+    assert service.pause_job(a.id)
+    assert not service.pause_job(a.id)  # уже на паузе
+    process = service._controls[a.id]._processes[-1]
+    assert wait_for(lambda: process.status() == psutil.STATUS_STOPPED)
+
+    # Вторая задача не останавливается и завершается, пока первая стоит
+    assert wait_for(lambda: b.state == JobState.DONE)
+    assert a.state == JobState.PAUSED and process.status() == psutil.STATUS_STOPPED
+
+    assert service.resume_job(a.id) and a.state == JobState.RUNNING
+    # Продолжение после паузы — не новый старт: время ожидания в очереди не пересчитывается
+    assert a.started_at == started_at and service.queue.wait_stats["priority"].count == waits
+    assert wait_for(lambda: process.status() != psutil.STATUS_STOPPED)
+    assert service.cancel_job(a.id)
+    assert wait_for(lambda: a.state == JobState.CANCELLED)
+    assert not service.cancel_job(a.id) and not service.resume_job(a.id)
+    assert not service._controls
+
+
+# --- ТЕСТ 28: Готовность файлов горячей папки без пауз ---
+def test_readiness_quiescence_and_container(tmp_path):
+    import struct
+    from videoconverter.readiness import ReadinessTracker, container_complete
+
+    def atom(kind, payload=b""):
+        return struct.pack(">I4s", 8 + len(payload), kind) + payload
+
+    mp4 = tmp_path / "a.mp4"
+    mp4.write_bytes(atom(b"ftyp", b"isom") + atom(b"mdat", b"x" * 100))
+    assert not container_complete(mp4)  # moov еще не записан
+    mp4.write_bytes(mp4.read_bytes() + atom(b"moov", b"m" * 20))
+    assert container_complete(mp4)
+    mp4.write_bytes(mp4.read_bytes()[:-5])  # обрезан на середине атома
+    assert not container_complete(mp4)
+
+    avi = tmp_path / "b.avi"
+    avi.write_bytes(b"RIFF" + struct.pack("<I", 12) + b"AVI " + b"\0" * 8)
+    assert container_complete(avi)
+    avi.write_bytes(b"RIFF" + struct.pack("<I", 100) + b"AVI ")
+    assert not container_complete(avi)
+
+    now = [0.0]
+    tracker = ReadinessTracker(quiet_seconds=2.0, clock=lambda: now[0])
+    mkv = tmp_path / "c.mkv"
+    mkv.write_bytes(b"1")
+    assert not tracker.check(mkv) and tracker.due() == []
+    now[0] = 1.5
+    mkv.write_bytes(b"12")  # запись продолжается — окно тишины начинается заново
+    assert not tracker.check(mkv)
+    now[0] = 3.0
+    assert tracker.due() == [] and tracker.next_due(10) == 0.5
+    now[0] = 3.6
+    assert tracker.due() == [mkv]
+    assert tracker.check(mkv) and len(tracker) == 0
+
+    # Подтвержденная запись не ждет тишины, но контейнер все равно проверяется
+    partial = tmp_path / "d.mp4"
+    partial.write_bytes(atom(b"ftyp") + atom(b"mdat", b"x"))
+    assert not tracker.check(partial, confirmed=True)
+    now[0] = 10.0
+    assert not tracker.check(partial)  # неполный файл перепроверяется не раньше чем через REJECT_BACKOFF
+    assert not tracker.check(mp4, confirmed=True)  # обрезанный файл выше
+    partial.write_bytes(partial.read_bytes() + atom(b"moov"))
+    assert tracker.check(partial, confirmed=True)
+
+    tracker.configure(0, "ffprobe")
+    assert tracker.check_mode == "ffprobe"
+    tracker.configure(0, "bogus")
+    assert tracker.check_mode == "container"
+
+
+# --- ТЕСТ 29: Несколько горячих папок, рекурсия и правила ---
+def test_hot_folder_rules_and_incremental_index(monkeypatch, tmp_path):
+    import json
+    import os
+    import time
+    from videoconverter import watcher as watcher_module
+    from videoconverter.hot_folder import hot_folder_rules, match_rule, rule_output_dir, rule_profile, watch_roots
+    from videoconverter.models import HotFolderRule, Settings
+    from videoconverter.service import VIDEO_EXTENSIONS
+
+    ingest, out = tmp_path / "ingest", tmp_path / "out"
+    (ingest / "a" / "b").mkdir(parents=True)
+    (tmp_path / "flat").mkdir()
+    settings_file = tmp_path / "settings.json"
+    settings_file.write_text(json.dumps({
+        "output_path": str(out), "hot_folder_enabled": True, "hot_folder_path": str(tmp_path / "flat"),
+        "hot_folders": [{"path": str(ingest), "recursive": True, "include": ["*.mov", "raw/*.mxf"],
+                         "exclude": ["*_proxy.*"], "output_path": str(ingest / "done"),
+                         "profile": {"format": "mkv", "crf": 20}}],
+    }), encoding="utf-8")
+    settings = Settings.load(settings_file)
+    rules = hot_folder_rules(settings)
+    assert [r.path for r in rules] == [str(ingest), str(tmp_path / "flat")]
+    assert watch_roots(rules) == ((tmp_path / "flat", False), (ingest, True))
+
+    def match(path):
+        return match_rule(rules, path, settings.output_path, VIDEO_EXTENSIONS)
+
+    clip = ingest / "a" / "b" / "clip.mov"
+    assert match(clip) is rules[0]
+    assert rule_output_dir(rules[0], clip, settings.output_path) == ingest / "done" / "a" / "b"
+    assert rule_profile(rules[0], settings).format == "mkv"
+    assert match(ingest / "raw" / "cam.mxf") is rules[0]  # шаблон с "/" — путь от корня канала
+    assert match(ingest / "a" / "cam.mxf") is None
+    assert match(ingest / "a" / "clip_proxy.mov") is None
+    assert match(ingest / "a" / "clip.mp4") is None  # include задан — расширения по умолчанию не действуют
+    assert match(ingest / "done" / "a" / "clip.mov") is None  # результат канала не возвращается на вход
+    assert match(tmp_path / "flat" / "x.avi") is rules[1]
+    assert match(tmp_path / "flat" / "sub" / "x.avi") is None  # без рекурсии
+    assert rule_profile(rules[1], settings) == settings.default_profile
+    assert HotFolderRule.from_dict({"path": "p"}).profile is None
+
+    # Повторный проход перечитывает только папки, у которых сменился mtime
+    monkeypatch.setattr(watcher_module, "RACY_NS", 0)
+    reads = []
+    original_read = watcher_module.DirectoryIndex._read
+
+    def counting_read(self, directory, recursive, stale):
+        reads.append(directory.name)
+        return original_read(self, directory, recursive, stale)
+
+    monkeypatch.setattr(watcher_module.DirectoryIndex, "_read", counting_read)
+    old = time.time_ns() - 10_000_000_000
+
+    def touch_dir(directory, shift):
+        os.utime(directory, ns=(old + shift, old + shift))
+
+    clip.write_bytes(b"1")
+    for shift, directory in enumerate((ingest, ingest / "a", ingest / "a" / "b")):
+        touch_dir(directory, shift)
+    index = watcher_module.DirectoryIndex([(ingest, True)])
+    assert index.scan() == [clip]
+    assert sorted(reads) == ["a", "b", "ingest"]
+    reads.clear()
+    assert index.scan() == [] and reads == []
+
+    (ingest / "a" / "new").mkdir()
+    (ingest / "a" / "new" / "n.mov").write_bytes(b"2")
+    touch_dir(ingest / "a", 10)
+    touch_dir(ingest / "a" / "new", 11)
+    assert index.scan() == [ingest / "a" / "new" / "n.mov"]
+    assert sorted(reads) == ["a", "new"]
+    assert len(index) == 4
+
+
+@pytest.mark.skipif(not __import__("sys").platform.startswith("linux"), reason="inotify есть только в Linux")
+def test_inotify_watcher_recursive(tmp_path):
+    import time
+    from videoconverter.watcher import InotifyWatcher
+    watcher = InotifyWatcher([(tmp_path, True)])
+    try:
+        assert watcher.poll(0) == []
+        sub = tmp_path / "a" / "b"
+        sub.mkdir(parents=True)
+        (sub / "early.mp4").write_bytes(b"1")  # записан до того, как наблюдатель подключил папку
+        events = []
+        deadline = time.monotonic() + 5
+        while not any(e.path.name == "early.mp4" for e in events) and time.monotonic() < deadline:
+            events.extend(watcher.poll(0.2))
+        assert sub / "early.mp4" in [e.path for e in events]
+        (sub / "late.mp4").write_bytes(b"2")
+        events = watcher.poll(1.0)
+        assert [(e.path, e.confirmed) for e in events] == [(sub / "late.mp4", True)]
+    finally:
+        watcher.close()
+
+
+# --- ТЕСТ 30: Остановка сервиса дожидается ffmpeg ---
+@pytest.mark.skipif(__import__("sys").platform == "win32", reason="скрипт-заглушка ffmpeg только для POSIX")
+def test_wait_stopped_reaps_ffmpeg(monkeypatch, tmp_path, make_service):
+    import time
+    import psutil
+    from videoconverter.models import Job, FormatProfile, JobState
+    monkeypatch.setenv("PATH", _fake_ffmpeg(tmp_path, "time.sleep(30)"))
+    service = make_service(max_workers=2)
+    jobs = []
+    for name in ("a.avi", "b.avi"):
+        (tmp_path / name).write_bytes(b"s")
+        jobs.append(Job(source_path=tmp_path / name, output_dir=tmp_path / "out", profile=FormatProfile()))
+        service.add_job(jobs[-1])
+    service.start_processing()
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline and not (
+            len(service._controls) == 2 and all(c._processes for c in list(service._controls.values()))):
+        time.sleep(0.02)
+    processes = [c._processes[-1] for c in list(service._controls.values())]
+    assert service.pause_job(jobs[0].id)  # спящий процесс тоже должен завершиться
+
+    service.stop_processing()
+    assert service.wait_stopped(10)
+    assert [j.state for j in jobs] == [JobState.CANCELLED] * 2
+    assert not any(p.is_running() and p.status() != psutil.STATUS_ZOMBIE for p in processes)
+
+
+def test_service_shutdown_releases_threads(tmp_path):
+    from videoconverter.models import Settings
+    from videoconverter.service import ConverterService
+    from videoconverter.settings_store import SettingsStore
+    path = tmp_path / "settings.json"
+    Settings(output_path=str(tmp_path), hot_folder_enabled=False).save(path)
+    store = SettingsStore(path)
+    service = ConverterService(max_workers=1, engine="asyncio", settings_store=store)
+    service.start_processing()
+
+    assert service.shutdown(timeout=10)
+    assert not service._watcher_thread.is_alive()
+    assert not service._async_engine.loop.is_running()
+    assert not store._listeners  # сервис отписался от настроек
+
+
+def test_service_from_settings(tmp_path):
+    from videoconverter.models import Settings
+    from videoconverter.service import ConverterService
+    from videoconverter.settings_store import SettingsStore
+    path = tmp_path / "settings.json"
+    Settings(output_path=str(tmp_path), hot_folder_enabled=False, max_workers=3, engine="asyncio", job_timeout=5,
+             resource_scheduler=True, queue_policy="fifo", journal_path=str(tmp_path / "jobs.db"),
+             output_cache_path=str(tmp_path / "cache")).save(path)
+    service = ConverterService.from_settings(SettingsStore(path))
+    try:
+        assert (service.max_workers, service.engine, service.job_timeout) == (3, "asyncio", 5)
+        assert service.scheduler is not None and service.output_cache is not None
+        assert service.journal is not None and service.queue.policy.name == "fifo"
+    finally:
+        service.shutdown(timeout=10)
+        service.journal.close()
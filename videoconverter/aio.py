@@ -0,0 +1,132 @@
+import asyncio
+import concurrent.futures
+import threading
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, Optional, TypeVar
+
+import psutil
+
+from .converter import (ConversionOptions, ConversionError, FfmpegRun, build_ffmpeg_command, ffmpeg_progress,
+                        get_video_duration)
+from .progress import ProgressInfo
+
+T = TypeVar("T")
+
+
+class AsyncConversion:
+    """
+    Одно кодирование на asyncio: процесс ведет ffmpeg_progress,
+    прогресс читается как асинхронный итератор (async for info in conversion).
+    convert_file — синхронная обертка над этим же классом.
+    pause()/resume()/cancel() можно вызывать из любого потока; pause_event/stop_event
+    опрашиваются так же, как в синхронном API.
+    """
+
+    def __init__(self, input_file: Path, options: ConversionOptions, timeout: Optional[float] = None,
+                 process_callback: Optional[Callable[[psutil.Process], None]] = None,
+                 duration: Optional[float] = None, pause_event: Optional[threading.Event] = None,
+                 stop_event: Optional[threading.Event] = None):
+        self.input_file = input_file
+        self.options = options
+        self.timeout = timeout
+        self.duration = duration  # None — узнать через ffprobe перед запуском
+        self.pause_event = pause_event
+        self.stop_event = stop_event
+        self.output_file = options.output_dir / f"{input_file.stem}.{options.target_format.lstrip('.')}"
+        self._run = FfmpegRun(process_callback=process_callback)
+        self._started = False
+
+    # --- Управление (потокобезопасно) ---
+    def pause(self) -> None:
+        self._run.pause()  # если процесс еще не запущен, он будет приостановлен сразу после старта
+
+    def resume(self) -> None:
+        self._run.resume()
+
+    def cancel(self) -> None:
+        self._run.cancel()
+
+    @property
+    def paused(self) -> bool:
+        return self._run.paused
+
+    @property
+    def total_duration(self) -> float:
+        return self._run.total_duration
+
+    @property
+    def last_info(self) -> Optional[ProgressInfo]:
+        return self._run.last_info
+
+    # --- Выполнение ---
+    def __aiter__(self) -> AsyncIterator[ProgressInfo]:
+        return self.progress()
+
+    async def progress(self) -> AsyncIterator[ProgressInfo]:
+        if self._started:
+            raise RuntimeError("Кодирование уже запущено")
+        self._started = True
+        if not self.input_file.exists():
+            raise ConversionError(f"Файл не найден: {self.input_file}")
+        cmd = build_ffmpeg_command(self.input_file, self.output_file, self.options)
+        if self.duration is None:
+            # ffprobe блокирующий, поэтому уводим его из event loop
+            self.duration = await asyncio.to_thread(get_video_duration, self.input_file)
+        self._run.total_duration = self.duration
+
+        print(f"[INFO] Конвертация: {self.input_file} -> {self.output_file}")
+        async for info in ffmpeg_progress(cmd, self._run, self.timeout, self.pause_event, self.stop_event):
+            yield info
+
+    async def run(
+            self,
+            progress_callback: Optional[Callable[[int], None]] = None,
+            metrics_callback: Optional[Callable[[ProgressInfo], None]] = None,
+    ) -> None:
+        """Выполняет кодирование до конца, вызывая те же колбэки, что и convert_file."""
+        self._run.progress_callback = progress_callback
+        self._run.metrics_callback = metrics_callback
+        async for _ in self:
+            pass
+        print(f"[OK] Готово: {self.output_file}")
+
+    def percent(self, info: ProgressInfo) -> Optional[int]:
+        return self._run.percent(info)
+
+
+async def convert_file_async(
+        input_file: Path,
+        options: ConversionOptions,
+        progress_callback: Optional[Callable[[int], None]] = None,
+        metrics_callback: Optional[Callable[[ProgressInfo], None]] = None,
+        timeout: Optional[float] = None,
+) -> None:
+    """Асинхронный аналог convert_file. Отмена задачи asyncio завершает ffmpeg."""
+    await AsyncConversion(input_file, options, timeout).run(progress_callback, metrics_callback)
+
+
+class AsyncEngine:
+    """Один event loop в фоновом потоке, на котором выполняется множество кодирований."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name="async-engine", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro: Awaitable[T]) -> "concurrent.futures.Future[T]":
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+        """Синхронная обертка: выполняет корутину на цикле движка и ждет результат."""
+        return self.submit(coro).result(timeout)
+
+    def close(self) -> None:
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout=5)
+        if not self.loop.is_running():
+            self.loop.close()
@@ -1,8 +1,18 @@
 import argparse
+import contextlib
+import glob
+import os
 import re
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, replace
 from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, TextIO
 
-from .converter import ConversionOptions, convert_file
+from .converter import ConversionError, ConversionOptions, convert_file, ENCODER_PRESETS
+from .service import VIDEO_EXTENSIONS, resolve_worker_count
 
 # допустимые форматы выходного видео
 VALID_FORMATS = {"mp4", "avi", "mkv", "mov", "wmv"}
@@ -13,6 +23,11 @@ BITRATE_PATTERN = re.compile(r"^\d+[kKmM]?$")
 # шаблон для разрешения вида 1920x1080
 RESOLUTION_PATTERN = re.compile(r"^\d+x\d+$")
 
+# коды завершения: 0 — все файлы готовы, 1 — были ошибки, 2 — неверные аргументы, 130 — прервано
+EXIT_OK, EXIT_FAILED, EXIT_USAGE, EXIT_INTERRUPTED = 0, 1, 2, 130
+
+PROGRESS_INTERVAL = 0.5  # как часто перерисовываем строку общего прогресса
+
 
 def _build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
@@ -22,8 +37,8 @@ def _build_parser() -> argparse.ArgumentParser:
 
     parser.add_argument(
         "inputs",
-        nargs="+",                      # один или больше аргументов
-        help="Пути к исходным видеофайлам"
+        nargs="*",                      # файлы, папки или шаблоны; "-" — читать список из stdin
+        help="Исходные видеофайлы, папки или шаблоны (*.avi, **/*.mkv); '-' — список путей из stdin"
     )
 
     parser.add_argument(
@@ -57,6 +72,67 @@ def _build_parser() -> argparse.ArgumentParser:
         help="Разрешение выходного видео, например 1920x1080"
     )
 
+    parser.add_argument(
+        "--video-codec",
+        type=str,
+        help="Видео-кодек, например h264, hevc, mpeg4 или copy"
+    )
+
+    parser.add_argument(
+        "--audio-codec",
+        type=str,
+        help="Аудио-кодек, например aac, mp3, ac3 или copy"
+    )
+
+    parser.add_argument(
+        "--preset",
+        choices=ENCODER_PRESETS,
+        help="Пресет скорости энкодера x264/x265, например veryfast"
+    )
+
+    parser.add_argument(
+        "--crf",
+        type=int,
+        help="Кодирование с постоянным качеством (битрейт видео становится потолком)"
+    )
+
+    parser.add_argument(
+        "--threads",
+        type=int,
+        help="Число потоков энкодера"
+    )
+
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=0,
+        help="Сколько файлов кодировать одновременно (по умолчанию: ядра CPU / --threads, иначе 1)"
+    )
+
+    parser.add_argument(
+        "-r", "--recursive",
+        action="store_true",
+        help="Искать видео во вложенных папках; структура папок повторяется в директории вывода"
+    )
+
+    parser.add_argument(
+        "-0", "--null",
+        action="store_true",
+        help="Пути в stdin разделены нулевым байтом (как у find -print0)"
+    )
+
+    parser.add_argument(
+        "--no-progress",
+        action="store_true",
+        help="Не показывать строку общего прогресса (она выводится в stderr только в терминале)"
+    )
+
+    parser.add_argument(
+        "-v", "--verbose",
+        action="store_true",
+        help="Печатать подробный лог кодирования каждого файла"
+    )
+
     return parser
 
 
@@ -72,16 +148,215 @@ def _validate_bitrate(label: str, value: str | None) -> str | None:
     if not BITRATE_PATTERN.fullmatch(normalized):
         print(
             f"[ERROR] Неверный {label} битрейт: '{value}'. "
-            "Ожидается целое число и опционально суффикс k или M, например 800k или 2M."
+            "Ожидается целое число и опционально суффикс k или M, например 800k или 2M.",
+            file=sys.stderr,
         )
         return None
 
     return normalized
 
 
-def main() -> None:
+@dataclass
+class BatchItem:
+    source: Path
+    output_dir: Path
+
+
+@dataclass
+class BatchResult:
+    source: Path
+    output: Optional[Path]
+    ok: bool
+    seconds: float = 0.0
+    error: str = ""
+
+
+def _read_stdin_paths(stream: TextIO, null_separated: bool) -> Iterator[str]:
+    if null_separated:
+        buffer = ""
+        for chunk in iter(lambda: stream.read(65536), ""):
+            buffer += chunk
+            *names, buffer = buffer.split("\0")
+            yield from (name for name in names if name)
+        if buffer:
+            yield buffer
+    else:
+        for line in stream:
+            name = line.rstrip("\r\n")
+            if name.strip():
+                yield name
+
+
+def iter_inputs(inputs: Iterable[str], output_dir: Path, recursive: bool = False,
+                stdin: Optional[TextIO] = None, null_separated: bool = False) -> Iterator[BatchItem]:
+    """
+    Разворачивает аргументы в список файлов лениво, чтобы длинный список из stdin
+    начинал обрабатываться сразу. Папки дают видеофайлы по расширению; при -r файлы из
+    вложенных папок попадают в такие же подпапки директории вывода. Несуществующие пути
+    передаются дальше — о них сообщит сводка.
+    """
+    for raw in inputs:
+        if raw == "-":
+            if stdin is not None:
+                yield from iter_inputs(_read_stdin_paths(stdin, null_separated), output_dir, recursive)
+            continue
+        # Шаблоны раскрываем сами: в Windows и в кавычках оболочка этого не делает
+        paths = [Path(p) for p in sorted(glob.glob(raw, recursive=True))] if glob.has_magic(raw) else [Path(raw)]
+        if not paths:
+            yield BatchItem(Path(raw), output_dir)  # шаблон ничего не нашел
+        for path in paths:
+            if not path.is_dir():
+                yield BatchItem(path, output_dir)
+                continue
+            found = path.rglob("*") if recursive else path.iterdir()
+            for file in sorted(found):
+                if file.is_file() and file.suffix.lower() in VIDEO_EXTENSIONS:
+                    yield BatchItem(file, output_dir / file.parent.relative_to(path))
+
+
+class BatchProgress:
+    """Одна строка общего прогресса в stderr: готово/ошибок/в работе и проценты активных файлов."""
+
+    def __init__(self, stream: TextIO, enabled: bool):
+        self.stream = stream
+        self.enabled = enabled
+        self.done = 0
+        self.failed = 0
+        self.submitted = 0
+        self.input_finished = False
+        self._active: Dict[Path, int] = {}
+        self._lock = threading.Lock()
+        self._last_draw = 0.0
+        self._width = 0
+
+    def started(self, source: Path) -> None:
+        with self._lock:
+            self._active[source] = 0
+        self.draw()
+
+    def update(self, source: Path, percent: int) -> None:
+        with self._lock:
+            self._active[source] = percent
+        self.draw()
+
+    def finished(self, result: BatchResult) -> None:
+        with self._lock:
+            self._active.pop(result.source, None)
+            if result.ok:
+                self.done += 1
+            else:
+                self.failed += 1
+        self.draw(force=True)
+
+    def draw(self, force: bool = False) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_draw < PROGRESS_INTERVAL:
+                return
+            self._last_draw = now
+            total = str(self.submitted) if self.input_finished else f"{self.submitted}+"
+            active = ", ".join(f"{p.name} {pct}%" for p, pct in list(self._active.items())[:3])
+            more = f" и еще {len(self._active) - 3}" if len(self._active) > 3 else ""
+            line = f"[{self.done + self.failed}/{total}] ошибок: {self.failed} | {active}{more}"
+            padding = " " * max(0, self._width - len(line))
+            self._width = len(line)
+            self.stream.write(f"\r{line}{padding}")
+            self.stream.flush()
+
+    def clear(self) -> None:
+        if self.enabled and self._width:
+            self.stream.write("\r" + " " * self._width + "\r")
+            self.stream.flush()
+
+
+def run_batch(items: Iterable[BatchItem], options: ConversionOptions, jobs: int,
+              progress: BatchProgress, report: TextIO, stop_event: threading.Event) -> List[BatchResult]:
+    """
+    Кодирует файлы пулом из jobs потоков. Файлы подаются в пул по мере освобождения мест,
+    поэтому список из тысяч путей не создает тысячи ожидающих задач.
+    Итог каждого файла сразу печатается в report одной строкой (удобно для конвейеров).
+    """
+    results: List[BatchResult] = []
+    claimed: Set[Path] = set()
+    pending: Set[Future] = set()
+
+    def encode(item: BatchItem, output: Path) -> BatchResult:
+        progress.started(item.source)
+        start = time.monotonic()
+        try:
+            item.output_dir.mkdir(parents=True, exist_ok=True)
+            convert_file(item.source, replace(options, output_dir=item.output_dir),
+                         progress_callback=lambda p: progress.update(item.source, p), stop_event=stop_event)
+            return BatchResult(item.source, output, True, time.monotonic() - start)
+        except (ConversionError, OSError) as exc:
+            # В сводку идет первая строка: хвост stderr ffmpeg слишком длинный для таблицы
+            message = str(exc).splitlines()[0] if str(exc) else type(exc).__name__
+            return BatchResult(item.source, output, False, time.monotonic() - start, message)
+
+    def record(result: BatchResult) -> None:
+        results.append(result)
+        progress.finished(result)
+        progress.clear()
+        if result.ok:
+            report.write(f"OK\t{result.source}\t{result.output}\t{result.seconds:.1f}s\n")
+        else:
+            report.write(f"FAIL\t{result.source}\t{result.error}\n")
+        report.flush()
+        progress.draw(force=True)
+
+    def collect(block: bool) -> None:
+        nonlocal pending
+        if not pending:
+            return
+        done, pending = wait(pending, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for future in done:
+            record(future.result())
+
+    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="cli-encode") as pool:
+        try:
+            for item in items:
+                if stop_event.is_set():
+                    break
+                output = item.output_dir / f"{item.source.stem}.{options.target_format}"
+                error = _check_item(item, output, claimed)
+                if error:
+                    progress.submitted += 1
+                    record(BatchResult(item.source, None, False, error=error))
+                    continue
+                claimed.add(output.resolve())
+                while len(pending) >= jobs:
+                    collect(block=True)
+                progress.submitted += 1
+                pending.add(pool.submit(encode, item, output))
+                collect(block=False)
+            progress.input_finished = True
+            while pending:
+                collect(block=True)
+        except KeyboardInterrupt:
+            # Выход из with ждет потоки пула: сначала останавливаем ffmpeg и снимаем невзятые файлы
+            stop_event.set()
+            for future in pending:
+                future.cancel()
+            raise
+    return results
+
+
+def _check_item(item: BatchItem, output: Path, claimed: Set[Path]) -> str:
+    if not item.source.is_file():
+        return "файл не найден"
+    resolved = output.resolve()
+    if resolved == item.source.resolve():
+        return "выходной файл совпадает с исходным (укажите другой формат или папку вывода)"
+    if resolved in claimed:
+        return f"выходной файл {output} уже занят другим исходником с тем же именем"
+    return ""
+
+
+def main(argv: Optional[List[str]] = None) -> int:
     parser = _build_parser()
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # нормализуем формат
     target_format = args.format.lower()
@@ -89,9 +364,10 @@ def main() -> None:
     if target_format not in VALID_FORMATS:
         print(
             f"[ERROR] Неверный формат: '{args.format}'. "
-            f"Допустимые: {', '.join(sorted(VALID_FORMATS))}"
+            f"Допустимые: {', '.join(sorted(VALID_FORMATS))}",
+            file=sys.stderr,
         )
-        return
+        return EXIT_USAGE
 
     # нормализуем разрешение и проверяем формат
     resolution = None
@@ -101,36 +377,29 @@ def main() -> None:
         if not RESOLUTION_PATTERN.fullmatch(normalized_res):
             print(
                 f"[ERROR] Неверный формат разрешения: '{args.resolution}'. "
-                "Ожидается вид WIDTHxHEIGHT (например, 1920x1080)."
+                "Ожидается вид WIDTHxHEIGHT (например, 1920x1080).",
+                file=sys.stderr,
             )
-            return
+            return EXIT_USAGE
         resolution = normalized_res
 
     # проверка битрейтов
     video_bitrate = _validate_bitrate("видео", args.video_bitrate)
     if args.video_bitrate is not None and video_bitrate is None:
         # была ошибка формата битрейта видео
-        return
+        return EXIT_USAGE
 
     audio_bitrate = _validate_bitrate("аудио", args.audio_bitrate)
     if args.audio_bitrate is not None and audio_bitrate is None:
         # была ошибка формата битрейта аудио
-        return
-
-    input_paths = [Path(p) for p in args.inputs]
+        return EXIT_USAGE
 
-    # разделяем существующие и несуществующие файлы
-    existing_files = [p for p in input_paths if p.exists()]
-    missing_files = [p for p in input_paths if not p.exists()]
-
-    if missing_files:
-        print("[WARN] Следующие файлы не найдены и будут пропущены:")
-        for p in missing_files:
-            print(f"  - {p}")
-
-    if not existing_files:
-        print("[ERROR] Ни один из указанных файлов не найден. Конвертация прервана.")
-        return
+    # без аргументов, но с перенаправленным вводом — читаем список путей из stdin
+    inputs = args.inputs or (["-"] if not sys.stdin.isatty() else [])
+    if not inputs:
+        print("[ERROR] Не указаны входные файлы (пути, папки, шаблоны или '-' для чтения из stdin).",
+              file=sys.stderr)
+        return EXIT_USAGE
 
     output_dir = Path(args.output_dir)
 
@@ -138,8 +407,8 @@ def main() -> None:
     try:
         output_dir.mkdir(parents=True, exist_ok=True)
     except OSError as exc:
-        print(f"[ERROR] Не удалось создать директорию вывода '{output_dir}': {exc}")
-        return
+        print(f"[ERROR] Не удалось создать директорию вывода '{output_dir}': {exc}", file=sys.stderr)
+        return EXIT_USAGE
 
     options = ConversionOptions(
         target_format=target_format,
@@ -147,11 +416,39 @@ def main() -> None:
         video_bitrate=video_bitrate,
         audio_bitrate=audio_bitrate,
         resolution=resolution,
+        video_codec=args.video_codec,
+        audio_codec=args.audio_codec,
+        preset=args.preset,
+        crf=args.crf,
+        threads=args.threads,
     )
+    jobs = args.jobs if args.jobs > 0 else resolve_worker_count(None, args.threads)
 
-    print("[INFO] Запуск конвертации")
-    print(f"[INFO] Целевой формат: {options.target_format}")
-    print(f"[INFO] Директория вывода: {options.output_dir}")
-    print(f"[INFO] Файлов к обработке: {len(existing_files)}")
+    report = sys.stdout
+    progress = BatchProgress(sys.stderr, enabled=not args.no_progress and sys.stderr.isatty())
+    print(f"[INFO] Формат: {options.target_format}, вывод: {options.output_dir}, параллельно: {jobs}",
+          file=sys.stderr)
 
-    convert_file(existing_files, options)
+    items = iter_inputs(inputs, output_dir, recursive=args.recursive, stdin=sys.stdin, null_separated=args.null)
+    stop_event = threading.Event()
+    start = time.monotonic()
+    # Построчный лог ffmpeg для тысяч файлов бесполезен: без -v остается только сводка
+    try:
+        with contextlib.ExitStack() as stack:
+            if not args.verbose:
+                stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+            results = run_batch(items, options, jobs, progress, report, stop_event)
+    except KeyboardInterrupt:
+        stop_event.set()
+        progress.clear()
+        print("[WARN] Прервано пользователем", file=sys.stderr)
+        return EXIT_INTERRUPTED
+
+    progress.clear()
+    failed = [r for r in results if not r.ok]
+    print(f"[INFO] Готово: {len(results) - len(failed)}, ошибок: {len(failed)}, "
+          f"время: {time.monotonic() - start:.1f} с", file=sys.stderr)
+    if not results:
+        print("[ERROR] Не найдено ни одного файла для конвертации.", file=sys.stderr)
+        return EXIT_FAILED
+    return EXIT_FAILED if failed else EXIT_OK
@@ -0,0 +1,101 @@
+import threading
+from typing import Callable, List, Optional
+
+import psutil
+
+from .aio import AsyncConversion
+
+
+class AnyEvent:
+    """
+    Флаг, поднятый, если поднят хотя бы один из исходных.
+    Годится везде, где кодирование только опрашивает is_set(): run_ffmpeg, сегменты, превью.
+    """
+
+    def __init__(self, *events: threading.Event):
+        self.events = events
+
+    def is_set(self) -> bool:
+        return any(event.is_set() for event in self.events)
+
+
+class JobControl:
+    """
+    Управление одной выполняемой задачей: пауза, продолжение и отмена только ее процессов ffmpeg.
+    Общие флаги сервиса (пауза и остановка всего) продолжают действовать: задача стоит,
+    если на паузе она сама или весь сервис, и останавливается по любой из двух отмен.
+    Процессы приостанавливаются через psutil-описатели, которые присылает process_callback.
+    """
+
+    def __init__(self, pause_event: threading.Event, stop_event: threading.Event,
+                 on_process: Optional[Callable[[psutil.Process], None]] = None):
+        self._service_pause = pause_event
+        self._paused = threading.Event()
+        self._cancelled = threading.Event()
+        self.pause_event = AnyEvent(self._paused, pause_event)
+        self.stop_event = AnyEvent(self._cancelled, stop_event)
+        self.on_process = on_process  # например, ProcessSampler.attach
+        self.conversion: Optional[AsyncConversion] = None  # кодирование движка asyncio, если оно идет
+        self._processes: List[psutil.Process] = []
+        self._lock = threading.Lock()
+
+    @property
+    def paused(self) -> bool:
+        return self._paused.is_set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def attach(self, process: psutil.Process) -> None:
+        """process_callback для convert_file/convert_ladder: запоминает процесс и сразу усыпляет, если задача на паузе."""
+        with self._lock:
+            self._processes = [p for p in self._processes if _alive(p)] + [process]
+            if self.paused:
+                _signal(process, psutil.Process.suspend)
+        if self.on_process:
+            self.on_process(process)
+
+    def pause(self) -> None:
+        with self._lock:
+            self._paused.set()
+            if self.conversion is not None:
+                self.conversion.pause()
+            for process in self._processes:
+                _signal(process, psutil.Process.suspend)
+
+    def resume(self) -> None:
+        with self._lock:
+            self._paused.clear()
+            if self._service_pause.is_set():
+                return  # весь сервис на паузе — задача проснется вместе с остальными
+            if self.conversion is not None:
+                self.conversion.resume()
+            for process in self._processes:
+                _signal(process, psutil.Process.resume)
+
+    def cancel(self) -> None:
+        """
+        Поток задачи сам замечает отмену и завершает ffmpeg; спящий процесс будим здесь,
+        иначе он не обработает SIGTERM. Кодирование asyncio отменяется сразу.
+        """
+        with self._lock:
+            self._cancelled.set()
+            if self.conversion is not None:
+                self.conversion.cancel()
+            for process in self._processes:
+                _signal(process, psutil.Process.resume)
+
+
+def _alive(process: psutil.Process) -> bool:
+    try:
+        return process.is_running() and process.status() != psutil.STATUS_ZOMBIE
+    except psutil.Error:
+        return False
+
+
+def _signal(process: psutil.Process, action: Callable[[psutil.Process], None]) -> None:
+    try:
+        action(process)
+    except psutil.Error:
+        pass  # процесс уже завершился
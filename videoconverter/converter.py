@@ -1,16 +1,45 @@
+import asyncio
 import subprocess
-import re
 import sys
-import time
 import threading
 import psutil
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Optional, Callable, Iterable
-
-# Регулярные выражения для чтения вывода FFmpeg (нужны для прогресс-бара)
-DURATION_REGEX = re.compile(r"Duration: (\d{2}):(\d{2}):(\d{2})\.(\d{2})")
-TIME_REGEX = re.compile(r"time=(\d{2}):(\d{2}):(\d{2})\.(\d{2})")
+from typing import AsyncIterator, List, Optional, Callable, Iterable, Tuple
+
+from .models import FormatProfile
+from .probe import probe_media, ProbeError, MediaInfo
+from .progress import ProgressInfo, ProgressParser, new_stderr_tail
+
+# Разные названия одного и того же кодека (профиль / ffprobe / имя энкодера)
+CODEC_ALIASES = {
+    "avc": "h264", "libx264": "h264", "x264": "h264",
+    "h265": "hevc", "libx265": "hevc", "x265": "hevc",
+    "mp3lame": "mp3", "libmp3lame": "mp3",
+}
+
+BITRATE_SUFFIXES = {"k": 1_000, "m": 1_000_000}
+
+# Кодек из профиля -> энкодер ffmpeg (неизвестные имена передаются как есть)
+VIDEO_ENCODERS = {
+    "h264": "libx264",
+    "hevc": "libx265",
+    "mpeg4": "mpeg4",
+    "vp9": "libvpx-vp9",
+    "av1": "libsvtav1",
+}
+AUDIO_ENCODERS = {
+    "aac": "aac",
+    "mp3": "libmp3lame",
+    "ac3": "ac3",
+    "opus": "libopus",
+}
+
+# Пресеты скорости x264/x265: чем быстрее, тем больше файл при том же качестве
+ENCODER_PRESETS = ("ultrafast", "superfast", "veryfast", "faster", "fast",
+                   "medium", "slow", "slower", "veryslow")
+PRESET_ENCODERS = {"libx264", "libx265"}
+CRF_ENCODERS = {"libx264", "libx265", "libvpx-vp9", "libsvtav1"}
 
 
 @dataclass
@@ -21,6 +50,13 @@ class ConversionOptions:
     audio_bitrate: Optional[str] = None
     resolution: Optional[str] = None
     fps: Optional[int] = None
+    video_codec: Optional[str] = None  # h264 / hevc / ... (None — выбор ffmpeg)
+    audio_codec: Optional[str] = None
+    preset: Optional[str] = None  # пресет скорости энкодера, например veryfast
+    crf: Optional[int] = None  # режим постоянного качества вместо целевого битрейта
+    threads: Optional[int] = None  # бюджет потоков кодировщика на одну задачу
+    copy_video: bool = False  # видео уже подходит — копируем без перекодирования
+    copy_audio: bool = False
 
 
 class ConversionError(Exception):
@@ -37,42 +73,149 @@ def build_ffmpeg_command(
         "-y",
         "-i", str(input_file),
     ]
+    cmd.extend(build_output_args(options))
+    cmd.append(str(output_file))
+    return cmd
 
-    if options.video_bitrate:
-        cmd.extend(["-b:v", options.video_bitrate])
 
-    if options.audio_bitrate:
-        cmd.extend(["-b:a", options.audio_bitrate])
+def build_output_args(options: ConversionOptions, geometry: bool = True) -> List[str]:
+    """
+    Параметры кодирования одного выхода (все, что стоит между входом и именем выходного файла).
+    geometry=False — разрешение и FPS уже заданы в filter_complex и повторять их не нужно.
+    """
+    cmd: List[str] = []
+    video_encoder = None
+    # Параметры кодирования применимы только к перекодируемым потокам
+    if options.copy_video:
+        cmd.extend(["-c:v", "copy"])
+    else:
+        video_encoder = get_video_encoder(options.video_codec)
+        if video_encoder:
+            cmd.extend(["-c:v", video_encoder])
+
+        if options.preset and video_encoder in PRESET_ENCODERS:
+            cmd.extend(["-preset", options.preset])
+
+        if options.crf is not None and video_encoder in CRF_ENCODERS:
+            cmd.extend(["-crf", str(options.crf)])
+            if options.video_bitrate:
+                # В режиме качества битрейт профиля работает как потолок
+                cmd.extend(["-maxrate", options.video_bitrate, "-bufsize", _double_bitrate(options.video_bitrate)])
+            elif video_encoder == "libvpx-vp9":
+                cmd.extend(["-b:v", "0"])  # без этого VP9 игнорирует CRF
+        elif options.video_bitrate:
+            cmd.extend(["-b:v", options.video_bitrate])
+
+        if options.resolution and geometry:
+            cmd.extend(["-s", options.resolution])
+
+        if options.fps and geometry:
+            cmd.extend(["-r", str(options.fps)])
+
+    if options.copy_audio:
+        cmd.extend(["-c:a", "copy"])
+    else:
+        audio_encoder = get_audio_encoder(options.audio_codec)
+        if audio_encoder:
+            cmd.extend(["-c:a", audio_encoder])
+        if options.audio_bitrate:
+            cmd.extend(["-b:a", options.audio_bitrate])
+
+    if options.threads and not (options.copy_video and options.copy_audio):
+        cmd.extend(["-threads", str(options.threads)])
+        # x265 держит собственный пул потоков, -threads его не ограничивает
+        if video_encoder == "libx265":
+            cmd.extend(["-x265-params", f"pools={options.threads}"])
+    return cmd
 
-    if options.resolution:
-        cmd.extend(["-s", options.resolution])
 
-    if options.fps:
-        cmd.extend(["-r", str(options.fps)])
+def normalize_codec(name: Optional[str]) -> str:
+    name = (name or "").strip().lower()
+    return CODEC_ALIASES.get(name, name)
 
-    cmd.append(str(output_file))
-    return cmd
 
+def get_video_encoder(codec: Optional[str]) -> Optional[str]:
+    codec = normalize_codec(codec)
+    if not codec or codec == "copy":
+        return None
+    return VIDEO_ENCODERS.get(codec, codec)
 
-def get_video_duration(input_file: Path) -> float:
-    cmd = ["ffmpeg", "-i", str(input_file)]
+
+def get_audio_encoder(codec: Optional[str]) -> Optional[str]:
+    codec = normalize_codec(codec)
+    if not codec or codec == "copy":
+        return None
+    return AUDIO_ENCODERS.get(codec, codec)
+
+
+def _double_bitrate(value: str) -> str:
+    # Размер буфера VBV берем равным двум секундам потока
+    bits = parse_bitrate(value)
+    return str(bits * 2) if bits else value
+
+
+def parse_bitrate(value: Optional[str]) -> Optional[int]:
+    """Переводит битрейт вида 800k / 4M в бит/с."""
+    if not value:
+        return None
+    value = value.strip().lower()
+    multiplier = BITRATE_SUFFIXES.get(value[-1:], 1)
+    number = value[:-1] if value[-1:] in BITRATE_SUFFIXES else value
     try:
-        # Запускаем ffmpeg просто чтобы считать метаданные из stderr
-        result = subprocess.run(
-            cmd,
-            stderr=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            text=True,
-            encoding='utf-8',
-            errors='replace'
+        return int(float(number) * multiplier)
+    except ValueError:
+        return None
+
+
+def plan_stream_copy(
+        info: MediaInfo,
+        profile: FormatProfile,
+        audio_bitrate: Optional[str] = None,
+) -> Tuple[bool, bool]:
+    """
+    Решает отдельно для видео и аудио, можно ли скопировать поток без перекодирования.
+    Поток копируется, если кодек совпадает с профилем (или в профиле указано "copy"),
+    а разрешение, FPS и битрейт не требуют изменений.
+    """
+    video = info.video_stream
+    copy_video = False
+    if normalize_codec(profile.video_codec) == "copy":
+        copy_video = True
+    elif video and normalize_codec(video.codec_name) == normalize_codec(profile.video_codec):
+        same_resolution = not profile.resolution or info.resolution == profile.resolution
+        same_fps = not profile.fps or (video.fps is not None and abs(video.fps - profile.fps) < 0.01)
+        # Битрейт профиля считаем потолком: более "тяжелый" поток нужно пережать
+        max_bitrate = parse_bitrate(profile.bitrate)
+        stream_bitrate = video.bit_rate or info.bit_rate
+        fits_bitrate = not max_bitrate or not stream_bitrate or stream_bitrate <= max_bitrate
+        copy_video = same_resolution and same_fps and fits_bitrate
+
+    audio_streams = info.audio_streams
+    copy_audio = False
+    if normalize_codec(profile.audio_codec) == "copy":
+        copy_audio = True
+    elif audio_streams:
+        target = normalize_codec(profile.audio_codec)
+        max_bitrate = parse_bitrate(audio_bitrate)
+        copy_audio = all(
+            normalize_codec(a.codec_name) == target
+            and (not max_bitrate or not a.bit_rate or a.bit_rate <= max_bitrate)
+            for a in audio_streams
         )
-        match = DURATION_REGEX.search(result.stderr)
-        if match:
-            hours, mins, secs, centis = map(int, match.groups())
-            return hours * 3600 + mins * 60 + secs + centis / 100.0
-    except Exception:
-        pass
-    return 1.0  # Возвращаем 1, чтобы избежать деления на ноль
+    else:
+        # Аудио нет — перекодировать нечего
+        copy_audio = True
+
+    return copy_video, copy_audio
+
+
+def get_video_duration(input_file: Path) -> float:
+    """Длительность файла в секундах по данным ffprobe (0 — длительность неизвестна)."""
+    try:
+        return probe_media(input_file).duration
+    except (ProbeError, OSError) as exc:
+        print(f"[WARN] Не удалось определить длительность {input_file}: {exc}")
+        return 0.0
 
 
 def convert_file(
@@ -80,86 +223,253 @@ def convert_file(
         options: ConversionOptions,
         progress_callback: Optional[Callable[[int], None]] = None,
         pause_event: Optional[threading.Event] = None,
-        stop_event: Optional[threading.Event] = None
+        stop_event: Optional[threading.Event] = None,
+        metrics_callback: Optional[Callable[[ProgressInfo], None]] = None,
+        process_callback: Optional[Callable[[psutil.Process], None]] = None,
+        duration: Optional[float] = None,
+        timeout: Optional[float] = None,
 ) -> None:
+    """
+    Синхронная обертка над AsyncConversion: кодирование идет на собственном цикле asyncio вызывающего потока.
+    duration — длительность, если она уже известна (ffprobe не запускается и кэш метаданных не трогается).
+    """
+    from .aio import AsyncConversion  # aio сам импортирует converter
+
     if not input_file.exists():
         raise ConversionError(f"Файл не найден: {input_file}")
+    if duration is None:
+        duration = get_video_duration(input_file)
+    conversion = AsyncConversion(input_file, options, timeout, process_callback, duration=duration,
+                                 pause_event=pause_event, stop_event=stop_event)
+    asyncio.run(conversion.run(progress_callback, metrics_callback))
 
-    output_name = f"{input_file.stem}.{options.target_format.lstrip('.')}"
-    output_file = options.output_dir / output_name
-    cmd = build_ffmpeg_command(input_file, output_file, options)
-    total_duration = get_video_duration(input_file)
-
-    print(f"[INFO] Конвертация: {input_file} -> {output_file}")
 
-    creationflags = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+def with_progress_pipe(cmd: List[str]) -> List[str]:
+    # Машиночитаемый прогресс идет в stdout, человекочитаемая статистика не нужна
+    return cmd[:1] + ["-progress", "pipe:1", "-nostats"] + cmd[1:]
 
-    process = None
-    is_paused = False  # Флаг для отслеживания текущего состояния
 
+def _signal(process: psutil.Process, action: Callable[[psutil.Process], None]) -> None:
+    try:
+        action(process)
+    except psutil.Error:
+        pass  # процесс уже завершился
+
+
+class FfmpegRun:
+    """
+    Состояние одного запуска ffmpeg: разбор -progress в проценты и метрики, хвост stderr,
+    пауза, продолжение и отмена процесса через psutil и итоговая ошибка по коду возврата.
+    Запуск процесса и чтение каналов — в ffmpeg_progress.
+    Управление потокобезопасно; пауза или отмена до запуска применяются сразу после старта.
+    """
+
+    def __init__(
+            self,
+            total_duration: float = 0.0,
+            progress_callback: Optional[Callable[[int], None]] = None,
+            metrics_callback: Optional[Callable[[ProgressInfo], None]] = None,
+            process_callback: Optional[Callable[[psutil.Process], None]] = None,
+    ):
+        self.total_duration = total_duration  # секунды входа для процентов (0 — неизвестна)
+        self.progress_callback = progress_callback
+        self.metrics_callback = metrics_callback
+        self.process_callback = process_callback  # получает psutil-описатель ffmpeg после запуска
+        self.last_info: Optional[ProgressInfo] = None
+        self.stderr_tail = new_stderr_tail()  # последние строки stderr для сообщения об ошибке
+        self._parser = ProgressParser()
+        self._process: Optional[psutil.Process] = None
+        self._lock = threading.Lock()
+        self._paused = False
+        self._cancelled = False
+
+    @property
+    def paused(self) -> bool:
+        return self._paused
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def started(self, pid: int) -> None:
+        process = psutil.Process(pid)
+        with self._lock:
+            self._process = process
+            if self.process_callback:
+                self.process_callback(process)
+            if self._cancelled:
+                self._terminate()
+            elif self._paused:
+                _signal(process, psutil.Process.suspend)
+
+    # --- Управление ---
+    def pause(self) -> None:
+        with self._lock:
+            if self._process and not self._paused:
+                _signal(self._process, psutil.Process.suspend)
+            self._paused = True
+
+    def resume(self) -> None:
+        with self._lock:
+            if self._process and self._paused:
+                _signal(self._process, psutil.Process.resume)
+            self._paused = False
+
+    def cancel(self) -> None:
+        with self._lock:
+            self._cancelled = True
+            self._terminate()
+
+    def terminate(self) -> None:
+        """Завершает процесс, не считая это отменой (например, при выходе по ошибке)."""
+        with self._lock:
+            self._terminate()
+
+    def _terminate(self) -> None:
+        if self._process:
+            # Спящий процесс не обработает SIGTERM; его мог усыпить и JobControl
+            _signal(self._process, psutil.Process.resume)
+            _signal(self._process, psutil.Process.terminate)
+
+    # --- Вывод процесса ---
+    def feed(self, line: str) -> Optional[ProgressInfo]:
+        """Строка stdout: в конце блока -progress вызывает колбэки и возвращает ProgressInfo."""
+        info = self._parser.feed(line)
+        if info is None:
+            return None
+        self.last_info = info
+        if self.metrics_callback:
+            self.metrics_callback(info)
+        percent = self.percent(info)
+        # Без известной длительности проценты посчитать нельзя
+        if self.progress_callback and percent is not None:
+            self.progress_callback(min(percent, 99))
+        return info
+
+    def feed_stderr(self, line: str) -> None:
+        line = line.rstrip()
+        if line:
+            self.stderr_tail.append(line)
+
+    def percent(self, info: ProgressInfo) -> Optional[int]:
+        if self.total_duration <= 0 or info.out_time <= 0:
+            return None
+        return int(info.out_time / self.total_duration * 100)
+
+    def finish(self, returncode: int) -> None:
+        """Итог по коду возврата: STOPPED после отмены, ошибка с хвостом stderr или 100%."""
+        if self._cancelled:
+            raise ConversionError("STOPPED")
+        if returncode != 0:
+            details = "\n".join(self.stderr_tail)
+            raise ConversionError(f"Ошибка FFmpeg (код {returncode})" + (f":\n{details}" if details else ""))
+        if self.progress_callback:
+            self.progress_callback(100)
+
+
+POLL_INTERVAL = 0.1  # как часто драйвер ffmpeg проверяет флаги паузы/остановки и предел времени
+
+
+async def ffmpeg_progress(
+        cmd: List[str],
+        run: FfmpegRun,
+        timeout: Optional[float] = None,
+        pause_event: Optional[threading.Event] = None,
+        stop_event: Optional[threading.Event] = None,
+) -> AsyncIterator[ProgressInfo]:
+    """
+    Единственный драйвер процесса ffmpeg: запуск, чтение -progress и stderr, пауза и остановка
+    по флагам, предел времени. Отдает блоки прогресса по мере поступления (async for).
+    На нем работают и AsyncConversion, и синхронные run_ffmpeg/convert_file.
+    """
+    kwargs = {"creationflags": subprocess.CREATE_NO_WINDOW} if sys.platform == "win32" else {}
     try:
-        process = subprocess.Popen(
-            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-            text=True, encoding='utf-8', errors='replace', creationflags=creationflags
+        process = await asyncio.create_subprocess_exec(
+            *with_progress_pipe(cmd), stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, **kwargs
         )
+    except OSError as exc:
+        raise ConversionError(f"Не удалось запустить ffmpeg: {exc}") from exc
 
-        # Получаем объект процесса psutil для управления (пауза/продолжение)
-        p = psutil.Process(process.pid)
-
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout if timeout else None
+    stderr_task = asyncio.create_task(_drain_stderr(process, run))
+    line_task: Optional[asyncio.Task] = None
+    try:
+        run.started(process.pid)
         while True:
-            # 1. СТОП
+            # Флаги проверяются на каждой итерации, даже если ffmpeg молчит
             if stop_event and stop_event.is_set():
-                if is_paused: p.resume()  # Если был на паузе, надо "разбудить", чтобы убить
-                process.terminate()
+                run.cancel()
                 raise ConversionError("STOPPED")
-
-            # 2. ПАУЗА (СИСТЕМНАЯ)
-            if pause_event and pause_event.is_set():
-                if not is_paused:
-                    # Ставим процесс на системную паузу
-                    p.suspend()
-                    is_paused = True
-
-                time.sleep(0.2)  # Просто ждем, пока флаг не снимут
+            if pause_event is not None:
+                if pause_event.is_set():
+                    run.pause()
+                else:
+                    run.resume()
+            if deadline is not None and loop.time() >= deadline:
+                raise ConversionError(f"Превышено время кодирования ({timeout:.0f} с)")
+
+            line_task = line_task or asyncio.ensure_future(process.stdout.readline())
+            done, _ = await asyncio.wait({line_task}, timeout=POLL_INTERVAL)
+            if not done:
                 continue
-            else:
-                # Если флаг сняли, а процесс все еще спит — будим
-                if is_paused:
-                    p.resume()
-                    is_paused = False
-
-            # Читаем вывод (только если не на паузе)
-            line = process.stderr.readline()
-            if not line and process.poll() is not None:
+            line, line_task = line_task.result(), None
+            if not line:
                 break
+            info = run.feed(line.decode("utf-8", errors="replace"))
+            if info is not None:
+                yield info
 
-            if line and progress_callback:
-                match = TIME_REGEX.search(line)
-                if match:
-                    h, m, s, cs = map(int, match.groups())
-                    current_seconds = h * 3600 + m * 60 + s + cs / 100.0
-                    percent = int((current_seconds / total_duration) * 100)
-                    progress_callback(min(percent, 99))
+        returncode = await process.wait()
+        await stderr_task
+        run.finish(returncode)
+    finally:
+        if line_task and not line_task.done():
+            line_task.cancel()
+        await _terminate(process, run)
+        if not stderr_task.done():
+            stderr_task.cancel()
 
-        if process.returncode != 0:
-            # Обработка ситуаций, когда процесс убили внешне
-            if stop_event and stop_event.is_set():
-                raise ConversionError("STOPPED")
-            raise ConversionError(f"Ошибка FFmpeg (код {process.returncode})")
 
-        if progress_callback and not (stop_event and stop_event.is_set()):
-            progress_callback(100)
-            print(f"[OK] Готово: {output_file}")
+async def _drain_stderr(process: asyncio.subprocess.Process, run: FfmpegRun) -> None:
+    async for line in process.stderr:
+        run.feed_stderr(line.decode("utf-8", errors="replace"))
 
-    except OSError as exc:
-        raise ConversionError(f"Не удалось запустить ffmpeg: {exc}") from exc
-    finally:
-        if process and process.poll() is None:
-            # На всякий случай
-            try:
-                process.terminate()
-            except:
-                pass
+
+async def _terminate(process: asyncio.subprocess.Process, run: FfmpegRun) -> None:
+    if process.returncode is not None:
+        return
+    run.terminate()
+    try:
+        await asyncio.wait_for(process.wait(), 5)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+
+
+async def _consume(progress: AsyncIterator[ProgressInfo]) -> None:
+    async for _ in progress:
+        pass  # колбэки вызывает FfmpegRun
+
+
+def run_ffmpeg(
+        cmd: List[str],
+        total_duration: float,
+        progress_callback: Optional[Callable[[int], None]] = None,
+        pause_event: Optional[threading.Event] = None,
+        stop_event: Optional[threading.Event] = None,
+        metrics_callback: Optional[Callable[[ProgressInfo], None]] = None,
+        process_callback: Optional[Callable[[psutil.Process], None]] = None,
+        timeout: Optional[float] = None,
+) -> None:
+    """
+    Синхронная обертка над ffmpeg_progress для готовой команды (лесенка, превью, сегменты).
+    total_duration — длительность входа в секундах для расчета процентов (0 — неизвестна).
+    process_callback получает psutil-описатель процесса сразу после запуска.
+    """
+    run = FfmpegRun(total_duration, progress_callback, metrics_callback, process_callback)
+    asyncio.run(_consume(ffmpeg_progress(cmd, run, timeout, pause_event, stop_event)))
 
 
 # convert_files для CLI оставляем без изменений
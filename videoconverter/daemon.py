@@ -0,0 +1,400 @@
+import argparse
+import json
+import signal
+import threading
+import time
+from dataclasses import asdict
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+from uuid import UUID
+
+from .ladder import build_renditions, rendition_label
+from .events import JobAdded, JobPriorityChanged, JobProgress, JobRemoved, JobStateChanged
+from .metrics import metrics_to_dict
+from .models import Job, JobState, JobPriority, FormatProfile, Rendition, Settings
+from .service import ConverterService
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+SSE_QUEUE_SIZE = 5000  # событий в очереди одного клиента; при переполнении клиент получает полный снимок
+SSE_POLL = 1.0  # как часто поток событий проверяет остановку сервера (секунды)
+SSE_HEARTBEAT = 15.0
+SHUTDOWN_TIMEOUT = 30.0  # сколько ждать завершения задач при остановке сервиса (секунды)
+
+
+class ApiError(Exception):
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def job_to_dict(job: Job) -> dict:
+    return {
+        "id": str(job.id),
+        "source_path": str(job.source_path),
+        "output_path": str(job.output_filename),
+        "profile": asdict(job.profile),
+        "state": job.state.name,
+        "progress": job.progress,
+        "priority": int(job.priority),
+        "deadline": job.deadline,
+        "segmented": job.segmented,
+        "conversion_path": job.conversion_path.name if job.conversion_path else None,
+        "error_message": job.error_message,
+        "renditions": [
+            {"label": r.label, "output_path": str(job.rendition_output(r)), "resolution": r.profile.resolution,
+             "state": r.state.name, "progress": r.progress, "size": r.size}
+            for r in job.renditions
+        ],
+        "metrics": metrics_to_dict(job.metrics),
+        "previews": [str(path) for path in job.previews],
+    }
+
+
+def job_from_dict(data: dict, settings: Settings) -> Job:
+    """Создает задачу из JSON запроса; незаданные поля берутся из настроек."""
+    if not isinstance(data, dict) or not data.get("source_path"):
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Поле source_path обязательно")
+    profile_data = {**asdict(settings.default_profile), **(data.get("profile") or {})}
+    try:
+        profile = FormatProfile(**profile_data)
+    except TypeError as e:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"Некорректный профиль: {e}")
+    return Job(
+        source_path=Path(data["source_path"]),
+        output_dir=Path(data.get("output_dir") or settings.output_path),
+        profile=profile,
+        priority=parse_priority(data.get("priority", 0)),
+        deadline=float(data["deadline"]) if data.get("deadline") is not None else None,
+        segmented=bool(data.get("segmented", False)),
+        renditions=parse_renditions(data.get("renditions") or [], profile),
+    )
+
+
+def parse_renditions(items: list, base: FormatProfile) -> List[Rendition]:
+    """
+    Выходы многовыходной задачи: строка — разрешение (битрейт пересчитывается от базового профиля),
+    объект — поля профиля поверх базового, необязательное поле label задает суффикс имени файла.
+    """
+    if not isinstance(items, list):
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Поле renditions должно быть списком")
+    renditions: List[Rendition] = []
+    for item in items:
+        if isinstance(item, str):
+            renditions.extend(build_renditions(base, [item]))
+            continue
+        if not isinstance(item, dict):
+            raise ApiError(HTTPStatus.BAD_REQUEST, f"Некорректный выход: {item!r}")
+        fields = dict(item)
+        label = fields.pop("label", None)
+        try:
+            profile = FormatProfile(**{**asdict(base), **fields})
+        except TypeError as e:
+            raise ApiError(HTTPStatus.BAD_REQUEST, f"Некорректный профиль выхода: {e}")
+        renditions.append(Rendition(profile=profile, label=label or rendition_label(profile.resolution)))
+    labels = [r.label for r in renditions]
+    if len(set(labels)) != len(labels):
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Имена выходов (label) должны различаться")
+    return renditions
+
+
+def parse_priority(value) -> int:
+    """Приоритет задается числом или именем класса (low, normal, high, urgent)."""
+    if isinstance(value, str) and not value.lstrip("-").isdigit():
+        try:
+            return JobPriority[value.upper()]
+        except KeyError:
+            raise ApiError(HTTPStatus.BAD_REQUEST, f"Неизвестный приоритет: {value}")
+    return int(value)
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    """HTTP/JSON API над ConverterService. Экземпляр сервиса лежит в self.server.service."""
+
+    server_version = "VideoConverterDaemon/1.0"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def service(self) -> ConverterService:
+        return self.server.service
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            print(f"[DAEMON] {self.address_string()} {format % args}")
+
+    # --- Маршрутизация ---
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def _dispatch(self, method: str) -> None:
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        query = parse_qs(url.query)
+        try:
+            if method == "GET" and parts == ["events"]:
+                self._stream_events(query)
+                return
+            if method == "GET" and parts == ["metrics"]:
+                self._send_text(HTTPStatus.OK, self.service.metrics_text(), "text/plain; version=0.0.4")
+                return
+            status, body = self._route(method, parts, query)
+            self._send_json(status, body)
+        except ApiError as e:
+            self._send_json(e.status, {"error": str(e)})
+        except ValueError as e:
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+        except Exception as e:
+            print(f"[DAEMON ERROR] {e}")
+            self._send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)})
+
+    def _route(self, method: str, parts: List[str], query: Dict[str, List[str]]) -> Tuple[HTTPStatus, object]:
+        if parts == ["status"] and method == "GET":
+            return HTTPStatus.OK, self._status()
+        if parts == ["metrics.json"] and method == "GET":
+            return HTTPStatus.OK, self.service.metrics_snapshot()
+        if parts == ["jobs"] and method == "GET":
+            return HTTPStatus.OK, self._list_jobs(query)
+        if parts == ["jobs"] and method == "POST":
+            return HTTPStatus.CREATED, self._submit_jobs(self._read_json())
+        if len(parts) >= 2 and parts[0] == "jobs":
+            job = self._find_job(parts[1])
+            if len(parts) == 2 and method == "GET":
+                return HTTPStatus.OK, job_to_dict(job)
+            if len(parts) == 2 and method == "DELETE":
+                if job.state in (JobState.RUNNING, JobState.PAUSED):
+                    raise ApiError(HTTPStatus.CONFLICT, "Задача выполняется, сначала отмените ее")
+                self.service.remove_job(job.id)
+                return HTTPStatus.OK, {"removed": str(job.id)}
+            if len(parts) == 3 and parts[2] == "priority" and method == "POST":
+                self.service.set_job_priority(job.id, parse_priority(self._read_object().get("priority", 0)))
+                return HTTPStatus.OK, job_to_dict(job)
+            if len(parts) == 3 and parts[2] == "cancel" and method == "POST":
+                if not self.service.cancel_job(job.id):
+                    raise ApiError(HTTPStatus.CONFLICT, "Задачу в этом состоянии нельзя отменить")
+                return HTTPStatus.OK, job_to_dict(job)
+            if len(parts) == 3 and parts[2] == "pause" and method == "POST":
+                if not self.service.pause_job(job.id):
+                    raise ApiError(HTTPStatus.CONFLICT, "Приостановить можно только выполняемую задачу")
+                return HTTPStatus.OK, job_to_dict(job)
+            if len(parts) == 3 and parts[2] == "resume" and method == "POST":
+                if not self.service.resume_job(job.id):
+                    raise ApiError(HTTPStatus.CONFLICT, "Задача не приостановлена")
+                return HTTPStatus.OK, job_to_dict(job)
+        if parts == ["policy"] and method == "POST":
+            self.service.set_queue_policy(str(self._read_object().get("policy", "")))
+            return HTTPStatus.OK, self._status()
+        if len(parts) == 2 and parts[0] == "control" and method == "POST":
+            return HTTPStatus.OK, self._control(parts[1])
+        raise ApiError(HTTPStatus.NOT_FOUND, f"Неизвестный запрос: {method} {self.path}")
+
+    # --- Обработчики ---
+    def _status(self) -> dict:
+        queue = self.service.queue
+        return {
+            "running": self.service.running,
+            "paused": self.service.paused,
+            "workers": self.service.max_workers,
+            "jobs": {state.name: queue.count(state) for state in JobState},
+            "policy": queue.policy.name,
+            "queue_wait": self.service.queue_wait_report(),
+        }
+
+    def _list_jobs(self, query: Dict[str, List[str]]) -> dict:
+        states = set()
+        for value in query.get("state", []):
+            for name in value.split(","):
+                try:
+                    states.add(JobState[name.strip().upper()])
+                except KeyError:
+                    raise ApiError(HTTPStatus.BAD_REQUEST, f"Неизвестное состояние: {name}")
+        if states:
+            jobs = [job for state in JobState if state in states for job in self.service.queue.jobs_in_state(state)]
+        else:
+            jobs = list(self.service.queue)
+        total = len(jobs)
+        offset = int(query.get("offset", ["0"])[0])
+        limit = int(query.get("limit", ["0"])[0])
+        jobs = jobs[offset:offset + limit] if limit else jobs[offset:]
+        return {"total": total, "jobs": [job_to_dict(job) for job in jobs]}
+
+    def _submit_jobs(self, payload) -> dict:
+        # Принимаем одну задачу или пакет: {"jobs": [...]}
+        items = payload.get("jobs") if isinstance(payload, dict) and "jobs" in payload else [payload]
+        if not isinstance(items, list):
+            raise ApiError(HTTPStatus.BAD_REQUEST, "Поле jobs должно быть списком")
+        settings = self.service.settings_store.get()
+        jobs = [job_from_dict(item, settings) for item in items]
+        for job in jobs:
+            self.service.add_job(job)
+        if jobs and self.server.autostart:
+            self.service.start_processing()
+        return {"created": [str(job.id) for job in jobs]}
+
+    def _control(self, action: str) -> dict:
+        actions = {
+            "start": self.service.start_processing,
+            "stop": self.service.stop_processing,
+            "pause": self.service.pause_processing,
+            "resume": self.service.resume_processing,
+        }
+        if action not in actions:
+            raise ApiError(HTTPStatus.NOT_FOUND, f"Неизвестная команда: {action}")
+        actions[action]()
+        return self._status()
+
+    def _stream_events(self, query: Dict[str, List[str]]) -> None:
+        """
+        Server-Sent Events: сначала текущие задачи, затем задачи, у которых изменились состояние, приоритет
+        или прогресс (прогресс — не чаще progress_interval сервиса). Удаление — событие removed.
+        """
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        wanted = set(query.get("job", []))
+        subscription = self.service.events.subscribe(
+            maxsize=SSE_QUEUE_SIZE, types=(JobAdded, JobStateChanged, JobPriorityChanged, JobProgress, JobRemoved))
+
+        def send_job(job: Optional[Job]) -> None:
+            if job is not None and (not wanted or str(job.id) in wanted):
+                data = json.dumps(job_to_dict(job), ensure_ascii=False)
+                self.wfile.write(f"event: job\ndata: {data}\n\n".encode("utf-8"))
+
+        try:
+            seen_dropped = -1
+            last_write = time.monotonic()
+            while not self.server.shutting_down.is_set():
+                if subscription.dropped != seen_dropped:
+                    # Клиент не успевал читать — вместо потерянных событий отправляем полный снимок
+                    seen_dropped = subscription.dropped
+                    subscription.drain()
+                    for job in self.service.queue:
+                        send_job(job)
+                    last_write = time.monotonic()
+                event = subscription.get(timeout=SSE_POLL)
+                if isinstance(event, JobRemoved):
+                    if not wanted or str(event.job_id) in wanted:
+                        data = json.dumps({"id": str(event.job_id)})
+                        self.wfile.write(f"event: removed\ndata: {data}\n\n".encode("utf-8"))
+                        last_write = time.monotonic()
+                elif event is not None:
+                    send_job(self.service.get_job(event.job_id))
+                    last_write = time.monotonic()
+                elif time.monotonic() - last_write > SSE_HEARTBEAT:
+                    self.wfile.write(b": ping\n\n")
+                    last_write = time.monotonic()
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            subscription.close()
+
+    # --- Вспомогательное ---
+    def _find_job(self, raw_id: str) -> Job:
+        try:
+            job = self.service.get_job(UUID(raw_id))
+        except ValueError:
+            job = None
+        if job is None:
+            raise ApiError(HTTPStatus.NOT_FOUND, f"Задача не найдена: {raw_id}")
+        return job
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b"{}"
+        try:
+            return json.loads(raw.decode("utf-8"))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise ApiError(HTTPStatus.BAD_REQUEST, f"Некорректный JSON: {e}")
+
+    def _read_object(self) -> dict:
+        payload = self._read_json()
+        if not isinstance(payload, dict):
+            raise ApiError(HTTPStatus.BAD_REQUEST, "Тело запроса должно быть JSON-объектом")
+        return payload
+
+    def _send_json(self, status: HTTPStatus, body: object) -> None:
+        self._send_text(status, json.dumps(body, ensure_ascii=False), "application/json")
+
+    def _send_text(self, status: HTTPStatus, text: str, content_type: str) -> None:
+        data = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class DaemonServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], service: ConverterService,
+                 autostart: bool = True, verbose: bool = False):
+        super().__init__(address, DaemonRequestHandler)
+        self.service = service
+        self.autostart = autostart
+        self.verbose = verbose
+        self.shutting_down = threading.Event()
+
+    def shutdown(self) -> None:
+        self.shutting_down.set()
+        super().shutdown()
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="videoconverter daemon",
+        description="Фоновый режим без GUI с локальным HTTP/JSON API"
+    )
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"Адрес (по умолчанию: {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Порт (по умолчанию: {DEFAULT_PORT})")
+    parser.add_argument("--verbose", action="store_true", help="Печатать каждый HTTP-запрос")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = _build_parser().parse_args(argv)
+    service = ConverterService.from_settings()
+    journal = service.journal
+    # Задачи, восстановленные из журнала, продолжаем сразу
+    if service.has_pending_jobs():
+        service.start_processing()
+
+    server = DaemonServer((args.host, args.port), service, verbose=args.verbose)
+
+    def handle_signal(signum, frame):
+        print("[DAEMON] Остановка...")
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+
+    print(f"[DAEMON] API доступен на http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    finally:
+        # Отключаем журнал до остановки: прерванные задачи останутся RUNNING
+        # и будут продолжены при следующем запуске, а не помечены отмененными
+        service.journal = None
+        # Не выходим, пока рабочие потоки не завершили свои ffmpeg: иначе процессы останутся сиротами
+        if not service.shutdown(SHUTDOWN_TIMEOUT):
+            print("[WARN] Не все задачи успели остановиться")
+        server.server_close()
+        if journal:
+            journal.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, ClassVar, Deque, Dict, Hashable, List, Optional, Sequence, Tuple, Type, Union
+from uuid import UUID
+
+from .models import Job, JobState
+from .progress import ProgressInfo
+
+
+@dataclass(frozen=True)
+class RenditionStatus:
+    label: str
+    format: str
+    state: JobState
+    progress: int
+    size: int
+
+
+def _renditions(job: Job) -> Tuple[RenditionStatus, ...]:
+    return tuple(RenditionStatus(r.label, r.profile.format, r.state, r.progress, r.size) for r in job.renditions)
+
+
+class Event:
+    """
+    Базовый класс событий сервиса. События — неизменяемые снимки: подписчик читает их
+    в своем потоке, не трогая объекты задач, которые в это время меняют рабочие потоки.
+    """
+    job_id: Optional[UUID]  # у событий задач — поле, у событий сервиса — None
+
+    @property
+    def coalesce_key(self) -> Optional[Hashable]:
+        """Ключ слияния: из нескольких еще не прочитанных событий с одним ключом остается последнее."""
+        return None
+
+
+@dataclass(frozen=True)
+class JobAdded(Event):
+    job_id: UUID
+    source_name: str
+    format: str
+    state: JobState
+    progress: int
+    priority: int
+    renditions: Tuple[RenditionStatus, ...] = ()
+
+    @classmethod
+    def of(cls, job: Job) -> "JobAdded":
+        return cls(job.id, job.source_path.name, job.profile.format, job.state, job.progress, int(job.priority),
+                   _renditions(job))
+
+
+@dataclass(frozen=True)
+class JobStateChanged(Event):
+    job_id: UUID
+    state: JobState
+    progress: int
+    priority: int
+    error_message: Optional[str] = None
+    renditions: Tuple[RenditionStatus, ...] = ()
+
+    @classmethod
+    def of(cls, job: Job) -> "JobStateChanged":
+        return cls(job.id, job.state, job.progress, int(job.priority), job.error_message, _renditions(job))
+
+
+@dataclass(frozen=True)
+class JobPriorityChanged(Event):
+    """Приоритет задачи изменен; состояние и прогресс при этом не меняются."""
+    job_id: UUID
+    priority: int
+
+    @classmethod
+    def of(cls, job: Job) -> "JobPriorityChanged":
+        return cls(job.id, int(job.priority))
+
+
+@dataclass(frozen=True)
+class JobProgress(Event):
+    job_id: UUID
+    progress: int
+    renditions: Tuple[RenditionStatus, ...] = ()
+
+    @classmethod
+    def of(cls, job: Job) -> "JobProgress":
+        return cls(job.id, job.progress, _renditions(job))
+
+    @property
+    def coalesce_key(self) -> Hashable:
+        return "progress", self.job_id
+
+
+@dataclass(frozen=True)
+class JobMetricsUpdated(Event):
+    """Текущие показатели кодирования по отчету ffmpeg -progress."""
+    job_id: UUID
+    out_time: float
+    speed: Optional[float]
+    fps: float
+    bitrate_kbps: Optional[float]
+
+    @classmethod
+    def of(cls, job: Job, info: ProgressInfo) -> "JobMetricsUpdated":
+        return cls(job.id, info.out_time, info.speed, info.fps, info.bitrate_kbps)
+
+    @property
+    def coalesce_key(self) -> Hashable:
+        return "metrics", self.job_id
+
+
+@dataclass(frozen=True)
+class JobRemoved(Event):
+    job_id: UUID
+
+
+@dataclass(frozen=True)
+class ServiceStateChanged(Event):
+    job_id: ClassVar[None] = None
+    running: bool
+    paused: bool
+
+    @property
+    def coalesce_key(self) -> Hashable:
+        return ("service",)
+
+
+EventTypes = Optional[Sequence[Type[Event]]]
+_FINAL_STATES = (JobState.DONE, JobState.FAILED, JobState.CANCELLED)
+
+
+class _Slot:
+    """Место в очереди подписчика под событие, которое может быть заменено более новым."""
+    __slots__ = ("key",)
+
+    def __init__(self, key: Hashable):
+        self.key = key
+
+
+class Subscription:
+    """
+    Ограниченная очередь событий одного подписчика.
+    Частые события (прогресс, метрики) сливаются: пока подписчик не прочитал событие,
+    новое с тем же ключом заменяет его на месте. При переполнении вытесняется самое старое
+    событие и растет dropped — подписчику стоит перечитать состояние целиком.
+    """
+
+    def __init__(self, bus: "EventBus", maxsize: int, types: EventTypes):
+        self._bus = bus
+        self.maxsize = maxsize
+        self.types = tuple(types) if types else None
+        self.dropped = 0
+        self.closed = False
+        self._cond = threading.Condition()
+        self._items: Deque[Union[Event, _Slot]] = deque()
+        self._pending: Dict[Hashable, Event] = {}
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def wants(self, event: Event) -> bool:
+        return self.types is None or isinstance(event, self.types)
+
+    def put(self, event: Event) -> None:
+        key = event.coalesce_key
+        with self._cond:
+            if self.closed:
+                return
+            if key is not None and key in self._pending:
+                self._pending[key] = event
+                return
+            if len(self._items) >= self.maxsize:
+                oldest = self._items.popleft()
+                if isinstance(oldest, _Slot):
+                    del self._pending[oldest.key]
+                self.dropped += 1
+            if key is None:
+                self._items.append(event)
+            else:
+                self._pending[key] = event
+                self._items.append(_Slot(key))
+            self._cond.notify()
+
+    def _pop(self) -> Event:
+        item = self._items.popleft()
+        return self._pending.pop(item.key) if isinstance(item, _Slot) else item
+
+    def get(self, timeout: Optional[float] = None) -> Optional[Event]:
+        """Следующее событие; None — истек timeout или подписка закрыта."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items or self.closed, timeout):
+                return None
+            return self._pop() if self._items else None
+
+    def drain(self, limit: Optional[int] = None) -> List[Event]:
+        """Все накопившиеся события без ожидания (для цикла GUI)."""
+        with self._cond:
+            count = len(self._items) if limit is None else min(limit, len(self._items))
+            return [self._pop() for _ in range(count)]
+
+    def close(self) -> None:
+        self._bus.unsubscribe(self)
+        with self._cond:
+            self.closed = True
+            self._items.clear()
+            self._pending.clear()
+            self._cond.notify_all()
+
+
+class EventBus:
+    """
+    Потокобезопасная шина событий ConverterService.
+    Подписчики с очередью (GUI, API, CLI) читают события в своем потоке; слушатели
+    (журналы, счетчики) вызываются прямо в потоке публикации и должны быть быстрыми.
+    Прогресс и метрики одной задачи публикуются не чаще progress_interval: промежуточное
+    значение придерживается и уходит со следующим событием этой задачи, а если его нет
+    (задача встала на паузу или зависла) — по таймеру, когда интервал истечет.
+    """
+
+    def __init__(self, progress_interval: float = 0.25):
+        self.progress_interval = progress_interval
+        self._lock = threading.Lock()
+        self._subscriptions: List[Subscription] = []
+        self._listeners: List[Tuple[Callable[[Event], None], EventTypes]] = []
+        self._last_sent: Dict[Hashable, float] = {}
+        self._held: Dict[UUID, Dict[Hashable, Event]] = {}  # придержанные частые события по задачам
+        self._flush_timer: Optional[threading.Timer] = None
+
+    def subscribe(self, maxsize: int = 1000, types: EventTypes = None) -> Subscription:
+        subscription = Subscription(self, maxsize, types)
+        with self._lock:
+            self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+
+    def add_listener(self, listener: Callable[[Event], None], types: EventTypes = None) -> Callable[[], None]:
+        """Синхронный слушатель. Возвращает функцию отписки."""
+        entry = (listener, tuple(types) if types else None)
+        with self._lock:
+            self._listeners.append(entry)
+
+        def remove() -> None:
+            with self._lock:
+                if entry in self._listeners:
+                    self._listeners.remove(entry)
+
+        return remove
+
+    def publish(self, event: Event) -> None:
+        with self._lock:
+            batch = self._admit(event)
+            subscriptions = list(self._subscriptions)
+            listeners = list(self._listeners)
+        self._dispatch(batch, subscriptions, listeners)
+
+    def _dispatch(self, batch: List[Event], subscriptions: List[Subscription],
+                  listeners: List[Tuple[Callable[[Event], None], EventTypes]]) -> None:
+        for item in batch:
+            for subscription in subscriptions:
+                if subscription.wants(item):
+                    subscription.put(item)
+            for listener, types in listeners:
+                if types is None or isinstance(item, types):
+                    try:
+                        listener(item)
+                    except Exception as e:
+                        print(f"[WARN] Ошибка обработчика события {type(item).__name__}: {e}")
+
+    def _admit(self, event: Event) -> List[Event]:
+        """Ограничение частоты (под блокировкой шины). Возвращает события, которые нужно разослать."""
+        key = event.coalesce_key
+        if key is not None and event.job_id is not None and self.progress_interval > 0:
+            now = time.monotonic()
+            last = self._last_sent.get(key)
+            if last is not None and now - last < self.progress_interval:
+                self._held.setdefault(event.job_id, {})[key] = event
+                self._schedule_flush(last + self.progress_interval - now)
+                return []
+            self._last_sent[key] = now
+            held = self._held.get(event.job_id)
+            if held:
+                held.pop(key, None)
+            return [event]
+
+        # Редкое событие сначала выпускает придержанные: подписчик увидит итоговый прогресс до смены состояния
+        if event.job_id is not None:
+            batch = list(self._held.pop(event.job_id, {}).values())
+            if isinstance(event, JobRemoved) or (isinstance(event, JobStateChanged) and event.state in _FINAL_STATES):
+                # Задача больше не шлет прогресс: ее отметки времени не должны копиться в долгоживущем демоне
+                self._last_sent = {k: v for k, v in self._last_sent.items() if k[1:] != (event.job_id,)}
+        else:
+            batch = [e for held in self._held.values() for e in held.values()]
+            self._held.clear()
+        batch.append(event)
+        return batch
+
+    def _schedule_flush(self, delay: float) -> None:
+        """Взводит таймер выпуска придержанных событий (под блокировкой шины)."""
+        if self._flush_timer is not None:
+            return
+        self._flush_timer = threading.Timer(max(delay, 0.0), self._flush_held)
+        self._flush_timer.daemon = True
+        self._flush_timer.start()
+
+    def _flush_held(self) -> None:
+        """Выпускает придержанные события, чей интервал истек, не дожидаясь следующего события задачи."""
+        with self._lock:
+            self._flush_timer = None
+            now = time.monotonic()
+            batch: List[Event] = []
+            next_due: Optional[float] = None
+            for job_id, held in list(self._held.items()):
+                for key, event in list(held.items()):
+                    due = self._last_sent.get(key, now) + self.progress_interval
+                    if due <= now:
+                        batch.append(held.pop(key))
+                        self._last_sent[key] = now
+                    else:
+                        next_due = due if next_due is None else min(next_due, due)
+                if not held:
+                    del self._held[job_id]
+            if next_due is not None:
+                self._schedule_flush(next_due - now)
+            subscriptions = list(self._subscriptions)
+            listeners = list(self._listeners)
+        self._dispatch(batch, subscriptions, listeners)
@@ -3,11 +3,17 @@ from tkinter import filedialog
 import ttkbootstrap as ttk
 from ttkbootstrap.constants import *
 from pathlib import Path
+from typing import Dict, List, Optional, Set
+from uuid import UUID
 
+from .events import JobAdded, JobProgress, JobRemoved, JobStateChanged, ServiceStateChanged
 from .models import Job, JobState, Settings
 from .service import ConverterService
+from .ladder import build_renditions
 from .settings_window import SettingsWindow, CustomPopup
 
+PAGE_SIZE = 200  # строк на странице таблицы: стоимость отрисовки не зависит от длины очереди
+
 
 class MainWindow(ttk.Window):
     def __init__(self, service: ConverterService):
@@ -17,10 +23,24 @@ class MainWindow(ttk.Window):
         self.geometry("800x650")
 
         self._processing_started = False
+        # Таблица показывает одну страницу очереди и обновляет только изменившиеся строки
+        self._job_ids: List[UUID] = []  # порядок задач как в очереди
+        self._positions: Dict[UUID, int] = {}
+        self._visible: Set[UUID] = set()
+        self._page = 0
+        self._row_states: Dict[str, JobState] = {}  # состояние видимых строк (для отображения паузы)
+        self._paused = False
+        # Рабочие потоки не трогают Tk: события копятся в очереди подписки и читаются в цикле Tk
+        self._events = service.events.subscribe(maxsize=20000)
+        self._seen_dropped = 0
+        # Обработчик вызывается из потока, сохранившего настройки; Tk трогаем только из главного цикла
+        self._settings_changed = False
+        self._unsubscribe_settings = service.settings_store.subscribe(self._on_settings_changed)
         self.font_header = ("Helvetica", 18, "bold")
         self.font_ui = ("Helvetica", 10)
 
         self._init_ui()
+        self._refresh_table()
         self._update_loop()
 
     def _init_ui(self):
@@ -41,7 +61,7 @@ class MainWindow(ttk.Window):
         btn_add.pack(side=LEFT, padx=(0, 5))
 
         # Загружаем текущий формат из настроек для отображения по умолчанию
-        current_fmt = Settings.load().default_profile.format.upper()
+        current_fmt = self.service.settings_store.get().default_profile.format.upper()
 
         self.var_quick_format = tk.StringVar(value=current_fmt)
         self.combo_quick_fmt = ttk.Combobox(
@@ -97,6 +117,13 @@ class MainWindow(ttk.Window):
         self.tree.column("status", width=120)
         self.tree.pack(fill=BOTH, expand=True)
 
+        pager = ttk.Frame(main_container, padding=(0, 5, 0, 0))
+        pager.pack(fill=X)
+        ttk.Button(pager, text="›", bootstyle="link", command=lambda: self._show_page(self._page + 1)).pack(side=RIGHT)
+        self.page_label = ttk.Label(pager, text="Стр. 1 из 1", font=("Helvetica", 9))
+        self.page_label.pack(side=RIGHT, padx=5)
+        ttk.Button(pager, text="‹", bootstyle="link", command=lambda: self._show_page(self._page - 1)).pack(side=RIGHT)
+
         # 3. Нижние кнопки
         list_actions_frame = ttk.Frame(main_container, padding=(0, 15))
         list_actions_frame.pack(fill=X)
@@ -108,6 +135,12 @@ class MainWindow(ttk.Window):
         btn_clear = ttk.Button(center_btn_frame, text="Очистить очередь", bootstyle="outline",
                                command=self._clear_queue)
         btn_clear.pack(side=LEFT, padx=10)
+        btn_pause_job = ttk.Button(center_btn_frame, text="Пауза / продолжить задачу", bootstyle="outline",
+                                   command=self._toggle_selected)
+        btn_pause_job.pack(side=LEFT, padx=10)
+        btn_cancel_job = ttk.Button(center_btn_frame, text="Отменить задачу", bootstyle="outline",
+                                    command=self._cancel_selected)
+        btn_cancel_job.pack(side=LEFT, padx=10)
 
         # 4. Лог
         ttk.Separator(main_container, orient=HORIZONTAL).pack(fill=X, pady=(0, 10))
@@ -127,13 +160,14 @@ class MainWindow(ttk.Window):
     def _add_files(self):
         file_paths = filedialog.askopenfilenames()
         if not file_paths: return
-        settings = Settings.load()
+        settings = self.service.settings_store.get()
         for path_str in file_paths:
             path = Path(path_str)
-            job = Job(source_path=path, output_dir=Path(settings.output_path), profile=settings.default_profile)
+            job = Job(source_path=path, output_dir=Path(settings.output_path), profile=settings.default_profile,
+                      renditions=build_renditions(settings.default_profile, settings.abr_ladder))
             self.service.add_job(job)
             self._log(f"[INFO] Добавлен файл: {path.name}")
-        self._refresh_table()
+        self._apply_events()
 
     # ЛОГИКА КНОПОК
     def _start_process(self):
@@ -186,88 +220,181 @@ class MainWindow(ttk.Window):
         self.btn_resume.pack_forget()
         self.btn_start.pack(side=RIGHT)
 
-    def _remove_selected(self):
+    def _selected_job_id(self) -> Optional[UUID]:
         selected_item = self.tree.selection()
-        if selected_item:
-            job_id_str = selected_item[0]
-            from uuid import UUID
-            try:
-                self.service.remove_job(UUID(job_id_str))
-                self.tree.delete(job_id_str)
-            except:
-                pass
+        if not selected_item:
+            return None
+        # Для строки выхода берем всю задачу
+        try:
+            return UUID(self.tree.parent(selected_item[0]) or selected_item[0])
+        except ValueError:
+            return None
+
+    def _remove_selected(self):
+        job_id = self._selected_job_id()
+        if job_id:
+            self.service.remove_job(job_id)
+            self._apply_events()
+
+    def _toggle_selected(self):
+        """Пауза или продолжение только выбранной задачи; остальные продолжают кодироваться."""
+        job_id = self._selected_job_id()
+        if job_id is None:
+            return
+        if self.service.pause_job(job_id):
+            self._log("[INFO] Задача приостановлена")
+        elif self.service.resume_job(job_id):
+            self._log("[INFO] Задача продолжена")
+
+    def _cancel_selected(self):
+        job_id = self._selected_job_id()
+        if job_id and self.service.cancel_job(job_id):
+            self._log("[INFO] Задача отменяется")
 
     def _clear_queue(self):
         self.service.clear_queue()
-        self._refresh_table()
+        self._apply_events()
         self._log("[INFO] Очередь очищена")
 
     def _refresh_table(self):
-        for i in self.tree.get_children():
-            self.tree.delete(i)
-        for idx, job in enumerate(self.service.queue, 1):
-            self.tree.insert("", tk.END, iid=str(job.id),
-                             values=(idx, job.source_path.name, job.profile.format, f"{job.progress}%",
-                                     job.state.value))
+        """Полная перерисовка по очереди: при запуске, после удаления задач и если очередь событий переполнилась."""
+        # Подписку сбрасываем до чтения очереди: события, пришедшие во время чтения, применятся повторно
+        self._events.drain()
+        self._seen_dropped = self._events.dropped
+        self._paused = self.service.paused
+        self._job_ids = [job.id for job in self.service.queue]
+        self._positions = {job_id: i for i, job_id in enumerate(self._job_ids)}
+        self._render_page()
+
+    def _page_count(self) -> int:
+        return max(1, (len(self._job_ids) + PAGE_SIZE - 1) // PAGE_SIZE)
+
+    def _show_page(self, page: int) -> None:
+        page = min(max(page, 0), self._page_count() - 1)
+        if page != self._page:
+            self._page = page
+            self._render_page()
+
+    def _render_page(self):
+        self._page = min(self._page, self._page_count() - 1)
+        self.tree.delete(*self.tree.get_children())
+        self._visible.clear()
+        self._row_states.clear()
+        start = self._page * PAGE_SIZE
+        for job_id in self._job_ids[start:start + PAGE_SIZE]:
+            job = self.service.get_job(job_id)
+            if job is not None:
+                self._insert_row(JobAdded.of(job))
         self._update_stats()
 
+    def _insert_row(self, job: JobAdded) -> None:
+        item_id = str(job.job_id)
+        self.tree.insert("", tk.END, iid=item_id, open=True,
+                         values=(self._positions[job.job_id] + 1, job.source_name, job.format,
+                                 f"{job.progress}%", self._state_text(job.state)))
+        self._row_states[item_id] = job.state
+        # Выходы многовыходной задачи — вложенные строки со своим прогрессом и статусом
+        for rendition in job.renditions:
+            rendition_id = self._rendition_iid(job.job_id, rendition.label)
+            self.tree.insert(item_id, tk.END, iid=rendition_id,
+                             values=("", f"  └ {rendition.label}", rendition.format,
+                                     f"{rendition.progress}%", self._state_text(rendition.state)))
+            self._row_states[rendition_id] = rendition.state
+        self._visible.add(job.job_id)
+
+    def _state_text(self, state: JobState) -> str:
+        return "Пауза" if self._paused and state == JobState.RUNNING else state.value
+
+    def _apply_events(self) -> None:
+        """
+        Применяет накопившиеся события сервиса. Treeview трогается только для видимых строк,
+        вся очередь перечитывается лишь после удаления задач или потери событий.
+        """
+        events = self._events.drain()
+        if self._events.dropped != self._seen_dropped:
+            self._refresh_table()
+            return
+
+        refresh = False
+        paused = self._paused
+        for event in events:
+            if isinstance(event, ServiceStateChanged):
+                self._on_service_state(event)
+            elif isinstance(event, JobAdded):
+                if event.job_id not in self._positions:
+                    self._positions[event.job_id] = len(self._job_ids)
+                    self._job_ids.append(event.job_id)
+                    if self._positions[event.job_id] // PAGE_SIZE == self._page:
+                        self._insert_row(event)
+            elif isinstance(event, JobRemoved):
+                refresh = refresh or event.job_id in self._positions
+            elif isinstance(event, (JobStateChanged, JobProgress)) and event.job_id in self._visible:
+                self._set_row(str(event.job_id), event.progress, getattr(event, "state", None))
+                for rendition in event.renditions:
+                    self._set_row(self._rendition_iid(event.job_id, rendition.label), rendition.progress,
+                                  rendition.state)
+
+        if refresh:
+            self._refresh_table()
+            return
+        # Пауза общая для всех задач — перерисовываем статус видимых строк
+        if paused != self._paused:
+            for item_id in self._row_states:
+                self._set_row(item_id)
+        if events:
+            self._update_stats()
+
+    def _on_service_state(self, event: ServiceStateChanged) -> None:
+        self._paused = event.paused
+        # Сервис запустила горячая папка, а интерфейс думает, что мы стоим
+        if event.running and not self._processing_started:
+            self._processing_started = True
+            self._show_running_state()  # Меняем кнопки на Стоп/Пауза
+            self._log("[INFO] Автоматический запуск (Горячая папка)")
+        # Автоматический финиш
+        elif not event.running and self._processing_started:
+            self._processing_started = False
+            self._show_idle_state()
+            self._log("[INFO] Все задачи выполнены")
+            CustomPopup(self, "Готово", "Конвертация всех файлов завершена!", is_error=False)
+
+    @staticmethod
+    def _rendition_iid(job_id, label: str) -> str:
+        return f"{job_id}/{label}"
+
+    def _set_row(self, item_id: str, progress: Optional[int] = None, state: Optional[JobState] = None) -> None:
+        if state is not None:
+            self._row_states[item_id] = state
+        current_values = self.tree.item(item_id)["values"]
+        new_values = list(current_values)
+        if progress is not None:
+            new_values[3] = f"{progress}%"
+        new_values[4] = self._state_text(self._row_states[item_id])
+        # Обновляем только если данные изменились
+        if new_values != list(current_values):
+            self.tree.item(item_id, values=new_values)
+
     def _update_stats(self):
+        # len и count очереди берутся из индексов, без прохода по задачам
         total = len(self.service.queue)
-        done = len([j for j in self.service.queue if j.state == JobState.DONE])
+        done = self.service.queue.count(JobState.DONE)
         self.status_bar_label.config(text=f"Всего файлов: {total}   Завершено: {done}")
+        self.page_label.config(text=f"Стр. {self._page + 1} из {self._page_count()}")
 
     def _update_loop(self):
         try:
-            # === СИНХРОНИЗАЦИЯ СОСТОЯНИЯ (НОВОЕ) ===
-            # Если сервис работает, а интерфейс думает, что мы стоим (флаг False)
-            if self.service._running and not self._processing_started:
-                self._processing_started = True
-                self._show_running_state()  # Меняем кнопки на Стоп/Пауза
-                self._log("[INFO] Автоматический запуск (Горячая папка)")
-            # 1. Проходимся по задачам и обновляем строки
-            for job in self.service.queue:
-                item_id = str(job.id)
-                if self.tree.exists(item_id):
-                    current_values = self.tree.item(item_id)["values"]
-
-                    # Логика отображения статуса "Пауза"
-                    state_text = job.state.value
-
-                    # Проверяем атрибут безопасно (на случай если service.py не обновился)
-                    is_paused = False
-                    if hasattr(self.service, '_pause_event'):
-                        is_paused = self.service._pause_event.is_set()
-
-                    if is_paused and job.state == JobState.RUNNING:
-                        state_text = "Пауза"
-
-                    # Обновляем только если данные изменились
-                    if current_values[3] != f"{job.progress}%" or current_values[4] != state_text:
-                        new_values = list(current_values)
-                        new_values[3] = f"{job.progress}%"
-                        new_values[4] = state_text
-                        self.tree.item(item_id, values=new_values)
-                else:
-                    self._refresh_table()
-                    break
-
-            # 2. Автоматический финиш
-            if not self.service._running and self._processing_started:
-                self._processing_started = False
-                self._show_idle_state()
-                self._log("[INFO] Все задачи выполнены")
-
-                # Показываем финальное окно
-                CustomPopup(self, "Готово", "Конвертация всех файлов завершена!", is_error=False)
-
-                # Принудительно обновляем таблицу еще раз, чтобы показать 100%
-                self._refresh_table()
+            # 1. События сервиса: новые задачи, состояние, прогресс, запуск и финиш обработки
+            self._apply_events()
+
+            # Правку settings.json извне замечаем по mtime (один stat), свои сохранения приходят через подписку
+            self.service.settings_store.check()
+            if self._settings_changed:
+                self.reload_settings()
 
         except Exception as e:
             print(f"[GUI ERROR] Ошибка в цикле обновления: {e}")
             # Если произошла ошибка, не останавливаем таймер, а пробуем снова
 
-        self._update_stats()
         self.after(500, self._update_loop)
 
     def _open_settings(self):
@@ -277,29 +404,31 @@ class MainWindow(ttk.Window):
     def _on_quick_format_change(self, event):
         """Быстрое изменение формата через главное окно"""
         try:
-            # 1. Загружаем текущие настройки
-            settings = Settings.load()
-
-            # 2. Меняем только формат в профиле
             new_fmt = self.var_quick_format.get().lower()
-            settings.default_profile.format = new_fmt
 
-            # 3. Сохраняем обратно в файл
-            settings.save()
+            # Меняем только формат в профиле; чтение и запись идут под одной блокировкой
+            def set_format(settings: Settings) -> None:
+                settings.default_profile.format = new_fmt
+
+            self.service.settings_store.update(set_format)
 
             self._log(f"[INFO] Формат вывода изменен на: {new_fmt.upper()}")
 
         except Exception as e:
             self._log(f"[ERROR] Не удалось сохранить формат: {e}")
 
+    def _on_settings_changed(self, settings: Settings) -> None:
+        self._settings_changed = True
+
     def reload_settings(self):
         """Обновляет интерфейс после изменения настроек"""
-        settings = Settings.load()
+        self._settings_changed = False
+        settings = self.service.settings_store.get()
         # Обновляем значение в выпадающем списке формата
         self.var_quick_format.set(settings.default_profile.format.upper())
         self._log("[INFO] Настройки обновлены")
 
 def run_gui():
-    service = ConverterService()
+    service = ConverterService.from_settings()
     app = MainWindow(service)
     app.mainloop()
\ No newline at end of file
@@ -0,0 +1,80 @@
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+from .models import FormatProfile, HotFolderRule, Settings
+
+Root = Tuple[Path, bool]  # папка и нужно ли следить за вложенными
+
+
+def hot_folder_rules(settings: Settings) -> List[HotFolderRule]:
+    """Каналы горячей папки: hot_folders и, для совместимости, одиночная hot_folder_path."""
+    if not settings.hot_folder_enabled:
+        return []
+    rules = list(settings.hot_folders)
+    if settings.hot_folder_path:
+        rules.append(HotFolderRule(path=settings.hot_folder_path))
+    return rules
+
+
+def watch_roots(rules: Iterable[HotFolderRule]) -> Tuple[Root, ...]:
+    """Существующие корни наблюдения; если одна папка указана дважды, вложенные смотрим, если нужно хоть одному."""
+    roots = {}
+    for rule in rules:
+        root = Path(rule.path)
+        if root.is_dir():
+            roots[root] = roots.get(root, False) or rule.recursive
+    return tuple(sorted(roots.items()))
+
+
+def _matches(name: str, relative: str, patterns: List[str]) -> bool:
+    # Шаблон без "/" сравнивается с именем файла, с "/" — с путем от корня канала
+    return any(fnmatch(relative if "/" in pattern else name, pattern) for pattern in patterns)
+
+
+def _relative(rule: HotFolderRule, path: Path) -> Optional[Path]:
+    try:
+        relative = path.relative_to(rule.path)
+    except ValueError:
+        return None
+    if not rule.recursive and len(relative.parts) != 1:
+        return None
+    return relative
+
+
+def rule_accepts(rule: HotFolderRule, path: Path, extensions: Iterable[str]) -> bool:
+    relative = _relative(rule, path)
+    if relative is None:
+        return False
+    posix = relative.as_posix()
+    if rule.include:
+        if not _matches(path.name, posix, rule.include):
+            return False
+    elif path.suffix.lower() not in extensions:
+        return False
+    return not _matches(path.name, posix, rule.exclude)
+
+
+def match_rule(rules: Iterable[HotFolderRule], path: Path, output_path: str,
+               extensions: Iterable[str]) -> Optional[HotFolderRule]:
+    """Первый канал, который принимает файл; None — файл не нужен ни одному."""
+    rules = list(rules)
+    outputs = {Path(rule.output_path or output_path) for rule in rules}
+    for rule in rules:
+        if not rule_accepts(rule, path, extensions):
+            continue
+        # Результаты, которые пишутся внутрь наблюдаемого дерева, не должны вернуться на вход
+        root = Path(rule.path)
+        if any(root in output.parents and output in path.parents for output in outputs):
+            continue
+        return rule
+    return None
+
+
+def rule_output_dir(rule: HotFolderRule, path: Path, output_path: str) -> Path:
+    """Папка результата: своя у канала или общая, плюс путь подпапки исходника при рекурсивном наблюдении."""
+    return Path(rule.output_path or output_path) / path.parent.relative_to(rule.path)
+
+
+def rule_profile(rule: HotFolderRule, settings: Settings) -> FormatProfile:
+    return rule.profile or settings.default_profile
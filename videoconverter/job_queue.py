@@ -0,0 +1,280 @@
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Tuple
+from uuid import UUID
+
+from .models import Job, JobState
+
+
+class OrderingPolicy:
+    """Политика порядка выдачи задач: чем меньше ключ, тем раньше задача. При равенстве — FIFO."""
+
+    name = "fifo"
+    needs_duration = False  # нужна ли политике длительность исходника (ffprobe)
+
+    def key(self, job: Job) -> Tuple:
+        return ()
+
+
+class FifoPolicy(OrderingPolicy):
+    name = "fifo"
+
+
+class PriorityPolicy(OrderingPolicy):
+    name = "priority"
+
+    def key(self, job: Job) -> Tuple:
+        return (-job.priority,)
+
+
+class ShortestJobFirstPolicy(OrderingPolicy):
+    """Сначала короткие файлы (внутри класса приоритета); неизвестная длительность — в конец."""
+
+    name = "sjf"
+    needs_duration = True
+
+    def key(self, job: Job) -> Tuple:
+        return (-job.priority, job.duration if job.duration is not None else math.inf)
+
+
+class EarliestDeadlinePolicy(OrderingPolicy):
+    """Сначала задачи с ближайшим сроком; задачи без срока — после них, по приоритету."""
+
+    name = "edf"
+
+    def key(self, job: Job) -> Tuple:
+        return (job.deadline if job.deadline is not None else math.inf, -job.priority)
+
+
+POLICIES = {policy.name: policy for policy in (FifoPolicy, PriorityPolicy, ShortestJobFirstPolicy,
+                                               EarliestDeadlinePolicy)}
+
+
+def get_policy(name: str) -> OrderingPolicy:
+    try:
+        return POLICIES[name.lower()]()
+    except KeyError:
+        raise ValueError(f"Неизвестная политика очереди: {name}. Допустимые: {', '.join(POLICIES)}")
+
+
+class WaitStats:
+    """Статистика ожидания в очереди (от добавления до старта) для одной политики."""
+
+    SAMPLES = 1000  # перцентили считаем по последним N задачам
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.missed_deadlines = 0
+        self._recent: Deque[float] = deque(maxlen=self.SAMPLES)
+
+    def add(self, wait: float, missed_deadline: bool = False) -> None:
+        self.count += 1
+        self.total += wait
+        self.max = max(self.max, wait)
+        self.missed_deadlines += int(missed_deadline)
+        self._recent.append(wait)
+
+    def percentile(self, q: float) -> float:
+        if not self._recent:
+            return 0.0
+        ordered = sorted(self._recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "max": self.max,
+            "missed_deadlines": self.missed_deadlines,
+        }
+
+
+class JobQueue:
+    """
+    Потокобезопасная очередь задач с индексами.
+    - по id и по исходному файлу — поиск за O(1);
+    - по состоянию (корзины) — подсчет и выборка без полного прохода;
+    - ожидающие задачи лежат в куче по ключу политики, затем по порядку добавления.
+    Порядок итерации совпадает с порядком добавления, как у прежнего списка.
+    Состояние задач, лежащих в очереди, нужно менять через set_state().
+    """
+
+    def __init__(self, policy: Optional[OrderingPolicy] = None):
+        self.policy = policy or PriorityPolicy()
+        self.wait_stats: Dict[str, WaitStats] = {}
+        self._lock = threading.RLock()
+        self._jobs: Dict[UUID, Job] = {}
+        self._by_source: Dict[Path, Dict[UUID, None]] = {}
+        self._buckets: Dict[JobState, Dict[UUID, None]] = {state: {} for state in JobState}
+        self._heap: List[Tuple[Tuple, int, UUID]] = []
+        self._heap_entry: Dict[UUID, int] = {}  # актуальный номер записи в куче для задачи
+        self._counter = itertools.count()
+
+    # --- Совместимость со списком ---
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def __iter__(self) -> Iterator[Job]:
+        with self._lock:
+            return iter(list(self._jobs.values()))
+
+    def __contains__(self, job: object) -> bool:
+        return isinstance(job, Job) and self._jobs.get(job.id) is job
+
+    def __bool__(self) -> bool:
+        return bool(self._jobs)
+
+    # --- Поиск ---
+    def get(self, job_id: UUID) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def has_source(self, source_path: Path) -> bool:
+        return source_path in self._by_source
+
+    def count(self, state: JobState) -> int:
+        return len(self._buckets[state])
+
+    def jobs_in_state(self, state: JobState) -> List[Job]:
+        with self._lock:
+            return [self._jobs[job_id] for job_id in self._buckets[state]]
+
+    def pending(self) -> List[Job]:
+        """Ожидающие задачи в порядке выдачи."""
+        with self._lock:
+            return sorted(self.jobs_in_state(JobState.QUEUED), key=self._order_key)
+
+    # --- Изменение ---
+    def add(self, job: Job) -> None:
+        with self._lock:
+            if job.id in self._jobs:
+                return
+            self._jobs[job.id] = job
+            self._by_source.setdefault(job.source_path, {})[job.id] = None
+            self._buckets[job.state][job.id] = None
+            if job.state == JobState.QUEUED:
+                self._push(job)
+
+    def remove(self, job_id: UUID) -> Optional[Job]:
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+            if job is None:
+                return None
+            sources = self._by_source.get(job.source_path)
+            if sources is not None:
+                sources.pop(job_id, None)
+                if not sources:
+                    del self._by_source[job.source_path]
+            self._buckets[job.state].pop(job_id, None)
+            # Запись в куче станет "мертвой" и будет пропущена при выдаче
+            self._heap_entry.pop(job_id, None)
+            return job
+
+    def remove_where(self, predicate: Callable[[Job], bool]) -> List[Job]:
+        with self._lock:
+            doomed = [job for job in self._jobs.values() if predicate(job)]
+            for job in doomed:
+                self.remove(job.id)
+            return doomed
+
+    def remove_states(self, *states: JobState) -> List[Job]:
+        """Удаляет все задачи в указанных состояниях (проходит только по их корзинам)."""
+        with self._lock:
+            doomed = [self._jobs[job_id] for state in states for job_id in list(self._buckets[state])]
+            for job in doomed:
+                self.remove(job.id)
+            return doomed
+
+    def set_state(self, job: Job, state: JobState) -> None:
+        with self._lock:
+            if self._jobs.get(job.id) is not job:
+                job.state = state
+                return
+            previous = job.state
+            self._buckets[previous].pop(job.id, None)
+            job.state = state
+            self._buckets[state][job.id] = None
+            # Ожидание заканчивается при выдаче из очереди; продолжение после паузы — не новый старт
+            if previous == JobState.QUEUED and state == JobState.RUNNING:
+                self._record_wait(job)
+            if state == JobState.QUEUED:
+                self._push(job)
+            else:
+                self._heap_entry.pop(job.id, None)
+
+    def transition(self, job: Job, expected: JobState, state: JobState) -> bool:
+        """Меняет состояние, только если задача все еще в ожидаемом состоянии (атомарно)."""
+        with self._lock:
+            if job.state != expected:
+                return False
+            self.set_state(job, state)
+            return True
+
+    def reorder(self, job: Job) -> None:
+        """Пересчитывает место ожидающей задачи после изменения ее приоритета."""
+        with self._lock:
+            if job.state == JobState.QUEUED and self._jobs.get(job.id) is job:
+                self._push(job)
+
+    def peek_next(self) -> Optional[Job]:
+        """Следующая ожидающая задача без изменения ее состояния."""
+        with self._lock:
+            while self._heap:
+                _key, seq, job_id = self._heap[0]
+                if self._heap_entry.get(job_id) == seq:
+                    return self._jobs[job_id]
+                heapq.heappop(self._heap)  # попутно выбрасываем "мертвые" записи
+            return None
+
+    def claim_next(self) -> Optional[Job]:
+        """Атомарно выдает следующую ожидающую задачу и переводит ее в RUNNING."""
+        with self._lock:
+            while self._heap:
+                _key, seq, job_id = heapq.heappop(self._heap)
+                if self._heap_entry.get(job_id) != seq:
+                    continue  # задача удалена, уже выдана или переупорядочена
+                job = self._jobs[job_id]
+                self.set_state(job, JobState.RUNNING)
+                job.progress = 0
+                return job
+            return None
+
+    def set_policy(self, policy: OrderingPolicy) -> None:
+        """Меняет политику и перестраивает кучу ожидающих задач."""
+        with self._lock:
+            self.policy = policy
+            self._heap.clear()
+            self._heap_entry.clear()
+            for job_id in self._buckets[JobState.QUEUED]:
+                self._push(self._jobs[job_id])
+
+    def wait_report(self) -> Dict[str, dict]:
+        with self._lock:
+            return {name: stats.to_dict() for name, stats in self.wait_stats.items()}
+
+    # --- Внутреннее ---
+    def _order_key(self, job: Job) -> Tuple:
+        return self.policy.key(job)
+
+    def _record_wait(self, job: Job) -> None:
+        now = time.time()
+        job.started_at = now
+        missed = job.deadline is not None and now > job.deadline
+        self.wait_stats.setdefault(self.policy.name, WaitStats()).add(max(0.0, now - job.created_at), missed)
+
+    def _push(self, job: Job) -> None:
+        if len(self._heap) > 2 * len(self._heap_entry) + 64:
+            # Слишком много "мертвых" записей — пересобираем кучу
+            self._heap = [entry for entry in self._heap if self._heap_entry.get(entry[2]) == entry[1]]
+            heapq.heapify(self._heap)
+        seq = next(self._counter)
+        self._heap_entry[job.id] = seq
+        heapq.heappush(self._heap, (self._order_key(job), seq, job.id))
@@ -0,0 +1,177 @@
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import asdict
+from pathlib import Path
+from typing import List, Optional
+from uuid import UUID
+
+from .models import Job, JobState, FormatProfile, Rendition
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    source_path TEXT NOT NULL,
+    output_dir TEXT NOT NULL,
+    profile TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    segmented INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL,
+    error_message TEXT,
+    deadline REAL,
+    renditions TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    event TEXT NOT NULL,
+    ts REAL NOT NULL,
+    message TEXT
+);
+CREATE INDEX IF NOT EXISTS events_job ON events(job_id);
+"""
+
+
+class JobJournal:
+    """
+    Журнал задач в SQLite (режим WAL).
+    Таблица events — только дописывается (создание, смена состояния или приоритета, удаление),
+    таблица jobs — текущий снимок, по которому очередь восстанавливается при запуске.
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._migrate()
+        self._conn.commit()
+
+    def _migrate(self) -> None:
+        # Журналы, созданные до появления новых колонок, дополняем на месте
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "deadline" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN deadline REAL")
+        if "renditions" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN renditions TEXT")
+
+    def record_created(self, job: Job) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs (id, source_path, output_dir, profile, priority, segmented, "
+                "state, error_message, deadline, renditions, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (str(job.id), str(job.source_path), str(job.output_dir), json.dumps(asdict(job.profile)),
+                 int(job.priority), int(job.segmented), job.state.name, job.error_message, job.deadline,
+                 _dump_renditions(job), job.created_at, now),
+            )
+            self._append(str(job.id), "CREATED", now)
+
+    def record_state(self, job: Job) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, priority = ?, error_message = ?, updated_at = ? WHERE id = ?",
+                (job.state.name, int(job.priority), job.error_message, now, str(job.id)),
+            )
+            self._append(str(job.id), job.state.name, now, job.error_message)
+
+    def record_priority(self, job: Job) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE jobs SET priority = ?, updated_at = ? WHERE id = ?",
+                               (int(job.priority), now, str(job.id)))
+            self._append(str(job.id), "PRIORITY", now, str(int(job.priority)))
+
+    def record_removed(self, job_id: UUID) -> None:
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (str(job_id),))
+            self._append(str(job_id), "REMOVED", now)
+
+    def _append(self, job_id: str, event: str, ts: float, message: Optional[str] = None) -> None:
+        self._conn.execute("INSERT INTO events (job_id, event, ts, message) VALUES (?, ?, ?, ?)",
+                           (job_id, event, ts, message))
+
+    def load_jobs(self) -> List[Job]:
+        """Читает сохраненные задачи в порядке создания."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, source_path, output_dir, profile, priority, segmented, state, error_message, "
+                "deadline, renditions, created_at FROM jobs ORDER BY created_at, rowid"
+            ).fetchall()
+        jobs = []
+        for (job_id, source, output_dir, profile, priority, segmented, state, error, deadline, renditions,
+             created) in rows:
+            try:
+                jobs.append(Job(
+                    source_path=Path(source),
+                    output_dir=Path(output_dir),
+                    profile=FormatProfile(**json.loads(profile)),
+                    id=UUID(job_id),
+                    state=JobState[state],
+                    progress=100 if state == JobState.DONE.name else 0,
+                    priority=priority,
+                    error_message=error,
+                    segmented=bool(segmented),
+                    deadline=deadline,
+                    created_at=created,
+                    renditions=_load_renditions(renditions, JobState[state]),
+                ))
+            except (KeyError, TypeError, ValueError) as e:
+                print(f"[WARN] Пропущена поврежденная запись журнала {job_id}: {e}")
+        return jobs
+
+    def history(self, job_id: UUID) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT event FROM events WHERE job_id = ? ORDER BY seq",
+                                      (str(job_id),)).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _dump_renditions(job: Job) -> Optional[str]:
+    if not job.renditions:
+        return None
+    return json.dumps([{"label": r.label, "profile": asdict(r.profile)} for r in job.renditions])
+
+
+def _load_renditions(raw: Optional[str], state: JobState) -> List[Rendition]:
+    if not raw:
+        return []
+    # Выходы завершенной задачи тоже завершены; у остальных итог по выходам еще не известен
+    done = state == JobState.DONE
+    return [Rendition(profile=FormatProfile(**item["profile"]), label=item["label"],
+                      state=JobState.DONE if done else JobState.QUEUED, progress=100 if done else 0)
+            for item in json.loads(raw)]
+
+
+def recover_jobs(journal: JobJournal) -> List[Job]:
+    """
+    Восстанавливает очередь после перезапуска.
+    Задачи, прерванные во время кодирования, возвращаются в очередь, а их
+    недописанный выходной файл удаляется. Завершенные задачи не повторяются.
+    """
+    jobs = journal.load_jobs()
+    for job in jobs:
+        if job.state in (JobState.RUNNING, JobState.PAUSED):
+            for partial in job.output_files:
+                if partial.exists() and partial != job.source_path:
+                    try:
+                        partial.unlink()
+                        print(f"[JOURNAL] Удален недописанный файл: {partial}")
+                    except OSError as e:
+                        print(f"[WARN] Не удалось удалить недописанный файл {partial}: {e}")
+            job.state = JobState.QUEUED
+            job.progress = 0
+            journal.record_state(job)
+    return jobs
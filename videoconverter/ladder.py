@@ -0,0 +1,127 @@
+import threading
+from dataclasses import replace
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import psutil
+
+from .converter import (ConversionOptions, ConversionError, build_output_args, get_video_duration,
+                        parse_bitrate, run_ffmpeg)
+from .models import FormatProfile, Rendition
+from .progress import ProgressInfo
+
+Output = Tuple[Path, ConversionOptions]
+
+# Битрейт ступени растет медленнее площади кадра: у маленьких кадров выше нагрузка на пиксель
+BITRATE_EXPONENT = 0.75
+
+
+def _pixels(resolution: Optional[str]) -> int:
+    try:
+        width, height = (resolution or "").lower().split("x")
+        return int(width) * int(height)
+    except ValueError:
+        return 0
+
+
+def rendition_label(resolution: str) -> str:
+    """1280x720 -> 720p; нестандартная запись разрешения остается как есть."""
+    _, _, height = resolution.lower().partition("x")
+    return f"{height}p" if height.isdigit() else resolution
+
+
+def build_renditions(base: FormatProfile, resolutions: Sequence[str]) -> List[Rendition]:
+    """
+    Лесенка выходов из базового профиля: меняется только разрешение,
+    а битрейт пересчитывается пропорционально площади кадра (в степени 0.75).
+    """
+    base_pixels = _pixels(base.resolution)
+    base_bitrate = parse_bitrate(base.bitrate)
+    renditions: List[Rendition] = []
+    labels = set()
+    for resolution in resolutions:
+        bitrate = base.bitrate
+        pixels = _pixels(resolution)
+        if base_bitrate and base_pixels and pixels:
+            scaled = base_bitrate * (pixels / base_pixels) ** BITRATE_EXPONENT
+            bitrate = f"{max(1, round(scaled / 1000))}k"
+        label = rendition_label(resolution)
+        if label in labels:
+            label = f"{label}_{len(renditions) + 1}"
+        labels.add(label)
+        renditions.append(Rendition(profile=replace(base, resolution=resolution, bitrate=bitrate), label=label))
+    return renditions
+
+
+def build_ladder_command(input_file: Path, outputs: Sequence[Output],
+                         extra_branches: Sequence[Tuple[str, List[str]]] = ()) -> List[str]:
+    """
+    Одна команда ffmpeg на все выходы: видео декодируется один раз и размножается фильтром split,
+    каждая ветка масштабируется и кодируется своим энкодером. Выходы, видео которых
+    можно скопировать, берут поток напрямую, без декодирования.
+    extra_branches — дополнительные ветки (цепочка фильтров, параметры выхода), например превью.
+    """
+    cmd: List[str] = ["ffmpeg", "-y", "-i", str(input_file)]
+    encoded = [i for i, (_, options) in enumerate(outputs) if not options.copy_video]
+    if encoded or extra_branches:
+        labels = [f"[s{i}]" for i in encoded] + [f"[x{k}]" for k in range(len(extra_branches))]
+        chains = [f"[0:v:0]split={len(labels)}" + "".join(labels)]
+        for i in encoded:
+            options = outputs[i][1]
+            filters = []
+            if options.resolution:
+                filters.append("scale=" + options.resolution.lower().replace("x", ":"))
+            if options.fps:
+                filters.append(f"fps={options.fps}")
+            chains.append(f"[s{i}]{','.join(filters) or 'null'}[v{i}]")
+        chains.extend(f"[x{k}]{chain}[xv{k}]" for k, (chain, _) in enumerate(extra_branches))
+        cmd.extend(["-filter_complex", ";".join(chains)])
+
+    for i, (output_file, options) in enumerate(outputs):
+        cmd.extend(["-map", f"[v{i}]" if i in encoded else "0:v:0?", "-map", "0:a:0?"])
+        cmd.extend(build_output_args(options, geometry=False))
+        cmd.append(str(output_file))
+    for k, (_, args) in enumerate(extra_branches):
+        cmd.extend(["-map", f"[xv{k}]", *args])
+    return cmd
+
+
+def convert_ladder(
+        input_file: Path,
+        outputs: Sequence[Output],
+        progress_callback: Optional[Callable[[int], None]] = None,
+        pause_event: Optional[threading.Event] = None,
+        stop_event: Optional[threading.Event] = None,
+        metrics_callback: Optional[Callable[[ProgressInfo], None]] = None,
+        output_callback: Optional[Callable[[int, int], None]] = None,
+        process_callback: Optional[Callable[[psutil.Process], None]] = None,
+        extra_branches: Sequence[Tuple[str, List[str]]] = (),
+        timeout: Optional[float] = None,
+) -> None:
+    """
+    Кодирует все выходы одним процессом ffmpeg.
+    output_callback(index, size) получает размер каждого выхода на каждом шаге прогресса.
+    timeout — предел времени кодирования в секундах.
+    """
+    if not input_file.exists():
+        raise ConversionError(f"Файл не найден: {input_file}")
+    if not outputs:
+        raise ConversionError("Не задано ни одного выхода")
+
+    def on_metrics(info: ProgressInfo) -> None:
+        if metrics_callback:
+            metrics_callback(info)
+        if output_callback:
+            for i, (output_file, _) in enumerate(outputs):
+                try:
+                    output_callback(i, output_file.stat().st_size)
+                except OSError:
+                    pass  # ffmpeg еще не создал файл
+
+    cmd = build_ladder_command(input_file, outputs, extra_branches)
+    names = ", ".join(output_file.name for output_file, _ in outputs)
+    print(f"[INFO] Конвертация в {len(outputs)} выхода(ов): {input_file} -> {names}")
+    run_ffmpeg(cmd, get_video_duration(input_file), progress_callback, pause_event, stop_event, on_metrics,
+               process_callback, timeout)
+    if not (stop_event and stop_event.is_set()):
+        print(f"[OK] Готово: {names}")
@@ -0,0 +1,225 @@
+import math
+import threading
+from dataclasses import asdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import psutil
+
+from .models import FormatProfile, Job, JobMetrics
+
+PREFIX = "videoconverter_"
+MB = 1024 * 1024
+
+SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 1800, 3600, 7200)
+SPEED_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64)
+FPS_BUCKETS = (5, 15, 30, 60, 120, 240, 480, 960)
+RSS_BUCKETS = tuple(n * MB for n in (64, 128, 256, 512, 1024, 2048, 4096, 8192))
+RATIO_BUCKETS = (0.5, 1, 2, 4, 8, 16, 32, 64)
+
+# имя -> (тип, описание, границы корзин для гистограмм)
+METRICS: Dict[str, Tuple[str, str, Sequence[float]]] = {
+    "jobs_total": ("counter", "Завершенные задачи по профилю, итогу и пути кодирования", ()),
+    "job_probe_seconds": ("histogram", "Время ffprobe на задачу", SECONDS_BUCKETS),
+    "job_queue_wait_seconds": ("histogram", "Ожидание в очереди от добавления до старта", SECONDS_BUCKETS),
+    "job_encode_seconds": ("histogram", "Время работы ffmpeg", SECONDS_BUCKETS),
+    "job_speed_ratio": ("histogram", "Скорость кодирования относительно реального времени", SPEED_BUCKETS),
+    "job_encode_fps": ("histogram", "Кадров в секунду по отчету ffmpeg", FPS_BUCKETS),
+    "job_peak_rss_bytes": ("histogram", "Пиковая память процесса ffmpeg", RSS_BUCKETS),
+    "job_compression_ratio": ("histogram", "Отношение размера исходника к результату", RATIO_BUCKETS),
+    "job_cpu_seconds_total": ("counter", "Процессорное время ffmpeg", ()),
+    "job_input_bytes_total": ("counter", "Прочитано байт исходников", ()),
+    "job_output_bytes_total": ("counter", "Записано байт результатов", ()),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def profile_label(profile: FormatProfile) -> str:
+    """Короткое имя профиля для меток: формат, кодек, разрешение, пресет/CRF."""
+    quality = f"crf{profile.crf}" if profile.crf is not None else (profile.bitrate or "auto")
+    return ":".join((profile.format.lower(), profile.video_codec or "auto", profile.resolution or "source",
+                     profile.preset or "default", quality))
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)  # не накопительные; суммируем при выводе
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        total, result = 0, []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((bound, total))
+        result.append((math.inf, self.count))
+        return result
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "buckets": {_format_value(bound): count for bound, count in self.cumulative()},
+        }
+
+
+class MetricsRegistry:
+    """
+    Счетчики и гистограммы по завершенным задачам (с метками профиля).
+    Отдаются в текстовом формате Prometheus и как JSON-снимок.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+
+    def inc(self, name: str, value: float = 1.0, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram(METRICS[name][2])
+            series[key].observe(value)
+
+    def observe_job(self, job: Job) -> None:
+        """Учитывает задачу, дошедшую до итогового состояния."""
+        m = job.metrics
+        profile = profile_label(job.profile)
+        path = job.conversion_path.name.lower() if job.conversion_path else "unknown"
+        self.inc("jobs_total", profile=profile, state=job.state.name.lower(), path=path)
+        self.observe("job_probe_seconds", m.probe_time, profile=profile)
+        if m.queue_wait is not None:
+            self.observe("job_queue_wait_seconds", m.queue_wait, profile=profile)
+        if m.encode_time is not None:
+            self.observe("job_encode_seconds", m.encode_time, profile=profile)
+        if m.speed:
+            self.observe("job_speed_ratio", m.speed, profile=profile)
+        if m.fps:
+            self.observe("job_encode_fps", m.fps, profile=profile)
+        if m.peak_rss:
+            self.observe("job_peak_rss_bytes", m.peak_rss, profile=profile)
+        if m.compression_ratio:
+            self.observe("job_compression_ratio", m.compression_ratio, profile=profile)
+        self.inc("job_cpu_seconds_total", m.cpu_seconds, profile=profile)
+        self.inc("job_input_bytes_total", m.input_bytes, profile=profile)
+        self.inc("job_output_bytes_total", m.output_bytes, profile=profile)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = {name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                        for name, series in self._counters.items()}
+            histograms = {name: [{"labels": dict(key), **hist.to_dict()} for key, hist in series.items()]
+                          for name, series in self._histograms.items()}
+        return {"counters": counters, "histograms": histograms}
+
+    def render_prometheus(self, gauges: Optional[Dict[str, Tuple[str, Dict[Labels, float]]]] = None) -> str:
+        """
+        Текстовый формат Prometheus 0.0.4.
+        gauges — мгновенные значения {имя: (описание, {метки: значение})}, например глубина очереди.
+        """
+        lines: List[str] = []
+        with self._lock:
+            for name, (kind, help_text, _) in METRICS.items():
+                series = self._counters.get(name) if kind == "counter" else self._histograms.get(name)
+                if not series:
+                    continue
+                lines.append(f"# HELP {PREFIX}{name} {help_text}")
+                lines.append(f"# TYPE {PREFIX}{name} {kind}")
+                for key, value in sorted(series.items()):
+                    if kind == "counter":
+                        lines.append(f"{PREFIX}{name}{_labels(key)} {_format_value(value)}")
+                        continue
+                    for bound, count in value.cumulative():
+                        le = key + (("le", _format_value(bound)),)
+                        lines.append(f"{PREFIX}{name}_bucket{_labels(le)} {count}")
+                    lines.append(f"{PREFIX}{name}_sum{_labels(key)} {_format_value(value.sum)}")
+                    lines.append(f"{PREFIX}{name}_count{_labels(key)} {value.count}")
+        for name, (help_text, series) in (gauges or {}).items():
+            lines.append(f"# HELP {PREFIX}{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}{name} gauge")
+            for key, value in sorted(series.items()):
+                lines.append(f"{PREFIX}{name}{_labels(key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class ProcessSampler:
+    """
+    Замер CPU и памяти процессов ffmpeg задачи через psutil (у сегментного кодирования их несколько).
+    После выхода процесса его счетчики уже не прочитать, поэтому замеряем на каждом отчете -progress.
+    CPU — сумма по всем процессам задачи, память — пик суммарной памяти одновременно живых процессов.
+    """
+
+    def __init__(self, metrics: JobMetrics):
+        self.metrics = metrics
+        self._processes: List[psutil.Process] = []
+        self._cpu: Dict[int, float] = {}  # последний замер CPU каждого процесса по pid
+        self._lock = threading.Lock()
+
+    def attach(self, process: psutil.Process) -> None:
+        with self._lock:
+            self._processes = [p for p in self._processes if _running(p)] + [process]
+        self.sample()
+
+    def sample(self) -> None:
+        with self._lock:
+            rss = 0
+            for process in self._processes:
+                try:
+                    with process.oneshot():
+                        times = process.cpu_times()
+                        rss += process.memory_info().rss
+                except psutil.Error:
+                    continue  # процесс уже завершился
+                self._cpu[process.pid] = times.user + times.system
+            if self._cpu:
+                self.metrics.cpu_seconds = max(self.metrics.cpu_seconds, sum(self._cpu.values()))
+            self.metrics.peak_rss = max(self.metrics.peak_rss, rss)
+
+
+def _running(process: psutil.Process) -> bool:
+    try:
+        return process.is_running() and process.status() != psutil.STATUS_ZOMBIE
+    except psutil.Error:
+        return False
+
+
+def metrics_to_dict(metrics: JobMetrics) -> dict:
+    data = asdict(metrics)
+    ratio = metrics.compression_ratio
+    data["compression_ratio"] = round(ratio, 3) if ratio else None
+    return data
+
+
+def _labels(key: Labels) -> str:
+    if not key:
+        return ""
+    body = ",".join(f'{name}="{_escape(value)}"' for name, value in key)
+    return "{" + body + "}"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
@@ -1,6 +1,8 @@
 import json
+import os
+import time
 from dataclasses import dataclass, field, asdict
-from enum import Enum
+from enum import Enum, IntEnum
 from pathlib import Path
 from typing import List, Optional
 from uuid import UUID, uuid4
@@ -14,6 +16,20 @@ class JobState(Enum):
     FAILED = "Ошибка"
     CANCELLED = "Отменено"
 
+# Каким путем была получена выходная запись
+class ConversionPath(Enum):
+    TRANSCODE = "Перекодирование"
+    PARTIAL_COPY = "Частичное копирование"
+    REMUX = "Копирование потоков"
+    CACHED = "Из кэша"  # такой же исходник уже кодировался с этим профилем
+
+# Классы приоритета: задачи с большим значением выдаются раньше
+class JobPriority(IntEnum):
+    LOW = -10
+    NORMAL = 0
+    HIGH = 10
+    URGENT = 20
+
 @dataclass
 class FormatProfile:
     format: str = "mp4"
@@ -22,6 +38,40 @@ class FormatProfile:
     resolution: str = "1920x1080"
     bitrate: str = "4M"
     fps: int = 30
+    preset: str = ""  # пресет скорости энкодера ("" — по умолчанию энкодера)
+    crf: Optional[int] = None  # если задан, кодируем по качеству, а bitrate становится потолком
+    threads: int = 0  # потоки энкодера для этого профиля (0 — бюджет сервиса)
+    # Превью делаются в том же проходе ffmpeg, что и кодирование
+    poster: bool = False  # кадр-обложка {имя}_poster.jpg
+    preview_interval: int = 0  # секунд между миниатюрами листов {имя}_sprite_NNN.jpg (0 — без листов)
+    preview_width: int = 160  # ширина миниатюры; высота — по пропорциям кадра
+    preview_tile: str = "10x10"  # сетка листа миниатюр: столбцы x строки
+
+@dataclass
+class Rendition:
+    """Один выход многовыходной задачи (ступень ABR-лесенки)."""
+    profile: FormatProfile
+    label: str  # суффикс имени файла, например 720p
+    state: JobState = JobState.QUEUED
+    progress: int = 0
+    size: int = 0  # сколько байт уже записано
+
+@dataclass
+class JobMetrics:
+    """Замеры одной задачи: время в секундах, объемы в байтах."""
+    probe_time: float = 0.0  # ffprobe (с учетом кэша)
+    queue_wait: Optional[float] = None  # от добавления до старта
+    encode_time: Optional[float] = None  # работа ffmpeg от запуска до завершения
+    speed: Optional[float] = None  # скорость относительно реального времени по отчету ffmpeg
+    fps: Optional[float] = None
+    cpu_seconds: float = 0.0  # процессорное время ffmpeg (psutil)
+    peak_rss: int = 0  # пиковая память ffmpeg (psutil)
+    input_bytes: int = 0
+    output_bytes: int = 0
+
+    @property
+    def compression_ratio(self) -> Optional[float]:
+        return self.input_bytes / self.output_bytes if self.output_bytes else None
 
 @dataclass
 class Job:
@@ -31,7 +81,18 @@ class Job:
     id: UUID = field(default_factory=uuid4)
     state: JobState = JobState.QUEUED
     progress: int = 0
+    priority: int = JobPriority.NORMAL  # задачи с большим приоритетом выдаются раньше
+    deadline: Optional[float] = None  # желаемое время готовности (unix time) для политики edf
+    duration: Optional[float] = None  # длительность исходника по ffprobe (для политики sjf)
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
     error_message: Optional[str] = None
+    segmented: bool = False  # кодировать длинный файл параллельными сегментами
+    conversion_path: Optional[ConversionPath] = None
+    # Несколько выходов за один проход декодирования (пусто — обычная задача с одним выходом)
+    renditions: List[Rendition] = field(default_factory=list)
+    metrics: JobMetrics = field(default_factory=JobMetrics)
+    previews: List[Path] = field(default_factory=list)  # созданные обложка, листы миниатюр и индекс WebVTT
 
     @property
     def output_filename(self) -> Path:
@@ -39,35 +100,88 @@ class Job:
         new_name = f"{self.source_path.stem}.{self.profile.format.lower()}"
         return self.output_dir / new_name
 
+    def rendition_output(self, rendition: Rendition) -> Path:
+        return self.output_dir / f"{self.source_path.stem}_{rendition.label}.{rendition.profile.format.lower()}"
+
+    @property
+    def output_files(self) -> List[Path]:
+        if self.renditions:
+            return [self.rendition_output(r) for r in self.renditions]
+        return [self.output_filename]
+
+@dataclass
+class HotFolderRule:
+    """Канал горячей папки: откуда брать файлы, какие именно, каким профилем и куда класть результат."""
+    path: str
+    recursive: bool = False  # следить и за вложенными папками (их структура повторяется в выводе)
+    include: List[str] = field(default_factory=list)  # шаблоны файлов; пусто — все видео
+    exclude: List[str] = field(default_factory=list)
+    output_path: str = ""  # "" — общий output_path
+    profile: Optional[FormatProfile] = None  # None — default_profile
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "HotFolderRule":
+        data = dict(data)
+        profile = data.pop("profile", None)
+        return cls(**data, profile=FormatProfile(**profile) if profile else None)
+
 @dataclass
 class Settings:
     output_path: str = str(Path.home() / "Videos")
     hot_folder_enabled: bool = False
     hot_folder_path: str = ""
+    hot_folders: List[HotFolderRule] = field(default_factory=list)  # дополнительные каналы горячей папки
+    hot_folder_quiet_seconds: float = 2.0  # файл без изменений столько секунд считается дописанным
+    hot_folder_ready_check: str = "container"  # none, container (moov/RIFF) или ffprobe
     notifications_enabled: bool = False
+    max_workers: int = 0  # 0 — подобрать автоматически по числу ядер
+    threads_per_job: int = 0  # 0 — ffmpeg сам выбирает число потоков
+    resource_scheduler: bool = False  # запускать задачи с учетом загрузки CPU, памяти и диска
+    queue_policy: str = "priority"  # порядок выдачи: fifo, priority, sjf, edf
+    engine: str = "threads"  # threads — пул потоков, asyncio — один event loop для всех задач
+    job_timeout: float = 0.0  # предел времени кодирования одной задачи в секундах (0 — без предела)
+    journal_path: str = "jobs.db"  # журнал очереди для восстановления после сбоя ("" — отключен)
+    output_cache_path: str = ""  # кэш результатов по содержимому исходника ("" — отключен)
+    output_cache_max_mb: int = 20480
+    abr_ladder: List[str] = field(default_factory=list)  # разрешения выходов, например ["1920x1080", "1280x720"]
     default_profile: FormatProfile = field(default_factory=FormatProfile)
 
     SETTINGS_FILE = Path("settings.json")
 
     @classmethod
-    def load(cls) -> "Settings":
-        if not cls.SETTINGS_FILE.exists():
+    def load(cls, path: Optional[Path] = None) -> "Settings":
+        """Читает файл напрямую. В приложении настройки берутся из SettingsStore, который кэширует результат."""
+        path = path or cls.SETTINGS_FILE
+        if not path.exists():
             return cls()
         try:
-            with open(cls.SETTINGS_FILE, "r", encoding="utf-8") as f:
+            with open(path, "r", encoding="utf-8") as f:
                 data = json.load(f)
                 # Восстанавливаем вложенный объект FormatProfile
                 profile_data = data.pop("default_profile", {})
+                rules = data.pop("hot_folders", [])
                 settings = cls(**data)
                 settings.default_profile = FormatProfile(**profile_data)
+                settings.hot_folders = [HotFolderRule.from_dict(rule) for rule in rules]
                 return settings
         except Exception as e:
             print(f"[ERROR] Не удалось загрузить настройки: {e}")
             return cls()
 
-    def save(self) -> None:
+    def save(self, path: Optional[Path] = None) -> bool:
+        """
+        Пишет во временный файл и подменяет им settings.json: читатель никогда
+        не увидит наполовину записанный JSON. Возвращает False при ошибке.
+        """
+        path = path or self.SETTINGS_FILE
+        tmp_file = path.with_name(path.name + ".tmp")
         try:
-            with open(self.SETTINGS_FILE, "w", encoding="utf-8") as f:
+            with open(tmp_file, "w", encoding="utf-8") as f:
                 json.dump(asdict(self), f, indent=4, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            tmp_file.replace(path)
+            return True
         except Exception as e:
-            print(f"[ERROR] Не удалось сохранить настройки: {e}")
\ No newline at end of file
+            print(f"[ERROR] Не удалось сохранить настройки: {e}")
+            return False
\ No newline at end of file
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict
+from pathlib import Path
+
+from .converter import normalize_codec, parse_bitrate
+from .models import FormatProfile
+
+SAMPLE_SIZE = 1024 * 1024  # размер одного читаемого фрагмента
+SAMPLE_COUNT = 16  # сколько фрагментов читаем из большого файла
+
+
+def fast_hash(path: Path, sample_size: int = SAMPLE_SIZE, samples: int = SAMPLE_COUNT) -> str:
+    """
+    Быстрый хэш содержимого: размер файла плюс равномерно распределенные фрагменты
+    (первый — начало файла, последний — его конец). Многогигабайтный файл не читается целиком,
+    а небольшие файлы хэшируются полностью.
+    """
+    size = path.stat().st_size
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(str(size).encode())
+    with open(path, "rb") as f:
+        if size <= sample_size * samples:
+            for chunk in iter(lambda: f.read(sample_size), b""):
+                digest.update(chunk)
+        else:
+            step = (size - sample_size) / (samples - 1)
+            for i in range(samples):
+                f.seek(int(i * step))
+                digest.update(f.read(sample_size))
+    return digest.hexdigest()
+
+
+def profile_key(profile: FormatProfile) -> str:
+    """
+    Нормализованное представление профиля: "MP4" и "mp4", "2M" и "2000k", "x264" и "h264"
+    дают один и тот же ключ. Число потоков на результат не влияет и в ключ не входит,
+    как и обложка с миниатюрами: они строятся отдельно и при попадании в кэш.
+    """
+    data = asdict(profile)
+    for name in ("threads", "poster", "preview_interval", "preview_width", "preview_tile"):
+        data.pop(name, None)
+    data["format"] = profile.format.lower().lstrip(".")
+    data["video_codec"] = normalize_codec(profile.video_codec)
+    data["audio_codec"] = normalize_codec(profile.audio_codec)
+    data["resolution"] = (profile.resolution or "").lower()
+    data["bitrate"] = parse_bitrate(profile.bitrate) or profile.bitrate
+    data["preset"] = (profile.preset or "").lower()
+    return json.dumps(data, sort_keys=True)
+
+
+class OutputCache:
+    """
+    Кэш готовых результатов по содержимому исходника.
+    Ключ — быстрый хэш исходника + нормализованный профиль, поэтому тот же ролик под другим
+    именем не кодируется повторно: результат берется из кэша копией. Жесткие ссылки не годятся:
+    ffmpeg -y перезаписывает выход на месте и испортил бы общий с кэшем inode.
+    При превышении max_bytes вытесняются давно не использованные записи.
+    """
+
+    INDEX_FILE = "index.json"
+
+    def __init__(self, cache_dir: Path, max_bytes: int = 20 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()  # от давно использованных к недавним
+        self._lock = threading.Lock()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(entry["size"] for entry in self._entries.values())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def key_for(self, source: Path, profile: FormatProfile) -> str:
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(fast_hash(source).encode())
+        digest.update(profile_key(profile).encode())
+        return digest.hexdigest()
+
+    def fetch(self, key: str, destination: Path) -> bool:
+        """Кладет закэшированный результат в destination. False — в кэше нет."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            cached = self.cache_dir / entry["file"]
+            if not cached.exists():
+                del self._entries[key]  # файл удалили вручную — забываем запись
+                self._save()
+                return False
+            self._entries.move_to_end(key)
+            entry["used"] = time.time()
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        _copy(cached, destination)
+        with self._lock:
+            self._save()
+        return True
+
+    def store(self, key: str, output: Path) -> None:
+        """Запоминает готовый результат. Ошибки кэша не должны ронять задачу, поэтому только пишем в лог."""
+        name = f"{key[:2]}/{key}{output.suffix}"
+        try:
+            size = output.stat().st_size
+            if size > self.max_bytes:
+                return
+            _copy(output, self.cache_dir / name)
+        except OSError as e:
+            print(f"[WARN] Не удалось сохранить результат в кэш: {e}")
+            return
+        with self._lock:
+            self._entries[key] = {"file": name, "size": size, "used": time.time()}
+            self._entries.move_to_end(key)
+            self._evict()
+            self._save()
+
+    def _evict(self) -> None:
+        total = self.total_bytes
+        while total > self.max_bytes and self._entries:
+            _, entry = self._entries.popitem(last=False)
+            total -= entry["size"]
+            try:
+                (self.cache_dir / entry["file"]).unlink()
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"[WARN] Не удалось удалить файл кэша {entry['file']}: {e}")
+
+    def _load(self) -> None:
+        index = self.cache_dir / self.INDEX_FILE
+        if not index.exists():
+            return
+        try:
+            with open(index, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for key, entry in sorted(data.items(), key=lambda item: item[1]["used"]):
+                self._entries[key] = entry
+            self._evict()  # лимит могли уменьшить в настройках
+        except Exception as e:
+            print(f"[WARN] Не удалось загрузить индекс кэша результатов: {e}")
+
+    def _save(self) -> None:
+        try:
+            tmp_file = self.cache_dir / (self.INDEX_FILE + ".tmp")
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(self._entries, f, ensure_ascii=False)
+            tmp_file.replace(self.cache_dir / self.INDEX_FILE)
+        except Exception as e:
+            print(f"[WARN] Не удалось сохранить индекс кэша результатов: {e}")
+
+
+def _copy(source: Path, destination: Path) -> None:
+    """
+    Копия с атомарной заменой: у кэша и у выхода всегда разные inode.
+    shutil на Linux копирует средствами ядра (copy_file_range/sendfile), без чтения в Python.
+    """
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = destination.with_name(destination.name + ".part")
+    if tmp_file.exists():
+        tmp_file.unlink()
+    shutil.copy2(source, tmp_file)
+    tmp_file.replace(destination)
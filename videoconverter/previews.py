@@ -0,0 +1,167 @@
+import math
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from .converter import ConversionError, run_ffmpeg
+from .models import FormatProfile
+from .probe import MediaInfo
+
+# Ветка фильтров без входной метки и параметры ее выхода (вместе с именем файла)
+Branch = Tuple[str, List[str]]
+
+POSTER_POSITION = 0.1  # кадр-обложка берется на 10% длительности: в первых кадрах часто заставка
+JPEG_QUALITY = "4"  # -q:v для mjpeg: 2 — лучшее качество, 31 — худшее
+
+
+def _size(resolution: Optional[str]) -> Optional[Tuple[int, int]]:
+    try:
+        width, height = (resolution or "").lower().split("x")
+        return int(width), int(height)
+    except ValueError:
+        return None
+
+
+@dataclass
+class PreviewPlan:
+    """Что и куда выводить для одной задачи: обложку, листы миниатюр и индекс WebVTT к ним."""
+    output_dir: Path
+    stem: str
+    poster: bool
+    poster_resolution: Optional[str]
+    interval: int  # секунд между миниатюрами (0 — без листов)
+    width: int
+    height: int
+    columns: int
+    rows: int
+    duration: float  # 0 — длительность неизвестна, индекс не пишется
+
+    @property
+    def poster_file(self) -> Path:
+        return self.output_dir / f"{self.stem}_poster.jpg"
+
+    @property
+    def sprite_pattern(self) -> Path:
+        return self.output_dir / f"{self.stem}_sprite_%03d.jpg"
+
+    def sprite_file(self, index: int) -> Path:
+        return self.output_dir / f"{self.stem}_sprite_{index + 1:03d}.jpg"
+
+    @property
+    def vtt_file(self) -> Path:
+        return self.output_dir / f"{self.stem}_sprite.vtt"
+
+    @property
+    def poster_time(self) -> float:
+        return round(self.duration * POSTER_POSITION, 3)
+
+    @property
+    def cue_count(self) -> int:
+        return math.ceil(self.duration / self.interval) if self.interval and self.duration else 0
+
+    @property
+    def files(self) -> List[Path]:
+        """Файлы, которые должны появиться после прохода (кроме листов при неизвестной длительности)."""
+        files = [self.poster_file] if self.poster else []
+        if self.cue_count:
+            per_sheet = self.columns * self.rows
+            files.extend(self.sprite_file(i) for i in range(math.ceil(self.cue_count / per_sheet)))
+            files.append(self.vtt_file)
+        return files
+
+
+def preview_plan(profile: FormatProfile, output_dir: Path, stem: str,
+                 info: Optional[MediaInfo] = None) -> Optional[PreviewPlan]:
+    """План превью по профилю; None — профиль превью не заказывает."""
+    if not profile.poster and not profile.preview_interval:
+        return None
+    try:
+        columns, rows = (int(n) for n in profile.preview_tile.lower().split("x"))
+    except ValueError:
+        raise ConversionError(f"Неверная сетка листа миниатюр: {profile.preview_tile} (ожидается вид 10x10)")
+    # Высоту миниатюры считаем сами: координаты в индексе WebVTT должны совпасть с листом точно
+    source = _size(info.resolution if info else None) or _size(profile.resolution) or (16, 9)
+    height = max(2, round(profile.preview_width * source[1] / source[0] / 2) * 2)
+    return PreviewPlan(
+        output_dir=output_dir,
+        stem=stem,
+        poster=profile.poster,
+        poster_resolution=profile.resolution or None,
+        interval=max(0, profile.preview_interval),
+        width=profile.preview_width,
+        height=height,
+        columns=max(1, columns),
+        rows=max(1, rows),
+        duration=info.duration if info else 0.0,
+    )
+
+
+def preview_branches(plan: PreviewPlan) -> List[Branch]:
+    """
+    Ветки для filter_complex основного прохода: кадры берутся из уже декодированного потока,
+    поэтому превью не требуют второго декодирования файла.
+    """
+    branches: List[Branch] = []
+    if plan.poster:
+        chain = f"trim=start={plan.poster_time}"
+        if plan.poster_resolution:
+            chain += ",scale=" + plan.poster_resolution.lower().replace("x", ":")
+        branches.append((chain, ["-an", "-frames:v", "1", "-c:v", "mjpeg", "-q:v", JPEG_QUALITY,
+                                 "-update", "1", str(plan.poster_file)]))
+    if plan.interval:
+        chain = f"fps=1/{plan.interval},scale={plan.width}:{plan.height},tile={plan.columns}x{plan.rows}"
+        branches.append((chain, ["-an", "-c:v", "mjpeg", "-q:v", JPEG_QUALITY, "-f", "image2",
+                                 str(plan.sprite_pattern)]))
+    return branches
+
+
+def build_preview_command(input_file: Path, plan: PreviewPlan) -> List[str]:
+    """
+    Отдельный проход только для превью (когда основной результат получен без нашего декодирования:
+    из кэша или сегментами). Декодируются лишь опорные кадры, а не весь поток.
+    """
+    branches = preview_branches(plan)
+    labels = "".join(f"[p{i}]" for i in range(len(branches)))
+    chains = [f"[0:v:0]split={len(branches)}{labels}"]
+    chains.extend(f"[p{i}]{chain}[pv{i}]" for i, (chain, _) in enumerate(branches))
+    cmd = ["ffmpeg", "-y", "-skip_frame", "nokey", "-i", str(input_file), "-filter_complex", ";".join(chains)]
+    for i, (_, args) in enumerate(branches):
+        cmd.extend(["-map", f"[pv{i}]", *args])
+    return cmd
+
+
+def generate_previews(input_file: Path, plan: PreviewPlan, stop_event: Optional[threading.Event] = None) -> None:
+    run_ffmpeg(build_preview_command(input_file, plan), plan.duration, stop_event=stop_event)
+    write_sprite_vtt(plan)
+
+
+def _timestamp(seconds: float) -> str:
+    millis = int(round(seconds * 1000))
+    hours, millis = divmod(millis, 3_600_000)
+    minutes, millis = divmod(millis, 60_000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}.{millis:03d}"
+
+
+def write_sprite_vtt(plan: PreviewPlan) -> Optional[Path]:
+    """
+    Индекс WebVTT для плееров: каждому отрезку времени — кусок листа (#xywh=...).
+    Пишется по плану, без чтения картинок.
+    """
+    if not plan.cue_count:
+        return None
+    per_sheet = plan.columns * plan.rows
+    lines = ["WEBVTT", ""]
+    for i in range(plan.cue_count):
+        start = i * plan.interval
+        end = min((i + 1) * plan.interval, plan.duration)
+        x = (i % plan.columns) * plan.width
+        y = (i % per_sheet) // plan.columns * plan.height
+        lines.append(f"{_timestamp(start)} --> {_timestamp(end)}")
+        lines.append(f"{plan.sprite_file(i // per_sheet).name}#xywh={x},{y},{plan.width},{plan.height}")
+        lines.append("")
+    tmp_file = plan.vtt_file.with_name(plan.vtt_file.name + ".tmp")
+    tmp_file.write_text("\n".join(lines), encoding="utf-8")
+    tmp_file.replace(plan.vtt_file)
+    return plan.vtt_file
@@ -0,0 +1,254 @@
+import atexit
+import json
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+
+class ProbeError(Exception):
+    pass
+
+
+@dataclass
+class StreamInfo:
+    index: int
+    codec_type: str  # video / audio / subtitle / data
+    codec_name: str = ""
+    width: Optional[int] = None
+    height: Optional[int] = None
+    fps: Optional[float] = None
+    bit_rate: Optional[int] = None
+    channels: Optional[int] = None
+    sample_rate: Optional[int] = None
+
+
+@dataclass
+class MediaInfo:
+    """Метаданные файла, полученные из ffprobe."""
+    duration: float = 0.0  # 0 — длительность неизвестна
+    format_name: str = ""
+    bit_rate: Optional[int] = None
+    size: int = 0
+    streams: List[StreamInfo] = field(default_factory=list)
+
+    @property
+    def video_stream(self) -> Optional[StreamInfo]:
+        return next((s for s in self.streams if s.codec_type == "video"), None)
+
+    @property
+    def audio_streams(self) -> List[StreamInfo]:
+        return [s for s in self.streams if s.codec_type == "audio"]
+
+    @property
+    def video_codec(self) -> Optional[str]:
+        stream = self.video_stream
+        return stream.codec_name if stream else None
+
+    @property
+    def audio_codec(self) -> Optional[str]:
+        streams = self.audio_streams
+        return streams[0].codec_name if streams else None
+
+    @property
+    def resolution(self) -> Optional[str]:
+        stream = self.video_stream
+        if stream and stream.width and stream.height:
+            return f"{stream.width}x{stream.height}"
+        return None
+
+    @property
+    def fps(self) -> Optional[float]:
+        stream = self.video_stream
+        return stream.fps if stream else None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "MediaInfo":
+        streams = [StreamInfo(**s) for s in data.get("streams", [])]
+        return cls(**{**data, "streams": streams})
+
+
+def _to_int(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_rate(value: Optional[str]) -> Optional[float]:
+    # ffprobe отдает частоту кадров дробью, например "30000/1001"
+    if not value:
+        return None
+    try:
+        num, _, den = value.partition("/")
+        rate = float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return None
+    return round(rate, 3) if rate > 0 else None
+
+
+def parse_ffprobe_output(data: dict) -> MediaInfo:
+    fmt = data.get("format", {})
+    streams = []
+    for raw in data.get("streams", []):
+        streams.append(StreamInfo(
+            index=int(raw.get("index", len(streams))),
+            codec_type=raw.get("codec_type", ""),
+            codec_name=raw.get("codec_name", ""),
+            width=_to_int(raw.get("width")),
+            height=_to_int(raw.get("height")),
+            fps=_parse_rate(raw.get("avg_frame_rate")) or _parse_rate(raw.get("r_frame_rate")),
+            bit_rate=_to_int(raw.get("bit_rate")),
+            channels=_to_int(raw.get("channels")),
+            sample_rate=_to_int(raw.get("sample_rate")),
+        ))
+
+    try:
+        duration = float(fmt.get("duration", 0) or 0)
+    except ValueError:
+        duration = 0.0
+    if duration <= 0:
+        # У некоторых контейнеров длительность есть только у потоков
+        durations = [float(s["duration"]) for s in data.get("streams", []) if s.get("duration")]
+        duration = max(durations, default=0.0)
+
+    return MediaInfo(
+        duration=duration,
+        format_name=fmt.get("format_name", ""),
+        bit_rate=_to_int(fmt.get("bit_rate")),
+        size=_to_int(fmt.get("size")) or 0,
+        streams=streams,
+    )
+
+
+def run_ffprobe(input_file: Path) -> MediaInfo:
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-print_format", "json",
+        "-show_format", "-show_streams",
+        str(input_file),
+    ]
+    creationflags = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+    try:
+        result = subprocess.run(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            text=True, encoding='utf-8', errors='replace', creationflags=creationflags
+        )
+    except OSError as exc:
+        raise ProbeError(f"Не удалось запустить ffprobe: {exc}") from exc
+
+    if result.returncode != 0:
+        raise ProbeError(f"ffprobe не смог прочитать {input_file}: {result.stderr.strip()}")
+    try:
+        return parse_ffprobe_output(json.loads(result.stdout or "{}"))
+    except (json.JSONDecodeError, TypeError, KeyError) as exc:
+        raise ProbeError(f"Некорректный ответ ffprobe для {input_file}: {exc}") from exc
+
+
+class ProbeCache:
+    """
+    Постоянный LRU-кэш результатов ffprobe.
+    Ключ — (путь, размер, mtime): измененный файл будет прочитан заново.
+    """
+
+    CACHE_FILE = Path("probe_cache.json")
+    SAVE_INTERVAL = 5.0  # не пишем файл кэша чаще, чем раз в несколько секунд
+
+    def __init__(self, cache_file: Optional[Path] = None, max_entries: int = 10000):
+        self.cache_file = cache_file if cache_file is not None else self.CACHE_FILE
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_save = 0.0
+        self._load()
+
+    @staticmethod
+    def _key(path: Path) -> Tuple[str, str]:
+        stat = path.stat()
+        return str(path.resolve()), f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    def _load(self) -> None:
+        if not self.cache_file.exists():
+            return
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for path, entry in data.items():
+                self._entries[path] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        except Exception as e:
+            print(f"[WARN] Не удалось загрузить кэш метаданных: {e}")
+
+    def get(self, path: Path) -> MediaInfo:
+        path_key, stamp = self._key(path)
+        with self._lock:
+            entry = self._entries.get(path_key)
+            if entry and entry.get("stamp") == stamp:
+                self._entries.move_to_end(path_key)
+                return MediaInfo.from_dict(entry["info"])
+
+        info = run_ffprobe(path)
+        with self._lock:
+            self._entries[path_key] = {"stamp": stamp, "info": info.to_dict()}
+            self._entries.move_to_end(path_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+        self._maybe_save()
+        return info
+
+    def invalidate(self, path: Path) -> None:
+        with self._lock:
+            if self._entries.pop(str(path.resolve()), None) is not None:
+                self._dirty = True
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _maybe_save(self) -> None:
+        if time.monotonic() - self._last_save >= self.SAVE_INTERVAL:
+            self.save()
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            snapshot = dict(self._entries)
+            self._dirty = False
+            self._last_save = time.monotonic()
+        try:
+            tmp_file = self.cache_file.with_suffix(".tmp")
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            tmp_file.replace(self.cache_file)
+        except Exception as e:
+            print(f"[WARN] Не удалось сохранить кэш метаданных: {e}")
+
+
+_default_cache: Optional[ProbeCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_probe_cache() -> ProbeCache:
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ProbeCache()
+            atexit.register(_default_cache.save)
+        return _default_cache
+
+
+def probe_media(input_file: Path, use_cache: bool = True, cache: Optional[ProbeCache] = None) -> MediaInfo:
+    """Возвращает метаданные файла (из кэша, если файл не менялся). cache=None — общий кэш процесса."""
+    if use_cache:
+        return (cache or get_probe_cache()).get(input_file)
+    return run_ffprobe(input_file)
@@ -0,0 +1,72 @@
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, Optional
+
+STDERR_TAIL_LINES = 40  # сколько последних строк stderr храним для сообщения об ошибке
+
+
+@dataclass
+class ProgressInfo:
+    """Один блок машиночитаемого вывода ffmpeg -progress."""
+    frame: int = 0
+    fps: float = 0.0
+    bitrate_kbps: Optional[float] = None
+    total_size: Optional[int] = None
+    out_time: float = 0.0  # секунды уже закодированного выхода
+    speed: Optional[float] = None  # во сколько раз быстрее реального времени
+    finished: bool = False  # ffmpeg прислал progress=end
+
+
+def _float(value: str) -> Optional[float]:
+    try:
+        return float(value.rstrip("xkbits/s "))
+    except ValueError:
+        return None
+
+
+def _int(value: str) -> Optional[int]:
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+class ProgressParser:
+    """
+    Собирает строки key=value из -progress в ProgressInfo.
+    Блок заканчивается строкой progress=continue|end — тогда feed() возвращает результат.
+    """
+
+    def __init__(self):
+        self._current: Dict[str, str] = {}
+
+    def feed(self, line: str) -> Optional[ProgressInfo]:
+        key, sep, value = line.strip().partition("=")
+        if not sep:
+            return None
+        key, value = key.strip(), value.strip()
+        if key != "progress":
+            self._current[key] = value
+            return None
+
+        block, self._current = self._current, {}
+        out_time = None
+        # out_time_us появился в новых версиях; out_time_ms исторически тоже в микросекундах
+        for time_key in ("out_time_us", "out_time_ms"):
+            raw = _int(block.get(time_key, ""))
+            if raw is not None and raw >= 0:
+                out_time = raw / 1_000_000
+                break
+        return ProgressInfo(
+            frame=_int(block.get("frame", "")) or 0,
+            fps=_float(block.get("fps", "")) or 0.0,
+            bitrate_kbps=_float(block.get("bitrate", "")),
+            total_size=_int(block.get("total_size", "")),
+            out_time=out_time or 0.0,
+            speed=_float(block.get("speed", "")),
+            finished=value == "end",
+        )
+
+
+def new_stderr_tail() -> Deque[str]:
+    return deque(maxlen=STDERR_TAIL_LINES)
@@ -0,0 +1,190 @@
+import struct
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, List, Tuple
+
+from .probe import ProbeError, probe_media
+
+# Как проверять, что файл дописан: none — только по тишине, container — по структуре
+# контейнера (mp4/mov/avi), ffprobe — файл должен читаться и иметь длительность
+READY_CHECKS = ("none", "container", "ffprobe")
+
+REJECT_BACKOFF = 30.0  # секунд до повторной проверки неполного файла, если он не менялся
+
+_ATOM = struct.Struct(">I4s")  # размер и тип атома MP4
+_LARGE_SIZE = struct.Struct(">Q")
+_RIFF = struct.Struct("<4sI")  # идентификатор и размер блока RIFF
+
+
+def _mp4_complete(f: BinaryIO, size: int) -> bool:
+    """Атомы верхнего уровня должны ровно покрыть файл, и среди них должен быть moov."""
+    offset, has_moov = 0, False
+    while offset < size:
+        f.seek(offset)
+        header = f.read(_ATOM.size)
+        if len(header) < _ATOM.size:
+            return False
+        atom_size, kind = _ATOM.unpack(header)
+        if kind == b"moov":
+            has_moov = True
+        if atom_size == 1:
+            large = f.read(_LARGE_SIZE.size)
+            if len(large) < _LARGE_SIZE.size:
+                return False
+            atom_size = _LARGE_SIZE.unpack(large)[0]
+        elif atom_size == 0:
+            return has_moov  # атом до конца файла — допустим только последним
+        if atom_size < _ATOM.size:
+            return False
+        offset += atom_size
+    return offset == size and has_moov
+
+
+def _avi_complete(f: BinaryIO, size: int) -> bool:
+    """Блоки RIFF (у больших файлов OpenDML их несколько) должны ровно покрыть файл."""
+    offset = 0
+    while offset < size:
+        f.seek(offset)
+        header = f.read(_RIFF.size)
+        if len(header) < _RIFF.size or header[:4] != b"RIFF":
+            return False
+        offset += _RIFF.size + _RIFF.unpack(header)[1]
+        offset += offset % 2  # блоки выравниваются по слову
+    return offset == size
+
+
+_CONTAINER_CHECKS: Dict[str, Callable[[BinaryIO, int], bool]] = {
+    ".mp4": _mp4_complete,
+    ".m4v": _mp4_complete,
+    ".mov": _mp4_complete,
+    ".avi": _avi_complete,
+}
+
+
+def container_complete(path: Path) -> bool:
+    """
+    Проверяет по заголовкам, что контейнер дописан: в mp4/mov moov пишется последним
+    (или атомы уже покрывают весь файл), у avi размер в RIFF совпадает с файлом.
+    Для остальных форматов структуру не проверяем — остается только тишина.
+    """
+    check = _CONTAINER_CHECKS.get(path.suffix.lower())
+    if check is None:
+        return True
+    try:
+        with open(path, "rb") as f:
+            return check(f, path.stat().st_size)
+    except OSError:
+        return False
+
+
+def probe_complete(path: Path) -> bool:
+    try:
+        return probe_media(path).duration > 0
+    except (ProbeError, OSError):
+        return False
+
+
+@dataclass
+class _Pending:
+    stamp: Tuple[int, int]  # размер и mtime_ns
+    since: float  # с какого момента файл не меняется
+    due: float  # когда проверить снова
+    rejected: bool = False
+
+
+class ReadinessTracker:
+    """
+    Решает, дописан ли файл, без пауз на каждый файл.
+    Файл готов, когда его размер и mtime не менялись quiet_seconds (между проверками, а не в sleep)
+    или система подтвердила закрытие после записи, и проверка контейнера прошла.
+    Ожидающие файлы остаются в трекере; due() отдает те, которые пора проверить снова.
+    Потокобезопасен: проверки разных файлов можно вести параллельно.
+    """
+
+    def __init__(self, quiet_seconds: float = 2.0, check: str = "container",
+                 clock: Callable[[], float] = time.monotonic):
+        if check not in READY_CHECKS:
+            raise ValueError(f"Неизвестная проверка готовности: {check}. Допустимые: {', '.join(READY_CHECKS)}")
+        self.quiet_seconds = quiet_seconds
+        self.check_mode = check
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._pending: Dict[Path, _Pending] = {}
+        self._rejected_mode = ""  # о неверном значении из настроек предупреждаем один раз
+
+    def configure(self, quiet_seconds: float, check: str) -> None:
+        """Применяет настройки горячей папки; неизвестный способ проверки заменяется на container."""
+        if check not in READY_CHECKS:
+            if check != self._rejected_mode:
+                print(f"[WARN] Неизвестная проверка готовности: {check}, используем container")
+                self._rejected_mode = check
+            check = "container"
+        self.quiet_seconds = max(0.0, quiet_seconds)
+        self.check_mode = check
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def check(self, path: Path, confirmed: bool = False) -> bool:
+        """True — файл можно брать в работу. confirmed — пришло close-write или перемещение в папку."""
+        try:
+            st = path.stat()
+        except OSError:
+            self.forget(path)
+            return False
+        stamp = (st.st_size, st.st_mtime_ns)
+        now = self._clock()
+        with self._lock:
+            entry = self._pending.get(path)
+            if entry is None or entry.stamp != stamp:
+                entry = self._pending[path] = _Pending(stamp, since=now, due=now + self.quiet_seconds)
+            if st.st_size == 0:
+                return False
+            if not confirmed and now - entry.since < self.quiet_seconds:
+                return False
+            if entry.rejected and not confirmed and now < entry.due:
+                return False
+
+        if not self._verify(path):
+            with self._lock:
+                if not entry.rejected:
+                    print(f"[WARN] Файл выглядит недописанным, ждем: {path.name}")
+                entry.rejected = True
+                entry.due = now + REJECT_BACKOFF
+            return False
+
+        with self._lock:
+            if self._pending.get(path) is entry:
+                del self._pending[path]
+        return True
+
+    def _verify(self, path: Path) -> bool:
+        if self.check_mode == "container":
+            return container_complete(path)
+        if self.check_mode == "ffprobe":
+            return probe_complete(path)
+        return True
+
+    def due(self) -> List[Path]:
+        """Ожидающие файлы, которые пора проверить снова (их следующий срок сдвигается сразу)."""
+        now = self._clock()
+        with self._lock:
+            paths = [path for path, entry in self._pending.items() if entry.due <= now]
+            for path in paths:
+                entry = self._pending[path]
+                entry.due = now + (REJECT_BACKOFF if entry.rejected else self.quiet_seconds)
+            return paths
+
+    def next_due(self, default: float) -> float:
+        """Сколько секунд можно ждать событий, не пропустив срок проверки."""
+        with self._lock:
+            if not self._pending:
+                return default
+            soonest = min(entry.due for entry in self._pending.values())
+        return max(0.0, min(default, soonest - self._clock()))
+
+    def forget(self, path: Path) -> None:
+        with self._lock:
+            self._pending.pop(path, None)
@@ -0,0 +1,208 @@
+import os
+import threading
+import time
+from dataclasses import dataclass
+from enum import Enum
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from uuid import UUID
+
+import psutil
+
+from .converter import normalize_codec, parse_bitrate
+from .models import Job
+from .probe import MediaInfo, ProbeError, probe_media
+
+MB = 1024 * 1024
+
+# Относительная "тяжесть" энкодеров: во сколько раз больше CPU и памяти, чем x264
+CODEC_COST = {
+    "h264": 1.0,
+    "hevc": 2.5,
+    "vp9": 2.0,
+    "av1": 3.0,
+    "mpeg4": 0.5,
+    "copy": 0.05,
+}
+DEFAULT_AUDIO_BITRATE = 192_000
+
+
+class Admission(Enum):
+    START = "start"  # ресурсов хватает — запускаем
+    WAIT = "wait"  # подождать, пока освободятся ресурсы
+    REJECT = "reject"  # задача не поместится никогда (например, не хватает диска)
+
+
+@dataclass
+class ResourceBudget:
+    max_cpu_percent: float = 90.0  # выше этой загрузки новые задачи не стартуют
+    min_free_memory_mb: int = 1024  # сколько памяти оставить системе после запуска задачи
+    max_iowait_percent: float = 25.0  # диск и так не успевает — новые задачи только помешают
+    disk_reserve_mb: int = 1024  # запас свободного места сверх оценки размера выхода
+    warmup_seconds: float = 10.0  # столько времени новая задача "разгоняется" и еще не видна в замерах
+
+
+@dataclass
+class JobCost:
+    cpu_percent: float  # доля всей машины, которую займет задача
+    memory_bytes: int
+    output_bytes: int
+
+
+@dataclass
+class ResourceSnapshot:
+    cpu_percent: float
+    iowait_percent: float
+    available_memory: int
+
+
+class ResourceMonitor:
+    """Замеры загрузки системы через psutil (с кэшированием, чтобы не дергать систему слишком часто)."""
+
+    def __init__(self, sample_interval: float = 1.0):
+        self.sample_interval = sample_interval
+        self._last: Optional[ResourceSnapshot] = None
+        self._last_time = 0.0
+        self._lock = threading.Lock()
+        psutil.cpu_times_percent(interval=None)  # первый вызов только запоминает точку отсчета
+
+    def snapshot(self) -> ResourceSnapshot:
+        with self._lock:
+            now = time.monotonic()
+            if self._last is None or now - self._last_time >= self.sample_interval:
+                times = psutil.cpu_times_percent(interval=None)
+                busy = 100.0 - times.idle - getattr(times, "iowait", 0.0)
+                self._last = ResourceSnapshot(
+                    cpu_percent=max(0.0, busy),
+                    iowait_percent=getattr(times, "iowait", 0.0),  # есть только в Linux
+                    available_memory=psutil.virtual_memory().available,
+                )
+                self._last_time = now
+            return self._last
+
+    def disk_free(self, path: Path) -> int:
+        return psutil.disk_usage(str(_existing_parent(path))).free
+
+
+def _existing_parent(path: Path) -> Path:
+    # Папки вывода может еще не быть — берем ближайшего существующего родителя
+    for candidate in (path, *path.parents):
+        if candidate.exists():
+            return candidate
+    return Path(os.getcwd())
+
+
+def filesystem_id(path: Path) -> int:
+    """Устройство файловой системы папки: разные папки одного диска делят одно свободное место."""
+    try:
+        return _existing_parent(path).stat().st_dev
+    except OSError:
+        return -1
+
+
+def _pixels(resolution: Optional[str]) -> int:
+    try:
+        width, height = (resolution or "").lower().split("x")
+        return int(width) * int(height)
+    except ValueError:
+        return 1920 * 1080
+
+
+def estimate_job_cost(job: Job, info: Optional[MediaInfo] = None, cpu_count: Optional[int] = None) -> JobCost:
+    """
+    Грубая оценка стоимости задачи по разрешению, кодеку и длительности.
+    Нужна не точность, а порядок величины: чтобы 4K HEVC не стартовал на занятой машине,
+    а на диске хватило места под весь выходной файл.
+    """
+    cpus = cpu_count or os.cpu_count() or 1
+    remux = job.conversion_path is not None and job.conversion_path.name == "REMUX"
+    duration = info.duration if info else 0.0
+    # Многовыходная задача — несколько энкодеров в одном процессе: их стоимость складывается
+    profiles = [r.profile for r in job.renditions] or [job.profile]
+    threads_total = 0.0
+    memory = 80 * MB  # база ffmpeg (декодер общий для всех выходов)
+    output = 0
+    for profile in profiles:
+        codec = "copy" if remux else normalize_codec(profile.video_codec)
+        factor = CODEC_COST.get(codec, 1.0)
+        megapixels = _pixels(profile.resolution) / 1_000_000
+
+        # Потоки: явный бюджет профиля или сколько энкодер реально загрузит (~4 потока на мегапиксель x264)
+        threads_total += profile.threads or min(cpus, max(1.0, megapixels * 4 * factor))
+
+        # Память: буферы кадров (lookahead/референсы) пропорционально площади кадра
+        memory += int(megapixels * 150 * factor * MB)
+
+        if codec == "copy" and info and info.size:
+            output += info.size
+        else:
+            video_bits = parse_bitrate(profile.bitrate) or (info.bit_rate if info and info.bit_rate else 4_000_000)
+            output += int(duration * (video_bits + DEFAULT_AUDIO_BITRATE) / 8)
+    if not output and info:
+        output = info.size * len(profiles)  # длительность неизвестна — ориентируемся на размер исходника
+    cpu_percent = min(100.0, threads_total / cpus * 100.0)
+    return JobCost(cpu_percent=cpu_percent, memory_bytes=memory, output_bytes=int(output * 1.1))
+
+
+class ResourceScheduler:
+    """
+    Решает, можно ли прямо сейчас запустить следующую задачу.
+    Замеры psutil отстают от реальности на время разгона задачи, поэтому стоимость
+    недавно запущенных задач добавляется к замерам, пока не истечет warmup.
+    Место на диске резервируется на все время кодирования.
+    """
+
+    def __init__(self, budget: Optional[ResourceBudget] = None, monitor: Optional[ResourceMonitor] = None):
+        self.budget = budget or ResourceBudget()
+        self.monitor = monitor or ResourceMonitor()
+        self._lock = threading.Lock()
+        self._reservations: Dict[UUID, Tuple[float, JobCost, int]] = {}  # старт, стоимость, устройство вывода
+
+    def estimate(self, job: Job) -> JobCost:
+        try:
+            info = probe_media(job.source_path)
+        except (ProbeError, OSError):
+            info = None
+        return estimate_job_cost(job, info)
+
+    def admit(self, job: Job, running: int) -> Tuple[Admission, str]:
+        cost = self.estimate(job)
+        budget = self.budget
+        with self._lock:
+            now = time.monotonic()
+            warming = [c for started, c, _ in self._reservations.values() if now - started < budget.warmup_seconds]
+            device = filesystem_id(job.output_dir)
+            disk_reserved = sum(c.output_bytes for _, c, reserved in self._reservations.values()
+                                if reserved == device)
+
+            free_disk = self.monitor.disk_free(job.output_dir) - disk_reserved
+            if cost.output_bytes + budget.disk_reserve_mb * MB > free_disk:
+                if running == 0:
+                    return Admission.REJECT, (f"Недостаточно места на диске: нужно ~{cost.output_bytes // MB} МБ, "
+                                              f"свободно {max(free_disk, 0) // MB} МБ")
+                return Admission.WAIT, "ожидание свободного места на диске"
+
+            # Хотя бы одна задача должна выполняться всегда, иначе очередь встанет
+            if running == 0:
+                self._reserve(job, cost, now, device)
+                return Admission.START, ""
+
+            snapshot = self.monitor.snapshot()
+            cpu = snapshot.cpu_percent + sum(c.cpu_percent for c in warming)
+            if cpu + cost.cpu_percent > budget.max_cpu_percent and cpu > 0:
+                return Admission.WAIT, f"процессор занят ({cpu:.0f}%)"
+            memory = snapshot.available_memory - sum(c.memory_bytes for c in warming)
+            if memory - cost.memory_bytes < budget.min_free_memory_mb * MB:
+                return Admission.WAIT, f"мало свободной памяти ({max(memory, 0) // MB} МБ)"
+            if snapshot.iowait_percent > budget.max_iowait_percent:
+                return Admission.WAIT, f"диск перегружен (iowait {snapshot.iowait_percent:.0f}%)"
+
+            self._reserve(job, cost, now, device)
+            return Admission.START, ""
+
+    def release(self, job: Job) -> None:
+        with self._lock:
+            self._reservations.pop(job.id, None)
+
+    def _reserve(self, job: Job, cost: JobCost, now: float, device: int) -> None:
+        self._reservations[job.id] = (now, cost, device)
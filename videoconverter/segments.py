@@ -0,0 +1,179 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from dataclasses import replace
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import psutil
+
+from . import converter
+from .converter import ConversionOptions, ConversionError
+from .probe import probe_media, ProbeError
+from .progress import ProgressInfo
+
+# Длина одного сегмента по умолчанию (секунды) и минимальная длина файла для нарезки
+DEFAULT_SEGMENT_SECONDS = 300
+MIN_SEGMENTED_DURATION = 2 * DEFAULT_SEGMENT_SECONDS
+
+# Промежуточный контейнер: mkv принимает практически любые кодеки без перекодирования
+SEGMENT_CONTAINER = "mkv"
+
+
+def build_split_command(input_file: Path, segment_dir: Path, segment_seconds: int) -> List[str]:
+    """Команда нарезки исходника на сегменты без перекодирования (разрез идет по ключевым кадрам)."""
+    return [
+        "ffmpeg", "-y", "-nostats", "-loglevel", "error",
+        "-i", str(input_file),
+        "-map", "0:v:0", "-map", "0:a?",
+        "-c", "copy",
+        "-f", "segment",
+        "-segment_time", str(segment_seconds),
+        "-reset_timestamps", "1",
+        str(segment_dir / f"seg_%05d.{SEGMENT_CONTAINER}"),
+    ]
+
+
+def build_concat_command(list_file: Path, output_file: Path) -> List[str]:
+    """Команда склейки закодированных сегментов через concat demuxer."""
+    return [
+        "ffmpeg", "-y", "-nostats", "-loglevel", "error",
+        "-f", "concat", "-safe", "0",
+        "-i", str(list_file),
+        "-c", "copy",
+        str(output_file),
+    ]
+
+
+def write_concat_list(parts: List[Path], list_file: Path) -> None:
+    # Формат списка concat demuxer: file '<путь>', кавычки внутри экранируются
+    lines = []
+    for part in parts:
+        escaped = str(part.resolve()).replace("'", "'\\''")
+        lines.append(f"file '{escaped}'")
+    list_file.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def _segment_duration(segment: Path, default: float) -> float:
+    # Временные сегменты не кладем в постоянный кэш метаданных
+    try:
+        return probe_media(segment, use_cache=False).duration or default
+    except ProbeError:
+        return default
+
+
+def convert_file_segmented(
+        input_file: Path,
+        options: ConversionOptions,
+        progress_callback: Optional[Callable[[int], None]] = None,
+        pause_event: Optional[threading.Event] = None,
+        stop_event: Optional[threading.Event] = None,
+        segment_seconds: int = DEFAULT_SEGMENT_SECONDS,
+        max_parallel: Optional[int] = None,
+        timeout: Optional[float] = None,
+        metrics_callback: Optional[Callable[[ProgressInfo], None]] = None,
+        process_callback: Optional[Callable[[psutil.Process], None]] = None,
+) -> None:
+    """
+    Конвертирует длинный файл по частям: нарезка по ключевым кадрам,
+    параллельное кодирование сегментов и склейка через concat demuxer.
+    Короткие файлы кодируются целиком обычным convert_file.
+    max_parallel — сколько сегментов кодировать одновременно (None — по числу ядер).
+    timeout — предел времени всей задачи в секундах: каждый шаг получает оставшееся время.
+    process_callback получает каждый процесс ffmpeg (нарезка, сегменты, склейка), чтобы его
+    можно было приостановить; metrics_callback — отчеты -progress всех сегментов.
+    """
+    if not input_file.exists():
+        raise ConversionError(f"Файл не найден: {input_file}")
+    deadline = time.monotonic() + timeout if timeout else None
+
+    def remaining() -> Optional[float]:
+        if deadline is None:
+            return None
+        left = deadline - time.monotonic()
+        if left <= 0:
+            raise ConversionError(f"Превышено время кодирования ({timeout:.0f} с)")
+        return left
+
+    total_duration = converter.get_video_duration(input_file)
+    if total_duration < max(MIN_SEGMENTED_DURATION, 2 * segment_seconds):
+        converter.convert_file(input_file, options, progress_callback, pause_event, stop_event, metrics_callback,
+                               process_callback, timeout=timeout)
+        return
+
+    output_file = options.output_dir / f"{input_file.stem}.{options.target_format.lstrip('.')}"
+    options.output_dir.mkdir(parents=True, exist_ok=True)
+    work_dir = Path(tempfile.mkdtemp(prefix=f".{input_file.stem}_segments_", dir=options.output_dir))
+    # Собственный флаг остановки: им гасим остальные сегменты, если один упал
+    local_stop = threading.Event()
+
+    try:
+        split_dir = work_dir / "src"
+        encoded_dir = work_dir / "enc"
+        split_dir.mkdir()
+        encoded_dir.mkdir()
+
+        print(f"[INFO] Нарезка на сегменты: {input_file}")
+        converter.run_ffmpeg(build_split_command(input_file, split_dir, segment_seconds), 0.0,
+                             pause_event=pause_event, stop_event=stop_event, process_callback=process_callback,
+                             timeout=remaining())
+        segments = sorted(split_dir.glob(f"seg_*.{SEGMENT_CONTAINER}"))
+        if not segments:
+            raise ConversionError("Не удалось нарезать файл на сегменты")
+
+        # Вес сегмента в общем прогрессе пропорционален его длительности
+        weights = [_segment_duration(seg, segment_seconds) for seg in segments]
+        total_weight = sum(weights) or 1.0
+        seg_progress: Dict[int, int] = {i: 0 for i in range(len(segments))}
+        progress_lock = threading.Lock()
+
+        def make_callback(index: int) -> Callable[[int], None]:
+            def on_progress(p: int) -> None:
+                with progress_lock:
+                    seg_progress[index] = p
+                    done = sum(weights[i] * seg_progress[i] for i in seg_progress) / total_weight
+                if progress_callback:
+                    progress_callback(min(int(done), 99))
+            return on_progress
+
+        segment_options = replace(options, output_dir=encoded_dir)
+
+        def encode(index: int) -> Path:
+            # Длительность сегмента уже известна: повторный ffprobe записал бы временный файл в probe_cache.json
+            converter.convert_file(segments[index], segment_options, make_callback(index),
+                                   pause_event=pause_event, stop_event=local_stop, metrics_callback=metrics_callback,
+                                   process_callback=process_callback, duration=weights[index], timeout=remaining())
+            return encoded_dir / f"{segments[index].stem}.{options.target_format.lstrip('.')}"
+
+        workers = max_parallel or max(1, (os.cpu_count() or 1) // (options.threads or 1))
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(segments)))) as pool:
+            futures = [pool.submit(encode, i) for i in range(len(segments))]
+            pending = set(futures)
+            while pending:
+                if stop_event and stop_event.is_set():
+                    local_stop.set()
+                finished, pending = wait(pending, timeout=0.2, return_when=FIRST_EXCEPTION)
+                if any(f.exception() for f in finished):
+                    local_stop.set()
+            if stop_event and stop_event.is_set():
+                raise ConversionError("STOPPED")
+            errors = [f.exception() for f in futures if f.exception()]
+            real_errors = [e for e in errors if str(e) != "STOPPED"]
+            if errors:
+                raise (real_errors or errors)[0]
+            parts = [f.result() for f in futures]
+
+        list_file = work_dir / "concat.txt"
+        write_concat_list(parts, list_file)
+        converter.run_ffmpeg(build_concat_command(list_file, output_file), 0.0,
+                             pause_event=pause_event, stop_event=stop_event, process_callback=process_callback,
+                             timeout=remaining())
+
+        if progress_callback:
+            progress_callback(100)
+        print(f"[OK] Готово: {output_file}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -1,177 +1,961 @@
+import asyncio
+import concurrent.futures
 import threading
 import time
 import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
 from pathlib import Path
-from typing import List, Optional, Set
+from typing import Callable, Dict, List, Optional, Set, Tuple
 from uuid import UUID
 
-from .models import Job, JobState, Settings
-from .converter import convert_file, ConversionOptions, ConversionError
+from .aio import AsyncConversion, AsyncEngine
+from .models import Job, JobState, Settings, ConversionPath, FormatProfile, HotFolderRule
+from .control import JobControl
+from .converter import convert_file, ConversionOptions, ConversionError, plan_stream_copy
+from .events import (EventBus, JobAdded, JobMetricsUpdated, JobPriorityChanged, JobProgress, JobRemoved,
+                     JobStateChanged, ServiceStateChanged)
+from .probe import MediaInfo, ProbeCache, probe_media, ProbeError
+from .scheduler import Admission, ResourceScheduler
+from .hot_folder import hot_folder_rules, match_rule, rule_output_dir, rule_profile, watch_roots
+from .job_queue import JobQueue, get_policy
+from .journal import JobJournal, recover_jobs
+from .ladder import build_renditions, convert_ladder
+from .metrics import MetricsRegistry, ProcessSampler
+from .output_cache import OutputCache
+from .previews import PreviewPlan, generate_previews, preview_branches, preview_plan, write_sprite_vtt
+from .progress import ProgressInfo
+from .readiness import ReadinessTracker
+from .segments import convert_file_segmented
+from .settings_store import SettingsStore, get_settings_store
+from .watcher import FileEvent, FolderWatcher, create_watcher
+
+# Способы выполнения задач: пул потоков или один event loop asyncio
+ENGINES = ("threads", "asyncio")
 
 # Список поддерживаемых расширений для горячей папки
 VIDEO_EXTENSIONS = {'.mp4', '.avi', '.mkv', '.mov', '.wmv', '.flv', '.webm'}
 
+PROBE_WORKERS = 4  # параллельных ffprobe длительности для политики sjf
+
+
+def resolve_worker_count(max_workers: Optional[int] = None, threads_per_job: Optional[int] = None) -> int:
+    """
+    Определяет размер пула рабочих потоков.
+    Явно заданное число имеет приоритет; иначе делим ядра CPU на бюджет потоков одной задачи.
+    Без бюджета ffmpeg сам занимает все ядра, поэтому оставляем один поток.
+    """
+    if max_workers and max_workers > 0:
+        return max_workers
+    if not threads_per_job or threads_per_job <= 0:
+        return 1
+    cpus = os.cpu_count() or 1
+    return max(1, cpus // threads_per_job)
+
+
+def _file_size(path: Path) -> int:
+    try:
+        return path.stat().st_size
+    except OSError:
+        return 0
+
+
+def build_output_cache(settings: Settings) -> Optional[OutputCache]:
+    if not settings.output_cache_path:
+        return None
+    return OutputCache(Path(settings.output_cache_path), max_bytes=settings.output_cache_max_mb * 1024 * 1024)
+
+
+@dataclass
+class _JobRun:
+    """Выполнение одной задачи: что общие шаги конвейера передают кодированию и завершению."""
+    job: Job
+    sampler: ProcessSampler
+    control: JobControl
+    key: Optional[str]  # ключ кэша результатов (None — кэш не используется)
+    start: float
+    plan: Optional[PreviewPlan] = None
+    options: Optional[ConversionOptions] = None  # None у многовыходной задачи
+    rendered: bool = False  # превью делаются в основном проходе
+
+    @property
+    def segmented(self) -> bool:
+        # Чистый ремукс быстрый сам по себе, резать его на сегменты незачем
+        return self.job.segmented and self.job.conversion_path != ConversionPath.REMUX
+
+    @property
+    def single_file(self) -> bool:
+        """Один выход одним процессом без веток превью — его движок asyncio ведет на своем цикле."""
+        return self.options is not None and not self.segmented and not self.rendered
+
 
 class ConverterService:
-    def __init__(self):
-        self.queue: List[Job] = []
+    def __init__(
+            self,
+            max_workers: Optional[int] = None,
+            threads_per_job: Optional[int] = None,
+            watcher_backend: Optional[str] = None,
+            journal: Optional[JobJournal] = None,
+            engine: str = "threads",
+            job_timeout: Optional[float] = None,
+            scheduler: Optional[ResourceScheduler] = None,
+            policy: str = "priority",
+            output_cache: Optional[OutputCache] = None,
+            settings_store: Optional[SettingsStore] = None,
+            progress_interval: float = 0.25,
+            encoder: Optional[Callable[..., None]] = None,
+            probe_cache: Optional[ProbeCache] = None,
+    ):
+        if engine not in ENGINES:
+            raise ValueError(f"Неизвестный движок: {engine}. Допустимые: {', '.join(ENGINES)}")
+        self.queue = JobQueue(get_policy(policy))
+        self.engine = engine
+        self.job_timeout = job_timeout  # предел времени кодирования одной задачи (Settings.job_timeout)
+        # Кодирование одиночного файла с сигнатурой convert_file (None — ffmpeg); бенчмарк подставляет пустышку
+        self.encoder = encoder
+        self.probe_cache = probe_cache  # None — общий кэш ffprobe процесса
+        self.threads_per_job = threads_per_job or None
+        self.max_workers = resolve_worker_count(max_workers, threads_per_job)
         self._running = False
-        self._thread: Optional[threading.Thread] = None
+        self._workers: List[threading.Thread] = []
+        self._active_workers = 0
+        # Защищает очередь и счетчик потоков: два потока не должны взять одну задачу
+        self._lock = threading.RLock()
         self._stop_event = threading.Event()
         self._pause_event = threading.Event()
+        # Управление отдельными выполняемыми задачами: пауза, продолжение, отмена
+        self._controls: Dict[UUID, JobControl] = {}
+
+        # Допуск задач по загрузке CPU/памяти/диска (None — только ограничение max_workers)
+        self.scheduler = scheduler
+        self._admission_lock = threading.Lock()
+
+        # Кэш результатов по содержимому: повторно пришедший ролик не кодируется заново
+        self.output_cache = output_cache
+
+        # Счетчики и гистограммы по завершенным задачам (Prometheus / JSON)
+        self.metrics = MetricsRegistry()
+
+        # События для GUI, API и журналов: добавление, состояние, прогресс (не чаще progress_interval), метрики
+        self.events = EventBus(progress_interval)
+
+        # Для движка asyncio: цикл событий и активные кодирования
+        self._async_engine: Optional[AsyncEngine] = None
+        self._dispatch_future = None
+        self._conversions: Dict[UUID, AsyncConversion] = {}
 
         # ДЛЯ ГОРЯЧЕЙ ПАПКИ
         self._processed_files: Set[Path] = set()  # Запоминаем, что уже добавили
+        self.watcher_backend = watcher_backend  # None — inotify, если доступен; "polling" — опрос
+        # Настройки берем из общего кэша; при их изменении цикл горячей папки просыпается сразу
+        self.settings_store = settings_store or get_settings_store()
+        self._settings_changed = threading.Event()
+        self._unsubscribe = self.settings_store.subscribe(lambda settings: self._settings_changed.set())
+        self._closed = threading.Event()  # shutdown(): цикл горячей папки завершается
+        # Проверки готовности файлов идут параллельно, а не по одному; недописанные ждут в трекере
+        self._readiness = ReadinessTracker()
+        self._ready_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="hot-folder-ready")
+        # ffprobe длительности для политики sjf — свой пул: пачка новых задач не задерживает горячую папку
+        self._probe_pool = ThreadPoolExecutor(max_workers=PROBE_WORKERS, thread_name_prefix="sjf-probe")
+
+        # Журнал: восстанавливаем очередь, пережившую падение процесса
+        self.journal = journal
+        if journal is not None:
+            for job in recover_jobs(journal):
+                self.queue.add(job)
+                self.events.publish(JobAdded.of(job))
+                self._processed_files.add(job.source_path)
+                if self.queue.policy.needs_duration and job.state == JobState.QUEUED:
+                    self._probe_pool.submit(self._probe_duration, job)
         self._watcher_thread = threading.Thread(target=self._watcher_loop, daemon=True)
         self._watcher_thread.start()
 
+    @classmethod
+    def from_settings(cls, store: Optional[SettingsStore] = None, **kwargs) -> "ConverterService":
+        """
+        Сервис по сохраненным настройкам: журнал, планировщик, кэш результатов, движок,
+        предел времени задачи, политика очереди и число потоков. Журнал закрывает вызывающий.
+        kwargs — аргументы конструктора, которых нет в настройках (encoder, probe_cache).
+        """
+        store = store or get_settings_store()
+        settings = store.get()
+        return cls(
+            max_workers=settings.max_workers,
+            threads_per_job=settings.threads_per_job,
+            journal=JobJournal(Path(settings.journal_path)) if settings.journal_path else None,
+            engine=settings.engine,
+            job_timeout=settings.job_timeout or None,
+            scheduler=ResourceScheduler() if settings.resource_scheduler else None,
+            policy=settings.queue_policy,
+            output_cache=build_output_cache(settings),
+            settings_store=store,
+            **kwargs,
+        )
+
     def add_job(self, job: Job) -> None:
-        self.queue.append(job)
+        self.queue.add(job)
+        self.events.publish(JobAdded.of(job))
+        if self.journal:
+            self.journal.record_created(job)
+        if self.queue.policy.needs_duration and job.duration is None:
+            self._probe_pool.submit(self._probe_duration, job)
+
+    def _probe_duration(self, job: Job) -> None:
+        """Узнает длительность в фоне и переставляет задачу (нужно для политики sjf)."""
+        try:
+            job.duration = probe_media(job.source_path, cache=self.probe_cache).duration or None
+        except (ProbeError, OSError):
+            return
+        self.queue.reorder(job)
+
+    def set_queue_policy(self, name: str) -> None:
+        self.queue.set_policy(get_policy(name))
+        if self.queue.policy.needs_duration:
+            for job in self.queue.jobs_in_state(JobState.QUEUED):
+                if job.duration is None:
+                    self._probe_pool.submit(self._probe_duration, job)
+
+    def set_job_priority(self, job_id: UUID, priority: int) -> bool:
+        job = self.queue.get(job_id)
+        if job is None:
+            return False
+        job.priority = priority
+        self.queue.reorder(job)
+        # Смена приоритета — не смена состояния: отдельное событие и отдельная запись в журнале
+        self.events.publish(JobPriorityChanged.of(job))
+        if self.journal:
+            self.journal.record_priority(job)
+        return True
+
+    def queue_wait_report(self) -> dict:
+        """Время ожидания в очереди по каждой использованной политике (секунды)."""
+        return self.queue.wait_report()
+
+    def get_job(self, job_id: UUID) -> Optional[Job]:
+        return self.queue.get(job_id)
 
     def remove_job(self, job_id: UUID) -> None:
-        job_to_remove = next((j for j in self.queue if j.id == job_id), None)
+        job_to_remove = self.queue.remove(job_id)
         if job_to_remove:
             self._processed_files.discard(job_to_remove.source_path)
-
-        self.queue = [j for j in self.queue if j.id != job_id]
+            self.events.publish(JobRemoved(job_id))
+            if self.journal:
+                self.journal.record_removed(job_id)
 
     def clear_queue(self) -> None:
-        jobs_to_remove = [j for j in self.queue if j.state != JobState.RUNNING]
-
-        for job in jobs_to_remove:
+        idle_states = [state for state in JobState if state not in (JobState.RUNNING, JobState.PAUSED)]
+        for job in self.queue.remove_states(*idle_states):
             self._processed_files.discard(job.source_path)
+            self.events.publish(JobRemoved(job.id))
+            if self.journal:
+                self.journal.record_removed(job.id)
 
-        self.queue = [j for j in self.queue if j.state == JobState.RUNNING]
+    def cancel_job(self, job_id: UUID) -> bool:
+        """
+        Отменяет задачу. Ожидающая сразу становится отмененной, у выполняемой останавливается
+        только ее ffmpeg — остальные задачи продолжают работу. False — задача уже завершена.
+        """
+        job = self.queue.get(job_id)
+        if job is None:
+            return False
+        if self.queue.transition(job, JobState.QUEUED, JobState.CANCELLED):
+            self._record_state(job)
+            return True
+        with self._lock:
+            control = self._controls.get(job_id)
+        if control is None:
+            return False
+        control.cancel()  # в CANCELLED задачу переведет ее рабочий поток, когда ffmpeg завершится
+        return True
+
+    def pause_job(self, job_id: UUID) -> bool:
+        """Приостанавливает процессы ffmpeg одной выполняемой задачи. False — задача не выполняется."""
+        with self._lock:
+            control = self._controls.get(job_id)
+            job = self.queue.get(job_id)
+            if control is None or job is None or not self.queue.transition(job, JobState.RUNNING, JobState.PAUSED):
+                return False
+            control.pause()
+        self._record_state(job)
+        return True
+
+    def resume_job(self, job_id: UUID) -> bool:
+        """Продолжает задачу, приостановленную pause_job. При общей паузе она проснется вместе с остальными."""
+        with self._lock:
+            control = self._controls.get(job_id)
+            job = self.queue.get(job_id)
+            if control is None or job is None or not self.queue.transition(job, JobState.PAUSED, JobState.RUNNING):
+                return False
+            control.resume()
+        self._record_state(job)
+        return True
+
+    def _job_control(self, job: Job, sampler: ProcessSampler) -> JobControl:
+        control = JobControl(self._pause_event, self._stop_event, on_process=sampler.attach)
+        with self._lock:
+            self._controls[job.id] = control
+        return control
+
+    def _release_control(self, job: Job) -> None:
+        with self._lock:
+            self._controls.pop(job.id, None)
 
     def has_pending_jobs(self) -> bool:
-        return any(j.state == JobState.QUEUED for j in self.queue)
+        return self.queue.count(JobState.QUEUED) > 0
+
+    def _set_state(self, job: Job, state: JobState) -> None:
+        self.queue.set_state(job, state)
+        self._record_state(job)
+
+    def _record_state(self, job: Job) -> None:
+        """Смена состояния: в журнал и подписчикам."""
+        self.events.publish(JobStateChanged.of(job))
+        if self.journal:
+            self.journal.record_state(job)
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    @property
+    def paused(self) -> bool:
+        return self._pause_event.is_set()
+
+    def _publish_service_state(self) -> None:
+        self.events.publish(ServiceStateChanged(running=self._running, paused=self._pause_event.is_set()))
+
+    def _report_progress(self, job: Job, progress: Optional[int] = None) -> None:
+        if progress is not None:
+            job.progress = progress
+        self.events.publish(JobProgress.of(job))
 
     def start_processing(self) -> None:
-        if self._running: return
-        self._running = True
-        self._stop_event.clear()
-        self._pause_event.clear()
-        self._thread = threading.Thread(target=self._worker, daemon=True)
-        self._thread.start()
+        """Запускает пул потоков (или добирает его до max_workers, если часть потоков уже завершилась)."""
+        with self._lock:
+            if self.engine == "asyncio":
+                self._start_async()
+                self._publish_service_state()
+                return
+
+            if self._active_workers == 0:
+                self._stop_event.clear()
+                self._pause_event.clear()
+            elif self._stop_event.is_set():
+                # Остановленные потоки еще завершаются, новые не запускаем
+                return
+
+            self._running = True
+            self._workers = [t for t in self._workers if t.is_alive()]
+            while self._active_workers < self.max_workers:
+                self._active_workers += 1
+                thread = threading.Thread(target=self._worker, daemon=True)
+                self._workers.append(thread)
+                thread.start()
+            self._publish_service_state()
 
     def stop_processing(self) -> None:
         self._running = False
         self._pause_event.clear()
         self._stop_event.set()
+        with self._lock:
+            controls = list(self._controls.values())
+        for control in controls:
+            control.cancel()  # будит и задачи, поставленные на паузу по отдельности
+        for conversion in list(self._conversions.values()):
+            conversion.cancel()
+        self._publish_service_state()
+
+    def wait_stopped(self, timeout: Optional[float] = None) -> bool:
+        """
+        Ждет после stop_processing, пока рабочие потоки (и диспетчер asyncio) завершат свои ffmpeg.
+        False — не уложились в timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        def remaining() -> Optional[float]:
+            return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+        for thread in list(self._workers):
+            thread.join(remaining())
+        if self._dispatch_future is not None:
+            try:
+                self._dispatch_future.result(remaining())
+            except concurrent.futures.TimeoutError:
+                return False
+            except Exception:
+                pass  # ошибки задач уже записаны в сами задачи
+        return not any(thread.is_alive() for thread in self._workers)
+
+    def shutdown(self, timeout: Optional[float] = None) -> bool:
+        """
+        Полное завершение сервиса: останавливает задачи, дожидается их ffmpeg, закрывает
+        горячую папку, пулы проверок и ffprobe, цикл asyncio. После shutdown сервис не используется.
+        False — задачи не успели остановиться за timeout.
+        """
+        self.stop_processing()
+        stopped = self.wait_stopped(timeout)
+        self._closed.set()
+        self._settings_changed.set()  # будит цикл горячей папки, если он ждет настроек
+        self._unsubscribe()
+        self._watcher_thread.join(timeout=5)
+        self._ready_pool.shutdown(wait=True, cancel_futures=True)
+        self._probe_pool.shutdown(wait=True, cancel_futures=True)
+        if self._async_engine is not None:
+            self._async_engine.close()
+        return stopped
 
     def pause_processing(self) -> None:
         self._pause_event.set()
+        for conversion in list(self._conversions.values()):
+            conversion.pause()
+        self._publish_service_state()
 
     def resume_processing(self) -> None:
         self._pause_event.clear()
+        with self._lock:
+            # Задачи, поставленные на паузу по отдельности, остаются на паузе
+            paused = {job_id for job_id, control in self._controls.items() if control.paused}
+        for job_id, conversion in list(self._conversions.items()):
+            if job_id not in paused:
+                conversion.resume()
+        self._publish_service_state()
 
     # === ЛОГИКА ГОРЯЧЕЙ ПАПКИ ===
-    def _is_file_ready(self, path: Path) -> bool:
-        """
-        Проверяет, завершилась ли запись файла (стабилен ли размер).
-        Нужно, чтобы не начать конвертировать файл, который еще копируется.
-        """
-        try:
-            size1 = path.stat().st_size
-            time.sleep(1)  # Ждем секунду
-            size2 = path.stat().st_size
-            return size1 == size2 and size1 > 0
-        except OSError:
-            return False
+    def _ingest_events(self, events: List[FileEvent], settings: Settings) -> None:
+        rules = hot_folder_rules(settings)
+        candidates = {}
+        matched: Dict[Path, HotFolderRule] = {}
+        for event in events:
+            path = event.path
+            if path not in matched:
+                rule = None if path in self._processed_files else match_rule(
+                    rules, path, settings.output_path, VIDEO_EXTENSIONS)
+                if rule is None:
+                    self._readiness.forget(path)
+                    continue
+                matched[path] = rule
+            # Подтвержденное событие побеждает неподтвержденное для того же файла
+            candidates[path] = candidates.get(path, False) or event.confirmed
+        if not candidates:
+            return
+
+        for path in [p for p in candidates if self.queue.has_source(p)]:
+            self._readiness.forget(path)
+            del candidates[path]
+
+        # Проверки без пауз (stat, заголовки контейнера, ffprobe) идут параллельно;
+        # недописанные файлы трекер вернет через due(), когда их пора будет проверить снова
+        paths = sorted(candidates)
+        ready = self._ready_pool.map(lambda p: self._readiness.check(p, candidates[p]), paths)
+
+        for file_path, is_ready in zip(paths, ready):
+            if not is_ready:
+                continue
+            rule = matched[file_path]
+            profile = rule_profile(rule, settings)
+            new_job = Job(
+                source_path=file_path,
+                output_dir=rule_output_dir(rule, file_path, settings.output_path),
+                profile=profile,
+                renditions=build_renditions(profile, settings.abr_ladder)
+            )
+            self.add_job(new_job)
+            self._processed_files.add(file_path)
+            print(f"[HOT FOLDER] Обнаружен новый файл: {file_path.name}")
+
+            # === АВТОМАТИЧЕСКИЙ ЗАПУСК ===
+            self.start_processing()
+            # =============================
 
     def _watcher_loop(self):
-        """Бесконечный цикл проверки горячей папки."""
-        while True:
+        """Цикл горячей папки до shutdown(): ждет событий файловой системы (или опрашивает папки)."""
+        watcher: Optional[FolderWatcher] = None
+        while not self._closed.is_set():
             try:
-                settings = Settings.load()
-
-                if settings.hot_folder_enabled and settings.hot_folder_path:
-                    folder = Path(settings.hot_folder_path)
-
-                    if folder.exists() and folder.is_dir():
-                        # Сканируем файлы
-                        for file_path in folder.iterdir():
-                            if (file_path.suffix.lower() in VIDEO_EXTENSIONS
-                                    and file_path not in self._processed_files):
-
-                                already_in_queue = any(j.source_path == file_path for j in self.queue)
-
-                                if not already_in_queue and self._is_file_ready(file_path):
-                                    new_job = Job(
-                                        source_path=file_path,
-                                        output_dir=Path(settings.output_path),
-                                        profile=settings.default_profile
-                                    )
-                                    self.add_job(new_job)
-                                    self._processed_files.add(file_path)
-                                    print(f"[HOT FOLDER] Обнаружен новый файл: {file_path.name}")
-
-                                    # === АВТОМАТИЧЕСКИЙ ЗАПУСК ===
-                                    if not self._running:
-                                        self.start_processing()
-                                    # =============================
-                    else:
-                        pass
+                self._settings_changed.clear()
+                settings = self.settings_store.get()  # только stat, если файл не менялся
+                roots = watch_roots(hot_folder_rules(settings))
+
+                if watcher and (not watcher.alive or watcher.roots != roots):
+                    watcher.close()
+                    watcher = None
+                    self._readiness = ReadinessTracker()  # ожидающие файлы старых папок больше не нужны
+
+                if watcher is None and roots:
+                    watcher = create_watcher(roots, self.watcher_backend)
+                    folders = ", ".join(f"{root}{' (с вложенными)' if recursive else ''}" for root, recursive in roots)
+                    print(f"[HOT FOLDER] Наблюдение за {folders} ({watcher.backend})")
+
+                if watcher is None:
+                    self._settings_changed.wait(3)
+                    continue
+
+                self._readiness.configure(settings.hot_folder_quiet_seconds, settings.hot_folder_ready_check)
+                events = watcher.poll(timeout=self._readiness.next_due(1.0))
+                events.extend(FileEvent(path) for path in self._readiness.due())
+                self._ingest_events(events, settings)
 
             except Exception as e:
                 print(f"[WATCHER ERROR] {e}")
+                self._closed.wait(3)
+        if watcher:
+            watcher.close()
 
-            time.sleep(3)
-
-    # ОСНОВНОЙ РАБОЧИЙ ПОТОК
+    def _claim_next_job(self) -> Optional[Job]:
+        """
+        Атомарно берет следующую задачу из очереди и переводит ее в RUNNING.
+        Возвращает None, если задач нет или планировщик ресурсов просит подождать.
+        """
+        if self.scheduler is None:
+            job = self.queue.claim_next()
+            if job:
+                self._record_state(job)
+            return job
+
+        with self._admission_lock:
+            while True:
+                job = self.queue.peek_next()
+                if job is None:
+                    return None
+                decision, reason = self.scheduler.admit(job, running=self._active_job_count())
+                if decision == Admission.WAIT:
+                    return None
+                if decision == Admission.REJECT:
+                    if self.queue.transition(job, JobState.QUEUED, JobState.FAILED):
+                        job.error_message = reason
+                        print(f"[SCHEDULER] {job.source_path.name}: {reason}")
+                        self._record_state(job)
+                    continue
+                if self.queue.transition(job, JobState.QUEUED, JobState.RUNNING):
+                    job.progress = 0
+                    self._record_state(job)
+                    return job
+                self.scheduler.release(job)
+
+    # ОСНОВНОЙ РАБОЧИЙ ПОТОК (их может быть несколько)
     def _worker(self) -> None:
-        while self._running:
-            if self._pause_event.is_set():
-                time.sleep(0.5)
-                continue
-
-            job = next((j for j in self.queue if j.state == JobState.QUEUED), None)
+        try:
+            while self._running:
+                if self._pause_event.is_set():
+                    time.sleep(0.5)
+                    continue
+
+                job = self._claim_next_job()
+
+                if not job:
+                    if self.scheduler and self.has_pending_jobs():
+                        time.sleep(1.0)  # планировщик ждет освобождения ресурсов
+                        continue
+                    break
+
+                self._run_job(job)
+
+                if self._stop_event.is_set():
+                    break
+        finally:
+            with self._lock:
+                self._active_workers -= 1
+                if self._active_workers == 0:
+                    self._running = False
+                    self._publish_service_state()
+
+    def _probe(self, job: Job) -> Optional[MediaInfo]:
+        start = time.perf_counter()
+        try:
+            return probe_media(job.source_path, cache=self.probe_cache)
+        except (ProbeError, OSError) as e:
+            print(f"[WARN] Не удалось прочитать метаданные {job.source_path.name}: {e}")
+            return None
+        finally:
+            job.metrics.probe_time += time.perf_counter() - start
+
+    def _apply_stream_copy(self, job: Job, options: ConversionOptions) -> None:
+        """Включает копирование потоков, которые уже соответствуют профилю, и запоминает выбранный путь."""
+        info = self._probe(job)
+        if info is None:
+            job.conversion_path = ConversionPath.TRANSCODE
+            return
+        # Длительность уже прочитана (в кэше сервиса): кодированию не нужен второй ffprobe
+        job.duration = job.duration or info.duration or None
+
+        options.copy_video, options.copy_audio = plan_stream_copy(info, job.profile, options.audio_bitrate)
+        if options.copy_video and options.copy_audio:
+            job.conversion_path = ConversionPath.REMUX
+        elif options.copy_video or options.copy_audio:
+            job.conversion_path = ConversionPath.PARTIAL_COPY
+        else:
+            job.conversion_path = ConversionPath.TRANSCODE
+
+    def _profile_options(self, profile: FormatProfile, output_dir: Path) -> ConversionOptions:
+        return ConversionOptions(
+            target_format=profile.format,
+            output_dir=output_dir,
+            video_bitrate=profile.bitrate,
+            resolution=profile.resolution,
+            fps=profile.fps,
+            video_codec=profile.video_codec,
+            audio_codec=profile.audio_codec,
+            preset=profile.preset or None,
+            crf=profile.crf,
+            threads=profile.threads or self.threads_per_job
+        )
+
+    def _build_options(self, job: Job) -> ConversionOptions:
+        job.output_dir.mkdir(parents=True, exist_ok=True)
+        options = self._profile_options(job.profile, job.output_dir)
+        self._apply_stream_copy(job, options)
+        return options
+
+    def _build_ladder_outputs(self, job: Job) -> List[Tuple[Path, ConversionOptions]]:
+        """Параметры каждого выхода многовыходной задачи; копирование потоков решается для каждого отдельно."""
+        job.output_dir.mkdir(parents=True, exist_ok=True)
+        info = self._probe(job)
+
+        outputs = []
+        for rendition in job.renditions:
+            options = self._profile_options(rendition.profile, job.output_dir)
+            if options.threads and not rendition.profile.threads:
+                # Все энкодеры работают в одном процессе — делим между ними бюджет потоков задачи
+                options.threads = max(1, options.threads // len(job.renditions))
+            if info is not None:
+                options.copy_video, options.copy_audio = plan_stream_copy(info, rendition.profile,
+                                                                          options.audio_bitrate)
+            outputs.append((job.rendition_output(rendition), options))
+
+        if all(o.copy_video and o.copy_audio for _, o in outputs):
+            job.conversion_path = ConversionPath.REMUX
+        elif any(o.copy_video or o.copy_audio for _, o in outputs):
+            job.conversion_path = ConversionPath.PARTIAL_COPY
+        else:
+            job.conversion_path = ConversionPath.TRANSCODE
+        return outputs
+
+    def _run_ladder(self, job: Job, update_progress, sampler: ProcessSampler, control: JobControl,
+                    plan: Optional[PreviewPlan] = None) -> None:
+        outputs = self._build_ladder_outputs(job)
+        for rendition in job.renditions:
+            rendition.state, rendition.progress, rendition.size = JobState.RUNNING, 0, 0
+
+        def on_progress(p: int):
+            for rendition in job.renditions:
+                rendition.progress = p
+            update_progress(p)
+
+        def on_output(index: int, size: int):
+            job.renditions[index].size = size
+            self._report_progress(job)
+
+        convert_ladder(job.source_path, outputs, progress_callback=on_progress, pause_event=control.pause_event,
+                       stop_event=control.stop_event, metrics_callback=self._metrics_callback(job, sampler),
+                       output_callback=on_output, process_callback=control.attach,
+                       extra_branches=preview_branches(plan) if plan else (), timeout=self.job_timeout)
+
+    def _convert_with_previews(self, job: Job, options: ConversionOptions, plan: PreviewPlan, update_progress,
+                               sampler: ProcessSampler, control: JobControl) -> None:
+        """Один выход плюс ветки превью — тот же многовыходной проход, что и у лесенки."""
+        convert_ladder(job.source_path, [(job.output_filename, options)], progress_callback=update_progress,
+                       pause_event=control.pause_event, stop_event=control.stop_event,
+                       metrics_callback=self._metrics_callback(job, sampler), process_callback=control.attach,
+                       extra_branches=preview_branches(plan), timeout=self.job_timeout)
+
+    # === ПРЕВЬЮ: обложка, листы миниатюр, индекс WebVTT ===
+    def _preview_plan(self, job: Job) -> Optional[PreviewPlan]:
+        if not job.profile.poster and not job.profile.preview_interval:
+            return None
+        return preview_plan(job.profile, job.output_dir, job.source_path.stem, self._probe(job))
+
+    @staticmethod
+    def _previews_in_pass(job: Job, options: ConversionOptions) -> bool:
+        """
+        Превью делаются в основном проходе, если видео там и так декодируется.
+        При копировании видео и сегментном кодировании дешевле отдельный проход по опорным кадрам.
+        """
+        return not (options.copy_video or (job.segmented and job.conversion_path != ConversionPath.REMUX))
 
-            if not job:
-                self._running = False
-                break
+    def _finish_previews(self, job: Job, plan: Optional[PreviewPlan], rendered: bool, control: JobControl) -> None:
+        """Ошибка превью не делает задачу неуспешной: основной результат уже готов."""
+        if plan is None:
+            return
+        try:
+            if rendered:
+                write_sprite_vtt(plan)
+            else:
+                generate_previews(job.source_path, plan, control.stop_event)
+        except (ConversionError, OSError) as e:
+            print(f"[WARN] Не удалось создать превью {job.source_path.name}: {e}")
+        job.previews = [path for path in plan.files if path.exists()]
+
+    def _finish_renditions(self, job: Job, error: Optional[BaseException]) -> Optional[BaseException]:
+        """Итог по каждому выходу. Выход, который ffmpeg так и не записал, делает задачу неуспешной."""
+        if error is not None:
+            stopped = isinstance(error, ConversionError) and str(error) == "STOPPED"
+            for rendition in job.renditions:
+                rendition.state = JobState.CANCELLED if stopped else JobState.FAILED
+            return error
+
+        missing = []
+        for rendition in job.renditions:
+            output = job.rendition_output(rendition)
+            rendition.size = output.stat().st_size if output.exists() else 0
+            if rendition.size > 0:
+                rendition.state, rendition.progress = JobState.DONE, 100
+            else:
+                rendition.state = JobState.FAILED
+                missing.append(rendition.label)
+        if missing:
+            return ConversionError(f"Не созданы выходы: {', '.join(missing)}")
+        return None
+
+    def _finish_job(self, job: Job, error: Optional[BaseException] = None) -> None:
+        """Переводит задачу в итоговое состояние по результату кодирования."""
+        self._release_control(job)
+        if self.scheduler:
+            self.scheduler.release(job)
+        if job.renditions:
+            error = self._finish_renditions(job, error)
+        self._collect_metrics(job, error is None)
+        if error is None:
+            job.progress = 100  # до смены состояния: событие DONE несет итоговый прогресс
+            self._set_state(job, JobState.DONE)
+        elif isinstance(error, ConversionError) and str(error) == "STOPPED":
+            self._set_state(job, JobState.CANCELLED)
+            print(f"[INFO] Задача отменена пользователем: {job.source_path.name}")
+        elif isinstance(error, ConversionError):
+            print(f"[SERVICE ERROR] {error}")
+            job.error_message = str(error)
+            self._set_state(job, JobState.FAILED)
+        else:
+            print(f"[CRITICAL ERROR] {error}")
+            job.error_message = str(error)
+            self._set_state(job, JobState.FAILED)
+        self.metrics.observe_job(job)
+
+    def _collect_metrics(self, job: Job, succeeded: bool) -> None:
+        metrics = job.metrics
+        if job.started_at is not None:
+            metrics.queue_wait = max(0.0, job.started_at - job.created_at)
+        metrics.input_bytes = _file_size(job.source_path)
+        if succeeded:
+            metrics.output_bytes = sum(_file_size(path) for path in job.output_files)
+
+    def _metrics_callback(self, job: Job, sampler: ProcessSampler):
+        """Колбэк для отчетов ffmpeg -progress: скорость, FPS и замер процесса."""
+        def on_metrics(info: ProgressInfo) -> None:
+            # speed и fps в отчете ffmpeg — средние с начала кодирования, последнее значение и есть итог
+            if info.speed:
+                job.metrics.speed = info.speed
+            if info.fps:
+                job.metrics.fps = info.fps
+            sampler.sample()
+            self.events.publish(JobMetricsUpdated.of(job, info))
+        return on_metrics
+
+    def metrics_snapshot(self) -> dict:
+        return self.metrics.snapshot()
+
+    def metrics_text(self) -> str:
+        """Метрики в формате Prometheus вместе с текущей глубиной очереди."""
+        gauges = {
+            "queue_jobs": ("Задачи в очереди по состояниям",
+                           {(("state", state.name.lower()),): self.queue.count(state) for state in JobState}),
+            "workers": ("Максимум одновременно выполняемых задач", {(): self.max_workers}),
+        }
+        return self.metrics.render_prometheus(gauges)
+
+    def _cache_key(self, job: Job) -> Optional[str]:
+        if self.output_cache is None or job.renditions:
+            return None  # многовыходные задачи в кэш не попадают
+        try:
+            return self.output_cache.key_for(job.source_path, job.profile)
+        except OSError as e:
+            print(f"[WARN] Не удалось вычислить хэш {job.source_path.name}: {e}")
+            return None
+
+    def _fetch_cached(self, job: Job, key: Optional[str]) -> bool:
+        """Берет результат из кэша вместо кодирования. True — задача уже выполнена."""
+        if key is None:
+            return False
+        try:
+            if not self.output_cache.fetch(key, job.output_filename):
+                return False
+        except OSError as e:
+            print(f"[WARN] Не удалось взять результат из кэша: {e}")
+            return False
+        print(f"[CACHE] Результат взят из кэша: {job.output_filename}")
+        job.conversion_path = ConversionPath.CACHED
+        return True
 
-            job.state = JobState.RUNNING
-            job.progress = 0
+    def _finish_cached(self, job: Job, control: JobControl) -> None:
+        """Результат взят из кэша: остаются превью. Ошибка плана превью (например, неверная сетка) — как при кодировании."""
+        try:
+            plan = self._preview_plan(job)
+        except Exception as e:
+            self._finish_job(job, e)
+            return
+        self._finish_previews(job, plan, rendered=False, control=control)
+        self._finish_job(job)
+
+    # === КОНВЕЙЕР ЗАДАЧИ: общий для обоих движков, различается только само кодирование ===
+    def _begin_job(self, job: Job) -> Optional[_JobRun]:
+        """Кэш, план превью и параметры кодирования. None — задача уже завершена (из кэша или с ошибкой)."""
+        sampler = ProcessSampler(job.metrics)
+        control = self._job_control(job, sampler)
+        key = self._cache_key(job)
+        if self._fetch_cached(job, key):
+            self._finish_cached(job, control)
+            return None
+        run = _JobRun(job, sampler, control, key, start=time.perf_counter())
+        try:
+            run.plan = self._preview_plan(job)
+            if job.renditions:
+                run.rendered = True
+            else:
+                run.options = self._build_options(job)
+                run.rendered = run.plan is not None and self._previews_in_pass(job, run.options)
+        except Exception as e:
+            self._end_job(run, e)
+            return None
+        return run
+
+    def _encode(self, run: _JobRun) -> None:
+        """Кодирование в текущем потоке; движок asyncio сюда приходит со всем, кроме одиночного файла."""
+        job, control = run.job, run.control
+        update_progress = partial(self._report_progress, job)
+        if job.renditions:
+            self._run_ladder(job, update_progress, run.sampler, control, run.plan)
+        elif run.segmented:
+            # Каждый процесс сегментов регистрируется в JobControl: pause_job/cancel_job действуют на все
+            convert_file_segmented(job.source_path, run.options, progress_callback=update_progress,
+                                   pause_event=control.pause_event, stop_event=control.stop_event,
+                                   max_parallel=self._segment_parallelism(run.options), timeout=self.job_timeout,
+                                   metrics_callback=self._metrics_callback(job, run.sampler),
+                                   process_callback=control.attach)
+        elif run.rendered:
+            self._convert_with_previews(job, run.options, run.plan, update_progress, run.sampler, control)
+        else:
+            (self.encoder or convert_file)(
+                job.source_path,
+                run.options,
+                progress_callback=update_progress,
+                pause_event=control.pause_event,
+                stop_event=control.stop_event,
+                metrics_callback=self._metrics_callback(job, run.sampler),
+                process_callback=control.attach,
+                duration=job.duration,
+                timeout=self.job_timeout
+            )
+
+    def _segment_parallelism(self, options: ConversionOptions) -> int:
+        """
+        Сколько сегментов одной задачи кодировать одновременно. Сегменты делят CPU с остальными
+        задачами сервиса: пока выполняются другие — по одному, иначе ядра делятся на потоки одного ffmpeg.
+        """
+        if self._active_job_count() > 1:
+            return 1
+        return max(1, (os.cpu_count() or 1) // (options.threads or 1))
+
+    def _active_job_count(self) -> int:
+        """Задачи, у которых есть процесс ffmpeg: приостановленные тоже держат память и место на диске."""
+        return self.queue.count(JobState.RUNNING) + self.queue.count(JobState.PAUSED)
+
+    def _end_job(self, run: _JobRun, error: Optional[BaseException] = None) -> None:
+        """Время кодирования, превью, сохранение в кэш и итоговое состояние."""
+        self._record_encode_time(run.job, run.start)
+        if error is None:
+            self._finish_previews(run.job, run.plan, run.rendered, run.control)
+            if run.key is not None:
+                self.output_cache.store(run.key, run.job.output_filename)
+        self._finish_job(run.job, error)
+
+    def _run_job(self, job: Job) -> None:
+        run = self._begin_job(job)
+        if run is None:
+            return
+        try:
+            self._encode(run)
+        except Exception as e:
+            self._end_job(run, e)
+        else:
+            self._end_job(run)
+
+    @staticmethod
+    def _record_encode_time(job: Job, start: float) -> None:
+        # Время ffprobe учитывается отдельно
+        job.metrics.encode_time = max(0.0, time.perf_counter() - start - job.metrics.probe_time)
+
+    # === РЕЖИМ ASYNCIO: все задачи на одном event loop ===
+    def _start_async(self) -> None:
+        if self._dispatch_future is not None and not self._dispatch_future.done():
+            return  # диспетчер уже работает (или еще завершает остановку)
+        self._stop_event.clear()
+        self._pause_event.clear()
+        if self._async_engine is None:
+            self._async_engine = AsyncEngine()
+        self._running = True
+        self._dispatch_future = self._async_engine.submit(self._async_dispatch())
 
-            try:
-                job.output_dir.mkdir(parents=True, exist_ok=True)
-                options = ConversionOptions(
-                    target_format=job.profile.format,
-                    output_dir=job.output_dir,
-                    video_bitrate=job.profile.bitrate,
-                    resolution=job.profile.resolution,
-                    fps=job.profile.fps
-                )
-
-                def update_progress(p: int):
-                    job.progress = p
-
-                convert_file(
-                    job.source_path,
-                    options,
-                    progress_callback=update_progress,
-                    pause_event=self._pause_event,
-                    stop_event=self._stop_event
-                )
-
-                job.state = JobState.DONE
-                job.progress = 100
-
-            except ConversionError as e:
-                if str(e) == "STOPPED":
-                    job.state = JobState.CANCELLED
-                    print(f"[INFO] Задача отменена пользователем: {job.source_path.name}")
-                else:
-                    print(f"[SERVICE ERROR] {e}")
-                    job.state = JobState.FAILED
-                    job.error_message = str(e)
-            except Exception as e:
-                print(f"[CRITICAL ERROR] {e}")
-                job.state = JobState.FAILED
-                job.error_message = str(e)
+    async def _async_dispatch(self) -> None:
+        slots = asyncio.Semaphore(self.max_workers)
+        tasks: Set[asyncio.Task] = set()
 
-            if self._stop_event.is_set():
-                break
+        def on_done(task: asyncio.Task) -> None:
+            tasks.discard(task)
+            slots.release()
 
-        self._running = False
\ No newline at end of file
+        try:
+            while self._running and not self._stop_event.is_set():
+                await slots.acquire()
+                job = None if self._pause_event.is_set() else self._claim_next_job()
+                if job is None:
+                    slots.release()
+                    if not tasks and not self._pause_event.is_set() and not self.has_pending_jobs():
+                        break
+                    # Ждем завершения любой задачи (или новых задач в очереди)
+                    await asyncio.wait(tasks or {asyncio.create_task(asyncio.sleep(0.5))},
+                                       timeout=0.5, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                task = asyncio.create_task(self._run_job_async(job))
+                tasks.add(task)
+                task.add_done_callback(on_done)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            self._running = False
+            self._publish_service_state()
+
+    async def _run_job_async(self, job: Job) -> None:
+        run = await asyncio.to_thread(self._begin_job, job)
+        if run is None:
+            return
+        try:
+            if run.single_file:
+                await self._encode_async(run)
+            else:
+                # Лесенка, сегменты и проход с превью ведут свои процессы из отдельного потока
+                await asyncio.to_thread(self._encode, run)
+        except Exception as e:
+            await asyncio.to_thread(self._end_job, run, e)
+        else:
+            await asyncio.to_thread(self._end_job, run)
+
+    async def _encode_async(self, run: _JobRun) -> None:
+        if self.encoder is not None:
+            # Подставленный кодировщик синхронный — в поток, как и остальные виды кодирования
+            await asyncio.to_thread(self._encode, run)
+            return
+        job, control = run.job, run.control
+        conversion = AsyncConversion(job.source_path, run.options, timeout=self.job_timeout,
+                                     process_callback=run.sampler.attach, duration=job.duration)
+        self._conversions[job.id] = conversion
+        control.conversion = conversion
+        if control.pause_event.is_set():
+            conversion.pause()
+        if control.cancelled:
+            conversion.cancel()
+        try:
+            await conversion.run(progress_callback=partial(self._report_progress, job),
+                                 metrics_callback=self._metrics_callback(job, run.sampler))
+        finally:
+            control.conversion = None
+            self._conversions.pop(job.id, None)
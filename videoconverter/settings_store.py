@@ -0,0 +1,122 @@
+import copy
+import threading
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+from .models import Settings
+
+Listener = Callable[[Settings], None]
+FileStamp = Optional[Tuple[int, int]]
+
+
+def _stamp(path: Path) -> FileStamp:
+    try:
+        stat = path.stat()
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class SettingsStore:
+    """
+    Единственный источник настроек для сервиса, горячей папки, GUI и демона.
+    Разобранный settings.json хранится в памяти и перечитывается только при смене
+    mtime/размера файла. Подписчики получают новые настройки при сохранении через
+    store и при правке файла извне (ее замечает ближайший get() или check()).
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self.path = path or Settings.SETTINGS_FILE
+        self._lock = threading.RLock()
+        self._settings: Optional[Settings] = None
+        self._stamp: FileStamp = None
+        self._listeners: List[Listener] = []
+
+    def get(self) -> Settings:
+        """Копия текущих настроек: вызывающий может менять ее, не затрагивая кэш."""
+        self.check()
+        with self._lock:
+            return copy.deepcopy(self._settings)
+
+    def check(self) -> bool:
+        """Перечитывает файл, если он изменился. True — настройки обновились и подписчики оповещены."""
+        with self._lock:
+            changed = self._reload()
+            settings = copy.deepcopy(self._settings)
+        if changed:
+            self._notify(settings)
+        return changed
+
+    def save(self, settings: Settings) -> bool:
+        with self._lock:
+            if not self._write(settings):
+                return False
+        self._notify(copy.deepcopy(settings))
+        return True
+
+    def update(self, change: Callable[[Settings], None]) -> Settings:
+        """
+        Чтение-изменение-запись под одной блокировкой, чтобы два окна, меняющие
+        разные поля, не затерли изменения друг друга. Подписчики оповещаются уже после нее.
+        """
+        with self._lock:
+            reloaded = self._reload()
+            settings = copy.deepcopy(self._settings)
+            change(settings)
+            saved = self._write(settings)
+            current = copy.deepcopy(self._settings)
+        if saved or reloaded:
+            self._notify(current)
+        return settings
+
+    def _reload(self) -> bool:
+        """Под блокировкой: читает файл при смене mtime/размера. True — изменились уже загруженные настройки."""
+        stamp = _stamp(self.path)
+        if self._settings is not None and stamp == self._stamp:
+            return False
+        initial = self._settings is None
+        self._settings = Settings.load(self.path)
+        self._stamp = stamp
+        return not initial
+
+    def _write(self, settings: Settings) -> bool:
+        """Под блокировкой: сохраняет файл и кэш. Оповещение — забота вызывающего, вне блокировки."""
+        if not settings.save(self.path):
+            return False
+        self._settings = copy.deepcopy(settings)
+        self._stamp = _stamp(self.path)
+        return True
+
+    def subscribe(self, listener: Listener) -> Callable[[], None]:
+        """Подписка на изменения. Возвращает функцию отписки."""
+        with self._lock:
+            self._listeners.append(listener)
+
+        def unsubscribe() -> None:
+            with self._lock:
+                if listener in self._listeners:
+                    self._listeners.remove(listener)
+
+        return unsubscribe
+
+    def _notify(self, settings: Settings) -> None:
+        # Вызываем вне блокировки: обработчик может сам обратиться к store
+        with self._lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(copy.deepcopy(settings))
+            except Exception as e:
+                print(f"[WARN] Ошибка обработчика изменения настроек: {e}")
+
+
+_default_store: Optional[SettingsStore] = None
+_default_store_lock = threading.Lock()
+
+
+def get_settings_store() -> SettingsStore:
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = SettingsStore()
+        return _default_store
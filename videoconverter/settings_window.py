@@ -1,9 +1,11 @@
 import tkinter as tk
+from dataclasses import replace
 import ttkbootstrap as ttk
 from ttkbootstrap.constants import *
 from tkinter import filedialog
 
-from .models import Settings, FormatProfile
+from .converter import ENCODER_PRESETS
+from .settings_store import get_settings_store
 
 class CustomPopup(tk.Toplevel):
     def __init__(self, parent, title, message, is_error=False):
@@ -59,13 +61,14 @@ class SettingsWindow(ttk.Toplevel):
     def __init__(self, parent):
         super().__init__(parent)
         self.title("Настройки")
-        self.geometry("600x580")
+        self.geometry("600x660")
         self.resizable(False, False)
 
         self.transient(parent)
         self.grab_set()
 
-        self.current_settings = Settings.load()
+        self.store = parent.service.settings_store if hasattr(parent, "service") else get_settings_store()
+        self.current_settings = self.store.get()
 
         self._init_ui()
         self._load_values()
@@ -160,6 +163,17 @@ class SettingsWindow(ttk.Toplevel):
         fps_combo = ttk.Combobox(container, textvariable=self.var_fps, values=[24, 25, 30, 60], state="readonly")
         fps_combo.grid(row=12, column=1, sticky="ew", padx=5)
 
+        ttk.Label(container, text="Пресет").grid(row=13, column=0, sticky="e", padx=5, pady=5)
+        self.var_preset = ttk.StringVar()
+        combo_preset = ttk.Combobox(container, textvariable=self.var_preset, state="readonly")
+        combo_preset['values'] = ("",) + ENCODER_PRESETS
+        combo_preset.grid(row=13, column=1, sticky="ew", padx=5)
+
+        ttk.Label(container, text="CRF (качество)").grid(row=14, column=0, sticky="e", padx=5, pady=5)
+        self.var_crf = ttk.StringVar()
+        ttk.Entry(container, textvariable=self.var_crf, width=6, validate="key", validatecommand=vcmd).grid(
+            row=14, column=1, sticky="w", padx=5)
+
         container.columnconfigure(1, weight=1)
 
         btn_frame = ttk.Frame(wrapper, padding=20)
@@ -187,6 +201,8 @@ class SettingsWindow(ttk.Toplevel):
         self.var_vcodec.set(p.video_codec)
         self.var_acodec.set(p.audio_codec)
         self.var_fps.set(p.fps)
+        self.var_preset.set(p.preset)
+        self.var_crf.set("" if p.crf is None else str(p.crf))
         if p.bitrate and p.bitrate.endswith("M"):
             self.var_bitrate.set(p.bitrate[:-1])
         else:
@@ -213,16 +229,25 @@ class SettingsWindow(ttk.Toplevel):
             bitrate_val = self.var_bitrate.get()
             if bitrate_val.isdigit(): bitrate_val += "M"
 
-            new_profile = FormatProfile(
+            crf_val = self.var_crf.get().strip()
+            if crf_val and not 0 <= int(crf_val) <= 63: raise ValueError("CRF должен быть в диапазоне 0–63")
+
+            # replace сохраняет поля профиля, которых нет в окне (потоки, превью)
+            new_profile = replace(
+                self.current_settings.default_profile,
                 format=self.var_format.get().lower(),
                 video_codec=self.var_vcodec.get(),
                 audio_codec=self.var_acodec.get(),
                 resolution=full_resolution,
                 bitrate=bitrate_val,
-                fps=int(self.var_fps.get())
+                fps=int(self.var_fps.get()),
+                preset=self.var_preset.get(),
+                crf=int(crf_val) if crf_val else None
             )
 
-            new_settings = Settings(
+            # replace сохраняет поля, которых нет в окне (например, размер пула)
+            new_settings = replace(
+                self.current_settings,
                 output_path=self.var_output_path.get(),
                 hot_folder_enabled=self.var_hot_enabled.get(),
                 hot_folder_path=self.var_hot_path.get(),
@@ -230,9 +255,9 @@ class SettingsWindow(ttk.Toplevel):
                 default_profile=new_profile
             )
 
-            new_settings.save()
-            if hasattr(self.master, "reload_settings"):
-                self.master.reload_settings()
+            # Главное окно и горячая папка узнают об изменении через подписку на store
+            if not self.store.save(new_settings):
+                raise OSError("не удалось записать settings.json")
             CustomPopup(self, "Настройки", "Настройки успешно сохранены!", is_error=False)
 
         except Exception as e:
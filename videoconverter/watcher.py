@@ -0,0 +1,309 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+
+# Константы inotify из <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+Root = Tuple[Path, bool]  # папка и нужно ли следить за вложенными
+
+# Папку, измененную незадолго до ее чтения, перечитываем и на следующем проходе:
+# файл, созданный в тот же квант времени, не сдвинет ее mtime
+RACY_NS = 2_000_000_000
+
+
+@dataclass
+class FileEvent:
+    path: Path
+    # True, если система сообщила о завершении записи (close-write / перемещение в папку)
+    confirmed: bool = False
+
+
+def _as_roots(folders: Union[Path, Iterable[Root]]) -> Tuple[Root, ...]:
+    if isinstance(folders, Path):
+        return ((folders, False),)
+    return tuple((Path(folder), recursive) for folder, recursive in folders)
+
+
+@dataclass
+class _DirState:
+    mtime_ns: int
+    read_ns: int  # когда папка была прочитана (время по часам системы, как и mtime)
+    recursive: bool
+    files: Set[str]
+    subdirs: Set[str]
+
+
+class DirectoryIndex:
+    """
+    Известные папки и файлы под корнями наблюдения.
+    Повторный обход перечитывает только папки, у которых сменился mtime (файл появился,
+    исчез или переименован): большое дерево не обходится целиком на каждом проходе.
+    """
+
+    def __init__(self, roots: Iterable[Root]):
+        self.roots = tuple(roots)
+        self._dirs: Dict[Path, _DirState] = {}
+
+    def __contains__(self, directory: Path) -> bool:
+        return directory in self._dirs
+
+    def __len__(self) -> int:
+        return len(self._dirs)
+
+    def directories(self) -> List[Root]:
+        return [(directory, state.recursive) for directory, state in self._dirs.items()]
+
+    def scan(self) -> List[Path]:
+        """Файлы, появившиеся с прошлого обхода (при первом обходе — все)."""
+        stale = [root for root in self.roots if root[0] not in self._dirs]
+        for directory, state in list(self._dirs.items()):
+            if directory not in self._dirs:
+                continue  # удалена вместе с родителем
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                self._forget(directory)
+                continue
+            if mtime != state.mtime_ns or state.mtime_ns >= state.read_ns - RACY_NS:
+                stale.append((directory, state.recursive))
+
+        new_files: List[Path] = []
+        while stale:
+            directory, recursive = stale.pop()
+            new_files.extend(self._read(directory, recursive, stale))
+        return new_files
+
+    def _read(self, directory: Path, recursive: bool, stale: List[Root]) -> List[Path]:
+        files: Set[str] = set()
+        subdirs: Set[str] = set()
+        read_ns = time.time_ns()
+        try:
+            mtime = os.stat(directory).st_mtime_ns  # до чтения: изменения во время чтения заметим в следующий раз
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.is_file(follow_symlinks=False):
+                        files.add(entry.name)
+                    elif recursive and entry.is_dir(follow_symlinks=False):
+                        subdirs.add(entry.name)
+        except OSError:
+            self._forget(directory)
+            return []
+        old = self._dirs.get(directory)
+        self._dirs[directory] = _DirState(mtime, read_ns, recursive, files, subdirs)
+        old_files, old_subdirs = (old.files, old.subdirs) if old else (set(), set())
+        for name in old_subdirs - subdirs:
+            self._forget(directory / name)
+        stale.extend((directory / name, True) for name in subdirs - old_subdirs)
+        return [directory / name for name in sorted(files - old_files)]
+
+    def _forget(self, directory: Path) -> None:
+        for known in [d for d in self._dirs if d == directory or directory in d.parents]:
+            del self._dirs[known]
+
+
+class FolderWatcher(ABC):
+    """
+    Базовый класс наблюдателя за одной или несколькими папками (с вложенными или без):
+    poll() возвращает новые или дописанные файлы. Недописанные файлы ждут в ReadinessTracker.
+    """
+
+    backend = "base"
+
+    def __init__(self, folders: Union[Path, Iterable[Root]]):
+        self.roots = _as_roots(folders)
+        self.alive = True
+        self._initial_done = False
+        self._index = DirectoryIndex(self.roots)
+
+    def poll(self, timeout: float) -> List[FileEvent]:
+        if not self._initial_done:
+            # Файлы, лежавшие в папке до запуска, проверяем как неподтвержденные
+            self._initial_done = True
+            return [FileEvent(p) for p in self._scan()]
+        return self._wait(timeout)
+
+    def close(self) -> None:
+        self.alive = False
+
+    def _scan(self) -> List[Path]:
+        files = self._index.scan()
+        if any(root not in self._index for root, _ in self.roots):
+            self.alive = False  # корень удален или недоступен — наблюдатель пересоздадут
+        return files
+
+    @abstractmethod
+    def _wait(self, timeout: float) -> List[FileEvent]:
+        """Ждет изменений не дольше timeout и возвращает события по файлам."""
+
+
+class PollingWatcher(FolderWatcher):
+    """Запасной вариант: периодически перечитывает папки, у которых изменился mtime."""
+
+    backend = "polling"
+
+    def __init__(self, folders: Union[Path, Iterable[Root]], interval: float = 3.0):
+        super().__init__(folders)
+        self.interval = interval
+        self._last_scan = 0.0
+
+    def _scan(self) -> List[Path]:
+        self._last_scan = time.monotonic()
+        return super()._scan()
+
+    def _wait(self, timeout: float) -> List[FileEvent]:
+        remaining = self.interval - (time.monotonic() - self._last_scan)
+        if remaining > 0:
+            if remaining > timeout:
+                time.sleep(timeout)
+                return []
+            time.sleep(remaining)
+        return [FileEvent(p) for p in self._scan()]
+
+
+class _Inotify:
+    """Минимальная обертка над inotify через ctypes (без сторонних зависимостей)."""
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def add_watch(self, path: Path, mask: int) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(str(path)), ctypes.c_uint32(mask))
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), str(path))
+        return wd
+
+    def remove_watch(self, wd: int) -> None:
+        self._libc.inotify_rm_watch(self.fd, wd)  # ошибку (watch уже снят) игнорируем
+
+    def read(self, timeout: float) -> List[Tuple[int, int, str]]:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            raw_name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            events.append((wd, mask, os.fsdecode(raw_name)))
+        return events
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class InotifyWatcher(FolderWatcher):
+    """
+    Событийный наблюдатель (Linux): реагирует на завершение записи и перемещение файлов в папку.
+    В рекурсивных корнях следит за каждой вложенной папкой и подключает новые по мере появления.
+    """
+
+    backend = "inotify"
+    MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF
+
+    def __init__(self, folders: Union[Path, Iterable[Root]]):
+        super().__init__(folders)
+        self._inotify = _Inotify()
+        self._watches: Dict[int, Path] = {}
+        self._watched: Dict[Path, int] = {}
+        try:
+            for root, recursive in self.roots:
+                self._watch(root, recursive)
+        except OSError:
+            self._inotify.close()
+            raise
+
+    def _watch(self, directory: Path, recursive: bool) -> None:
+        wd = self._inotify.add_watch(directory, self.MASK | (IN_CREATE if recursive else 0))
+        self._watches[wd] = directory
+        self._watched[directory] = wd
+
+    def _unwatch(self, wd: int) -> None:
+        directory = self._watches.pop(wd, None)
+        if directory is not None:
+            self._watched.pop(directory, None)
+            if any(directory == root for root, _ in self.roots):
+                self.alive = False
+
+    def _scan(self) -> List[Path]:
+        files = super()._scan()
+        for directory, recursive in self._index.directories():
+            if directory not in self._watched:
+                try:
+                    self._watch(directory, recursive)
+                except OSError as e:
+                    # Например, исчерпан fs.inotify.max_user_watches
+                    print(f"[WARN] Не удалось следить за {directory}: {e}")
+        return files
+
+    def _wait(self, timeout: float) -> List[FileEvent]:
+        result = []
+        rescan = False
+        for wd, mask, name in self._inotify.read(timeout):
+            if mask & IN_Q_OVERFLOW:
+                rescan = True  # очередь событий переполнилась — перечитываем изменившиеся папки
+            elif mask & IN_IGNORED:
+                self._unwatch(wd)
+            elif mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                self._inotify.remove_watch(wd)  # у перемещенной папки путь уже другой
+                self._unwatch(wd)
+                rescan = True
+            elif mask & IN_ISDIR:
+                rescan = True  # новая вложенная папка: подключаем ее и забираем то, что уже успели положить
+            elif name and mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and wd in self._watches:
+                result.append(FileEvent(self._watches[wd] / name, confirmed=True))
+        if rescan and self.alive:
+            result.extend(FileEvent(p) for p in self._scan())
+        return result
+
+    def close(self) -> None:
+        super().close()
+        self._inotify.close()
+
+
+def inotify_available() -> bool:
+    return sys.platform.startswith("linux")
+
+
+def create_watcher(folders: Union[Path, Iterable[Root]], backend: Optional[str] = None) -> FolderWatcher:
+    """Создает inotify-наблюдатель, а если он недоступен — опрос папок."""
+    if backend != "polling" and inotify_available():
+        try:
+            return InotifyWatcher(folders)
+        except (OSError, AttributeError) as e:
+            print(f"[WARN] inotify недоступен, используем опрос папки: {e}")
+    return PollingWatcher(folders)